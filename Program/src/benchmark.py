@@ -0,0 +1,368 @@
+"""
+Micro-benchmarks of the scoring and categorization hot paths.
+
+Each benchmark is timed on synthetic scale-ups of data.csv and
+food_data.csv (the rows repeated 1x, 10x, 100x by default) and reported
+as JSON, keyed by benchmark name and parameters, e.g.
+"user_data_round_trip[history=100,cache=warm]". Pass a previous
+report as --baseline to compare against it; slowdowns above the tolerance
+are listed as regressions and make the run exit with status 1.
+
+Run from the src directory, like the servers:
+
+    python benchmark.py --output baseline.json
+    python benchmark.py --baseline baseline.json --output current.json
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import timeit
+
+import numpy as np
+import pandas as pd
+import sklearn
+from sklearn.preprocessing import LabelEncoder
+
+from compact_model import CompactTextClassifier
+from food_table import load_food_table
+from model import load_training_data, train_model
+from rating import FOOD_DATA_PATH, load_or_fit_pipeline, rate_food
+from rating_store import RatingStore
+
+# Bump when benchmarks change what they measure, so old baselines are not compared
+BENCHMARK_FORMAT = 1
+
+DEFAULT_SCALES = [1, 10, 100]
+DEFAULT_HISTORY_SIZES = [10, 100, 1000]
+DEFAULT_REPEAT = 5
+
+# Relative slowdown of a benchmark's median over the baseline reported as a regression
+DEFAULT_TOLERANCE = 0.10
+
+BENCHMARKS = [
+    'process_food_data',
+    'rate_food',
+    'rating_store_update',
+    'user_data_round_trip',
+    'personalized_learn',
+    'personalized_rebuild',
+    'sync_apply',
+    'pipeline_predict',
+    'compact_predict',
+    'predict_top3_food_groups',
+]
+
+
+def measure(function, repeat=DEFAULT_REPEAT):
+    """
+    Time function after one warm-up call. Each of the repeat runs calls it
+    enough times to take at least 0.2 seconds (see timeit.Timer.autorange).
+
+    Returns:
+    - Dictionary of per-call timings in seconds.
+    """
+    function()
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    times = [total / number for total in timer.repeat(repeat, number)]
+    return {
+        'median_s': statistics.median(times),
+        'min_s': min(times),
+        'mean_s': statistics.mean(times),
+        'max_s': max(times),
+        'calls_per_run': number,
+        'runs': repeat,
+    }
+
+
+def benchmark_key(name, **params):
+    return f"{name}[{','.join(f'{key}={value}' for key, value in params.items())}]"
+
+
+def scale_food_data(file_path, scale, output_dir):
+    """
+    Write food_data.csv with its rows repeated scale times, the repeated
+    foods get new IDs. Returns the path of the scaled CSV.
+    """
+    food_data = pd.read_csv(file_path, low_memory=False)
+    id_step = int(pd.to_numeric(food_data['ID']).max()) + 1
+    copies = []
+    for copy in range(scale):
+        copy_data = food_data.copy()
+        copy_data['ID'] = pd.to_numeric(copy_data['ID']) + copy * id_step
+        copies.append(copy_data)
+    scaled_path = os.path.join(output_dir, f'food_data_{scale}x.csv')
+    pd.concat(copies, ignore_index=True).to_csv(scaled_path, index=False)
+    return scaled_path
+
+
+def user_history(X, y, size):
+    """
+    A synthetic user history of size items, spread over the training categories.
+    """
+    return {f'{X[index % len(X)]} {index}': y[index % len(y)] for index in range(size)}
+
+
+def food_data_benchmarks(food_data_path, scales, work_dir, selected, repeat):
+    import food_rater
+    from predict_all import load_model_and_vectorizer, predict_top3_food_groups
+
+    results = {}
+    for scale in scales:
+        scaled_path = scale_food_data(food_data_path, scale, work_dir)
+        table_dir = os.path.join(work_dir, 'food_table')
+        pipeline_path = os.path.join(work_dir, f'rating_pipeline_{scale}x.json')
+
+        # After measure's warm-up call the CSV is converted and the rating pipeline
+        # fitted, so this times the server's path for an unchanged CSV
+        if 'process_food_data' in selected:
+            results[benchmark_key('process_food_data', scale=scale)] = measure(
+                lambda: food_rater.process_food_data(scaled_path, table_dir, pipeline_path), repeat)
+
+        food_table = load_food_table(scaled_path, table_dir)
+        if 'rate_food' in selected:
+            pipeline = load_or_fit_pipeline(food_table, pipeline_path=pipeline_path)
+            row = len(food_table.ids) // 2
+            profile = pipeline.normalize(np.asarray(food_table.nutrients[row:row + 1]))[0].tolist()
+            groups = [food_table.food_groups[code] if code >= 0 else None
+                      for code in food_table.food_group_codes[row]]
+            name = str(food_table.names[row])
+            results[benchmark_key('rate_food', scale=scale)] = measure(
+                lambda: rate_food(profile, name, *groups), repeat)
+
+        if 'rating_store_update' in selected:
+            results.update(rating_store_benchmarks(food_table, pipeline_path, scale, repeat))
+
+        if 'predict_top3_food_groups' in selected:
+            model, vectorizer = load_model_and_vectorizer()
+            names = pd.Series(food_table.names).str.lower()
+            results[benchmark_key('predict_top3_food_groups', scale=scale)] = measure(
+                lambda: predict_top3_food_groups(names, model, vectorizer), repeat)
+    return results
+
+
+def rating_store_benchmarks(food_table, pipeline_path, scale, repeat):
+    """
+    RatingStore.update of one food, as /update_foods does it: with the new
+    value inside the normalization bounds (only that row is re-rated) and
+    with a value that moves a bound (every row is re-rated).
+    """
+    store = RatingStore.from_table(food_table, load_or_fit_pipeline(food_table, pipeline_path=pipeline_path))
+    column = store.pipeline.nutrient_columns[0]
+    values = np.asarray(food_table.nutrients)[:, 0]
+    # A food whose value is no bound, toggled between two values that aren't either
+    food_id = str(food_table.ids[int(np.argsort(values)[len(values) // 2])])
+    inside_values = itertools.cycle(np.quantile(values, [0.25, 0.75]).tolist())
+    outside_values = itertools.cycle([values.max() * 2 + 1, values.max() * 4 + 2])
+
+    return {
+        benchmark_key('rating_store_update', scale=scale, bounds='unchanged'): measure(
+            lambda: store.update([{'ID': food_id, column: next(inside_values)}]), repeat),
+        benchmark_key('rating_store_update', scale=scale, bounds='moved'): measure(
+            lambda: store.update([{'ID': food_id, column: next(outside_values)}]), repeat),
+    }
+
+
+def grocery_benchmarks(scales, history_sizes, work_dir, selected, repeat):
+    # Keep the benchmark users out of the server's database
+    os.environ['GROCERY_DATABASE_URI'] = f"sqlite:///{os.path.join(work_dir, 'grocery_benchmark.db')}"
+    import grocery_server
+    grocery_server.logger.setLevel(logging.WARNING)
+
+    results = {}
+    X, y = load_training_data()
+    label_encoder = LabelEncoder().fit(y)
+    for scale in scales:
+        if 'pipeline_predict' in selected:
+            pipeline = train_model(X * scale, y * scale, label_encoder)
+            results[benchmark_key('pipeline_predict', scale=scale)] = measure(
+                lambda: pipeline.predict(['brown bread']), repeat)
+
+        if 'compact_predict' in selected:
+            compact = CompactTextClassifier.fit(X * scale, label_encoder.transform(y * scale))
+            results[benchmark_key('compact_predict', scale=scale)] = measure(
+                lambda: compact.predict(['brown bread']), repeat)
+
+    if selected & {'personalized_learn', 'personalized_rebuild'}:
+        results.update(personalization_benchmarks(grocery_server, X, y, history_sizes, selected, repeat))
+    if 'sync_apply' in selected:
+        results.update(sync_benchmarks(grocery_server, history_sizes, repeat))
+    if 'user_data_round_trip' in selected:
+        results.update(user_data_benchmarks(grocery_server, X, y, history_sizes, repeat))
+    return results
+
+
+def personalization_benchmarks(grocery_server, X, y, history_sizes, selected, repeat):
+    """
+    The user model updates: learn on a copy of a trained model, as /grocery/saveItem
+    does, and the background rebuild over the whole history.
+    """
+    results = {}
+    for size in history_sizes:
+        history = user_history(X, y, size)
+        if 'personalized_learn' in selected:
+            model = grocery_server.new_user_model()
+            model.rebuild(history)
+            items = itertools.cycle(zip(X, reversed(y)))
+
+            def learn():
+                item_name, category = next(items)
+                model.copy().learn(item_name, category)
+
+            results[benchmark_key('personalized_learn', history=size)] = measure(learn, repeat)
+
+        if 'personalized_rebuild' in selected:
+            results[benchmark_key('personalized_rebuild', history=size)] = measure(
+                lambda: grocery_server.new_user_model().rebuild(history), repeat)
+    return results
+
+
+def sync_benchmarks(grocery_server, list_sizes, repeat):
+    """
+    apply_sync_operation of a typical /grocery/sync batch on user data with
+    list_size items: add one, remove one, count the usage, rename a category.
+    """
+    results = {}
+    for size in list_sizes:
+        user_data = {
+            'items': [{'id': item_id, 'name': f'item {item_id}', 'category': 'Produce', 'checked': False}
+                      for item_id in range(size)],
+            'categories': list(grocery_server.initialCategories),
+            'categoryUsage': {'Produce': size},
+            'history': {f'item {item_id}': 'Produce' for item_id in range(size)},
+        }
+        operations = [
+            {'type': 'putItem', 'item': {'id': size, 'name': 'milk', 'category': 'Dairy', 'checked': False}},
+            {'type': 'removeItem', 'id': size // 2},
+            {'type': 'incrementCategoryUsage', 'category': 'Dairy', 'by': 1},
+            {'type': 'renameCategory', 'from': 'Produce', 'to': 'Fruit & Vegetables'},
+        ]
+
+        def apply():
+            # Operations never modify the lists and dicts they got, like the cached user data
+            synced = dict(user_data)
+            for operation in operations:
+                grocery_server.apply_sync_operation(synced, operation)
+
+        results[benchmark_key('sync_apply', items=size)] = measure(apply, repeat)
+    return results
+
+
+def user_data_benchmarks(grocery_server, X, y, history_sizes, repeat):
+    """
+    load_user_data + save_user_data of a user with a changed history item,
+    with the user data cache cleared before every load and with it warm.
+    """
+    results = {}
+    with grocery_server.app.app_context():
+        db = grocery_server.db
+        db.create_all()
+        for size in history_sizes:
+            user = grocery_server.User(username=f'benchmark-{size}', password_hash='-')
+            db.session.add(user)
+            db.session.commit()
+
+            model = grocery_server.new_user_model()
+            model.rebuild(user_history(X, y, size))
+            grocery_server.save_user_data(user.id, {'model': model, 'history': user_history(X, y, size)})
+
+            categories = itertools.cycle(sorted(set(y)))
+
+            def round_trip(cached):
+                if not cached:
+                    grocery_server.user_data_cache.invalidate(user.id)
+                user_data = grocery_server.load_user_data(user.id)
+                item = next(iter(user_data['history']))
+                user_data['history'][item] = next(categories)
+                grocery_server.save_user_data(user.id, user_data)
+
+            results[benchmark_key('user_data_round_trip', history=size, cache='cold')] = measure(
+                lambda: round_trip(False), repeat)
+            results[benchmark_key('user_data_round_trip', history=size, cache='warm')] = measure(
+                lambda: round_trip(True), repeat)
+    return results
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Print each benchmark's median next to the baseline's.
+
+    Returns:
+    - List of the keys that are slower than the baseline by more than tolerance.
+    """
+    regressions = []
+    print(f"{'benchmark':<70} {'baseline':>12} {'current':>12} {'ratio':>7}")
+    for key, timing in results.items():
+        base_timing = baseline.get(key)
+        if base_timing is None:
+            print(f"{key:<70} {'-':>12} {timing['median_s'] * 1000:>10.4g}ms {'new':>7}")
+            continue
+        ratio = timing['median_s'] / base_timing['median_s']
+        flag = ''
+        if ratio > 1 + tolerance:
+            regressions.append(key)
+            flag = '  REGRESSION'
+        print(f"{key:<70} {base_timing['median_s'] * 1000:>10.4g}ms {timing['median_s'] * 1000:>10.4g}ms "
+              f"{ratio:>7.2f}{flag}")
+    return regressions
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'sklearn': sklearn.__version__,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the scoring and categorization hot paths.")
+    parser.add_argument('--food-data', default=FOOD_DATA_PATH, help="food_data.csv to scale up")
+    parser.add_argument('--scales', type=int, nargs='+', default=DEFAULT_SCALES,
+                        help="Row multipliers of data.csv and food_data.csv")
+    parser.add_argument('--history-sizes', type=int, nargs='+', default=DEFAULT_HISTORY_SIZES,
+                        help="User history and list sizes for the user model, sync and user data benchmarks")
+    parser.add_argument('--only', nargs='+', choices=BENCHMARKS, default=BENCHMARKS, help="Benchmarks to run")
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help="Timed runs per benchmark")
+    parser.add_argument('--output', help="Write the results as JSON to this path")
+    parser.add_argument('--baseline', help="JSON results of an earlier run to compare against")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help="Relative slowdown over the baseline reported as a regression")
+    args = parser.parse_args()
+
+    selected = set(args.only)
+    with tempfile.TemporaryDirectory() as work_dir:
+        results = {}
+        if selected & {'process_food_data', 'rate_food', 'rating_store_update', 'predict_top3_food_groups'}:
+            results.update(food_data_benchmarks(args.food_data, args.scales, work_dir, selected, args.repeat))
+        if selected & {'user_data_round_trip', 'pipeline_predict', 'compact_predict', 'personalized_learn',
+                       'personalized_rebuild', 'sync_apply'}:
+            results.update(grocery_benchmarks(args.scales, args.history_sizes, work_dir, selected, args.repeat))
+
+    report = {'format': BENCHMARK_FORMAT, 'environment': environment(), 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('format') != BENCHMARK_FORMAT:
+            sys.exit(f"Baseline {args.baseline} has benchmark format {baseline.get('format')}, "
+                     f"expected {BENCHMARK_FORMAT}")
+        regressions = compare(results, baseline['results'], args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regression(s) over {args.tolerance:.0%}")
+            sys.exit(1)
+    elif not args.output:
+        print(json.dumps(report, indent=2))
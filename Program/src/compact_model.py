@@ -0,0 +1,172 @@
+import re
+
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+from sklearn.linear_model import LogisticRegression
+from sklearn.utils import murmurhash3_32
+
+# Size of the hashed feature space. Only the buckets seen in training are stored,
+# so this bounds collisions, not model size
+DEFAULT_N_FEATURES = 2 ** 18
+
+# Same tokens as the default TfidfVectorizer: words of two or more characters
+TOKEN_PATTERN = re.compile(r'(?u)\b\w\w+\b')
+
+# Coefficient storage formats
+QUANTIZATIONS = ('int8', 'float32')
+
+
+class CompactTextClassifier:
+    """
+    Text classifier with a hashed feature space and quantized coefficients,
+    a compact alternative to a TfidfVectorizer + LogisticRegression pipeline.
+
+    Tokens are hashed into n_features buckets, so there is no vocabulary to
+    store. Only the buckets seen in training are kept: their sorted indices,
+    IDF weights and one coefficient row each, as int8 with one float32 scale
+    per class (or as float32). Prediction is pure NumPy: hash the tokens, look
+    the buckets up with a binary search, and take one small dot product,
+    without sklearn's pipeline overhead.
+
+    Fit with fit(). predict returns classes_, which callers may relabel like
+    a LogisticRegression's.
+    """
+
+    def __init__(self, features, idf, coef, coef_scale, intercept, classes, n_features=DEFAULT_N_FEATURES,
+                 stop_words=False, data_hash=None):
+        self.features = features        # (n_used,) int32, sorted hashed feature indices
+        self.idf = idf                  # (n_used,) float32
+        self.coef = coef                # (n_used, n_classes) int8 or float32
+        self.coef_scale = coef_scale    # (n_classes,) float32, multiplies coef
+        self.intercept = intercept      # (n_classes,) float32
+        self.classes_ = classes
+        self.n_features = n_features
+        self.stop_words = stop_words    # drop English stop words, like TfidfVectorizer(stop_words='english')
+        self.data_hash = data_hash      # hash of the training data, if the caller recorded it
+
+    @property
+    def classes_(self):
+        return self._classes
+
+    @classes_.setter
+    def classes_(self, classes):
+        self._classes = np.asarray(classes)
+
+    @classmethod
+    def fit(cls, texts, labels, n_features=DEFAULT_N_FEATURES, quantization='int8', stop_words=False,
+            max_iter=1000):
+        """
+        Train a LogisticRegression on TF-IDF weighted hashed features and keep
+        its coefficients for the buckets that occur in texts.
+        """
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"quantization must be one of {QUANTIZATIONS}, got {quantization!r}")
+
+        model = cls(None, None, None, None, None, [], n_features, stop_words)
+
+        # Keep the buckets that occur in texts, with smoothed IDF weights as
+        # TfidfTransformer computes them
+        model.features = np.unique(np.concatenate([model.hash_tokens(text) for text in texts]))
+        _, positions, _ = model._term_counts(texts)
+        document_frequency = np.bincount(positions, minlength=len(model.features))
+        model.idf = np.log((1 + len(texts)) / (1 + document_frequency)) + 1
+
+        rows, positions, values = model._tfidf(texts)
+        tfidf = sparse.csr_matrix((values, (rows, positions)), shape=(len(texts), len(model.features)))
+
+        classifier = LogisticRegression(max_iter=max_iter)
+        classifier.fit(tfidf, labels)
+
+        coef = classifier.coef_.T
+        if quantization == 'int8':
+            coef_scale = np.abs(coef).max(axis=0) / 127
+            coef_scale[coef_scale == 0] = 1
+            coef = np.round(coef / coef_scale).astype(np.int8)
+        else:
+            coef_scale = np.ones(coef.shape[1])
+
+        model.features = model.features.astype(np.int32)
+        model.idf = model.idf.astype(np.float32)
+        model.coef = np.ascontiguousarray(coef, dtype=np.int8 if quantization == 'int8' else np.float32)
+        model.coef_scale = coef_scale.astype(np.float32)
+        model.intercept = classifier.intercept_.astype(np.float32)
+        model.classes_ = classifier.classes_
+        return model
+
+    def hash_tokens(self, text):
+        """
+        Hashed bucket of every token of text, with repeats.
+        """
+        tokens = TOKEN_PATTERN.findall(text.lower())
+        if self.stop_words:
+            tokens = [token for token in tokens if token not in ENGLISH_STOP_WORDS]
+        return np.array([abs(murmurhash3_32(token, seed=0)) % self.n_features for token in tokens], dtype=np.int64)
+
+    def decision_function(self, texts):
+        rows, positions, values = self._tfidf(texts)
+        scores = np.zeros((len(texts), len(self.classes_)), dtype=np.float32)
+        np.add.at(scores, rows, self.coef[positions].astype(np.float32) * values[:, None])
+        return scores * self.coef_scale + self.intercept
+
+    def predict_proba(self, texts):
+        scores = self.decision_function(texts)
+        scores -= scores.max(axis=1, keepdims=True)
+        probabilities = np.exp(scores)
+        probabilities /= probabilities.sum(axis=1, keepdims=True)
+        return probabilities
+
+    def predict(self, texts):
+        return self.classes_[self.decision_function(texts).argmax(axis=1)]
+
+    @property
+    def nbytes(self):
+        """
+        Bytes of the stored arrays.
+        """
+        return sum(array.nbytes for array in (self.features, self.idf, self.coef, self.coef_scale, self.intercept))
+
+    def save(self, path):
+        """
+        Write the model as an .npz archive, without pickled objects.
+        """
+        extra = {} if self.data_hash is None else {'data_hash': np.array(self.data_hash)}
+        np.savez(path, features=self.features, idf=self.idf, coef=self.coef, coef_scale=self.coef_scale,
+                 intercept=self.intercept, classes=self.classes_,
+                 settings=np.array([self.n_features, int(self.stop_words)], dtype=np.int64), **extra)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as archive:
+            n_features, stop_words = archive['settings'].tolist()
+            data_hash = str(archive['data_hash']) if 'data_hash' in archive.files else None
+            return cls(archive['features'], archive['idf'], archive['coef'], archive['coef_scale'],
+                       archive['intercept'], archive['classes'], n_features, bool(stop_words), data_hash)
+
+    def _term_counts(self, texts):
+        """
+        (row, bucket position, count) of every stored bucket occurring in
+        texts, ordered by row. Buckets that did not occur in training are
+        dropped, as TfidfVectorizer drops unknown words.
+        """
+        hashed = [self.hash_tokens(text) for text in texts]
+        rows = np.repeat(np.arange(len(texts)), [len(buckets) for buckets in hashed])
+        buckets = np.concatenate(hashed) if hashed else np.empty(0, np.int64)
+
+        num_features = len(self.features)
+        if not num_features:
+            empty = np.empty(0, np.int64)
+            return empty, empty, empty
+        positions = np.minimum(np.searchsorted(self.features, buckets), num_features - 1)
+        known = self.features[positions] == buckets
+        keys, counts = np.unique(rows[known] * num_features + positions[known], return_counts=True)
+        return keys // num_features, keys % num_features, counts
+
+    def _tfidf(self, texts):
+        """
+        (row, bucket position, value) entries of the L2-normalized TF-IDF matrix of texts.
+        """
+        rows, positions, counts = self._term_counts(texts)
+        values = counts * self.idf[positions]
+        norms = np.sqrt(np.bincount(rows, values * values, minlength=len(texts)))
+        return rows, positions, (values / norms[rows]).astype(np.float32)
@@ -1,9 +1,33 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import AuthModal from './AuthModal';
 import CategoryList from './CategoryList';
 import { PlusCircle, X } from 'lucide-react';
 import { initialCategories } from '../data/categories';
 
+// Wait this long after the last keystroke before asking the server for a category
+const PREDICT_DEBOUNCE_MS = 250;
+
+// Batch the changes of this long into one /grocery/sync request
+const SYNC_DEBOUNCE_MS = 1000;
+
+// Wait this long before sending operations again after the server failed
+const SYNC_RETRY_MS = 5000;
+
+// Replace the entries with the same id as upserted ones, append new ones
+const mergeById = (entries, removed, upserted) => {
+  const removedIds = new Set(removed);
+  const merged = entries.filter((entry) => !removedIds.has(String(entry.id)));
+  upserted.forEach((entry) => {
+    const index = merged.findIndex((existing) => String(existing.id) === String(entry.id));
+    if (index === -1) {
+      merged.push(entry);
+    } else {
+      merged[index] = entry;
+    }
+  });
+  return merged;
+};
+
 const GroceryList = () => {
   const [categories, setCategories] = useState(initialCategories);
   const [items, setItems] = useState([]);
@@ -27,6 +51,19 @@ const GroceryList = () => {
   const [showAuthModal, setShowAuthModal] = useState(true);
   const [authUsername, setAuthUsername] = useState('');
 
+  // In-flight predict request, aborted when a newer one starts, and the sequence
+  // number that lets the server drop predictions superseded by a newer keystroke.
+  // The server compares sequence numbers per client id, so other tabs and
+  // devices of the same user don't supersede ours
+  const predictAbortController = useRef(null);
+  const predictRequestSeq = useRef(0);
+  const predictClientId = useRef(`${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`);
+
+  // Server revision our state is at, and the operations not yet sent to /grocery/sync
+  const syncRevision = useRef(null);
+  const pendingOperations = useRef([]);
+  const syncTimer = useRef(null);
+
   useEffect(() => {
     const savedToken = localStorage.getItem('authToken');
     const savedUsername = localStorage.getItem('username');
@@ -57,6 +94,10 @@ const GroceryList = () => {
       setCategories(data.categories);
       setCategoryUsage(data.categoryUsage);
       setUserHistory(data.userHistory);
+      syncRevision.current = data.revision;
+      if (pendingOperations.current.length > 0) {
+        syncState(token);
+      }
     } catch (error) {
       console.error('Error loading user data:', error);
     }
@@ -64,38 +105,92 @@ const GroceryList = () => {
   
   
 
-  const saveUserData = async () => {
-    const stateData = {
-      items,
-      categories,
-      categoryUsage,
-      userHistory
-    };
-  
+  // Apply the changes /grocery/sync or loadUserData?since= sent back; removals first
+  const applyChanges = (changes) => {
+    setItems((prevItems) => mergeById(prevItems, changes.items.removed, changes.items.upserted));
+    setCategories((prevCategories) =>
+      mergeById(prevCategories, changes.categories.removed, changes.categories.upserted)
+    );
+    setCategoryUsage((prevUsage) => {
+      const usage = { ...prevUsage };
+      changes.categoryUsage.removed.forEach((category) => delete usage[category]);
+      return { ...usage, ...changes.categoryUsage.upserted };
+    });
+    setUserHistory((prevHistory) => {
+      const replaced = new Set([
+        ...changes.userHistory.removed,
+        ...changes.userHistory.upserted.map((entry) => entry.item),
+      ]);
+      return [
+        ...prevHistory.filter((entry) => !replaced.has(entry.item.trim().toLowerCase())),
+        ...changes.userHistory.upserted,
+      ];
+    });
+  };
+
+  const queueOperations = (...operations) => {
+    pendingOperations.current.push(...operations);
+    clearTimeout(syncTimer.current);
+    syncTimer.current = setTimeout(() => syncState(), SYNC_DEBOUNCE_MS);
+  };
+
+  // Send the queued operations and apply everything that changed since our revision
+  const syncState = async (token = authToken) => {
+    clearTimeout(syncTimer.current);
+    if (syncRevision.current === null) return;  // Not loaded yet, sent after the load
+    const operations = pendingOperations.current;
+    pendingOperations.current = [];
+
     try {
-      const response = await fetch('http://127.0.0.1:5000/grocery/saveState', {
+      const response = await fetch('http://127.0.0.1:5000/grocery/sync', {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
-          Authorization: `Bearer ${authToken}`,
+          Authorization: `Bearer ${token}`,
         },
-        body: JSON.stringify(stateData),
+        body: JSON.stringify({ baseRevision: syncRevision.current, operations }),
       });
-  
+
+      if (response.status === 409) {
+        // The server can't send the changes since our revision: reload everything
+        // and send the operations again on top of it
+        pendingOperations.current = [...operations, ...pendingOperations.current];
+        await loadUserData(token);
+        return;
+      }
       if (!response.ok) {
-        console.error('Failed to save user data');
+        // Keep the operations; retry on server errors, the next change or logout resends them otherwise
+        pendingOperations.current = [...operations, ...pendingOperations.current];
+        console.error(`Failed to sync user data (status ${response.status})`);
+        if (response.status >= 500) {
+          clearTimeout(syncTimer.current);
+          syncTimer.current = setTimeout(() => syncState(token), SYNC_RETRY_MS);
+        }
+        return;
       }
+
+      const data = await response.json();
+      if (data.rejected && data.rejected.length > 0) {
+        console.error('Server rejected sync operations:', data.rejected);
+      }
+      syncRevision.current = data.revision;
+      applyChanges(data.changes);
     } catch (error) {
-      console.error('Error saving user data:', error);
+      // Keep the operations for the next sync
+      pendingOperations.current = [...operations, ...pendingOperations.current];
+      console.error('Error syncing user data:', error);
     }
   };
-  
-  
 
   useEffect(() => {
     if (newItemName.length > 2) {
-      fetchPredictedCategory(newItemName);
+      // Debounce: only predict once typing pauses
+      const timer = setTimeout(() => fetchPredictedCategory(newItemName), PREDICT_DEBOUNCE_MS);
+      return () => clearTimeout(timer);
     } else {
+      if (predictAbortController.current) {
+        predictAbortController.current.abort();
+      }
       setPredictedCategory('');
     }
   }, [newItemName]);
@@ -128,6 +223,15 @@ const GroceryList = () => {
 
   const fetchPredictedCategory = async (itemName) => {
     if (!itemName) return;
+
+    // Cancel the previous prediction, its answer would be for an outdated name
+    if (predictAbortController.current) {
+      predictAbortController.current.abort();
+    }
+    const controller = new AbortController();
+    predictAbortController.current = controller;
+    predictRequestSeq.current += 1;
+
     setIsLoading(true);
     try {
       const response = await fetch(`http://127.0.0.1:5000/grocery/predict`, {
@@ -136,25 +240,39 @@ const GroceryList = () => {
           'Content-Type': 'application/json',
           Authorization: `Bearer ${authToken}`,
         },
-        body: JSON.stringify({ itemName }),
+        body: JSON.stringify({
+          itemName,
+          requestSeq: predictRequestSeq.current,
+          clientId: predictClientId.current,
+        }),
+        signal: controller.signal,
       });
+      // 409: the server already has a newer prediction request from us
+      if (response.status === 409) return;
       const data = await response.json();
       setPredictedCategory(data.predictedCategory);
       setSelectedCategory('Automatic');
-      setIsLoading(false);
     } catch (error) {
-      console.error('Error fetching predicted category:', error);
-      setIsLoading(false);
+      if (error.name !== 'AbortError') {
+        console.error('Error fetching predicted category:', error);
+      }
+    } finally {
+      if (predictAbortController.current === controller) {
+        predictAbortController.current = null;
+        setIsLoading(false);
+      }
     }
   };
 
   const addItem = async () => {
-    let categoryToUse = selectedCategory === 'Automatic' ? predictedCategory : selectedCategory;
+    const categoryToUse = ((selectedCategory === 'Automatic' ? predictedCategory : selectedCategory) || '').trim();
 
-    if (newItemName && (categoryToUse || selectedCategory === 'Automatic')) {
+    // Wait for a prediction (or a chosen category) before adding the item
+    if (newItemName.trim() && categoryToUse) {
       if (!categories.find((category) => category.name === categoryToUse)) {
         const newCategory = { id: Date.now(), name: categoryToUse };
         setCategories((prevCategories) => [...prevCategories, newCategory]);
+        queueOperations({ type: 'putCategory', category: newCategory });
       }
 
       const newItem = {
@@ -164,6 +282,11 @@ const GroceryList = () => {
         checked: false,
       };
       setItems((prevItems) => [...prevItems, newItem]);
+      // saveItem records the history entry
+      queueOperations(
+        { type: 'putItem', item: newItem },
+        { type: 'incrementCategoryUsage', category: categoryToUse, by: 1 }
+      );
 
       setNewItemName('');
       setSelectedCategory('Automatic');
@@ -217,6 +340,7 @@ const GroceryList = () => {
       } else {
         const newCategory = { id: Date.now(), name: newCategoryName };
         setCategories((prevCategories) => [...prevCategories, newCategory]);
+        queueOperations({ type: 'putCategory', category: newCategory });
         setSelectedCategory(newCategoryName);
       }
 
@@ -231,13 +355,12 @@ const GroceryList = () => {
         item.id === itemId ? { ...item, checked: !item.checked } : item
       )
     );
-    setTimeout(() => {
-      setItems((prevItems) => prevItems.filter((item) => item.id !== itemId));
-    }, 800);
+    setTimeout(() => removeItem(itemId), 800);
   };
 
   const removeItem = (itemId) => {
     setItems((prevItems) => prevItems.filter((item) => item.id !== itemId));
+    queueOperations({ type: 'removeItem', id: itemId });
   };
 
   const toggleCategory = (categoryName) => {
@@ -287,6 +410,9 @@ const GroceryList = () => {
         )
       );
 
+      // One operation, the server moves the items, usage and history itself
+      queueOperations({ type: 'renameCategory', from: oldCategoryName, to: newCategoryName });
+
       setCategoryUpdates((prevUpdates) => ({
         ...prevUpdates,
         [oldCategoryName]: newCategoryName,
@@ -298,7 +424,8 @@ const GroceryList = () => {
   };
 
   const logout = async () => {
-    await saveUserData();  // Save the user's state before logging out
+    await syncState();  // Send the pending changes before logging out
+    syncRevision.current = null;
   
     setAuthToken(null);
     localStorage.removeItem('authToken');
@@ -398,7 +525,7 @@ const GroceryList = () => {
             <button
               onClick={addItem}
               className="bg-red-500 text-white p-2 rounded"
-              disabled={!newItemName || (selectedCategory === 'Automatic' && !predictedCategory)}
+              disabled={!newItemName.trim() || (selectedCategory === 'Automatic' && !predictedCategory)}
             >
               Add Item
             </button>
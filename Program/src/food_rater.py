@@ -1,111 +1,287 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS  # Import CORS
-import pandas as pd
-from sklearn.preprocessing import MinMaxScaler
+import hmac
+import math
+import os
+import threading
+
+from food_search import FoodSearchIndex
+from log_pipeline import configure_logging
+from metrics import MetricsRegistry, instrument_app
+from food_table import FOOD_TABLE_DIR, load_food_table
+from rating import FOOD_GROUP_COLUMNS, NUTRIENT_COLUMNS, RATING_PIPELINE_PATH, load_or_fit_pipeline
+from rating_index import RatingIndex
+from rating_store import RatingStore
+from substitutes import SubstituteIndex
+
+# Log records are written by a background thread, see log_pipeline
+configure_logging()
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
-def rate_food(nutrient_profile, food_name, food_group_1, food_group_2, food_group_3):
-    (calories, total_fat, saturated_fat, trans_fat, monounsaturated_fat, polyunsaturated_fat,
-     protein, carbs, sugars, fiber, calcium, iron, potassium, magnesium, 
-     vitamin_a, vitamin_c, vitamin_d, vitamin_e, vitamin_b12, folate) = nutrient_profile
-    
-    # Base nutrient rating
-    rating = (
-        0.15 * protein + 0.1 * fiber - 0.02 * carbs + 0.1 * total_fat - 0.35 * sugars + 
-        0.20 * calcium + 0.20 * iron + 0.05 * potassium + 0.05 * magnesium + 
-        0.15 * vitamin_a + 0.15 * vitamin_c + 0.15 * vitamin_d + 0.15 * vitamin_e +
-        0.15 * vitamin_b12 + 0.05 * folate
-    )
-    
-    
-    # Adjust the score based on healthy vs. unhealthy fats
-    rating += 0.1 * (monounsaturated_fat + polyunsaturated_fat)  # Reward healthy fats
-    rating -= 0.4 * (saturated_fat + trans_fat)  # Penalize unhealthy fats
-
-    # Add calorie control: slightly penalize extremely high-calorie foods
-    if calories < 60:
-        rating += 1
-    if calories > 250:
-        rating -= 0.1 * (calories - 500) / 100
-    
-    # Adjust score based on food groups (categories)
-    category_ratings = {
-        'Fruits': 3, 'Vegetables': 3, 'Snacks': -2, 'Sweets': -3, 'Fast Foods': -3,
-        'Fish': 3, 'Meats': 3, 'Dairy and Egg Products': 3, 'Baked Foods': 1, 
-        'Restaurant Foods': 0,  'Beans and Lentils': 3, 'Nuts and Seeds': 3,
-        'Grains and Pasta': -1,  'Spices and Herbs': 0, 'Fats and Oils': 0, 'Baby Foods' : +2
-    }
-    
-    if "Infant" in food_name and rating < 4:
-        rating += 7  # Reward for infant food
-    else:
-        food_groups = [food_group_1, food_group_2, food_group_3]
-        for group in food_groups:
-            if group in category_ratings:
-                rating += category_ratings[group]  # Add the category rating directly
-
-    # Ensure the rating is within 0-10
-    return max(0, min(10, rating))
-
-def process_food_data():
-    # Step 1: Read the CSV file with low_memory=False to avoid DtypeWarning
-    file_path = '../public/food_data.csv'
-    food_data = pd.read_csv(file_path, low_memory=False)
-
-    # Step 2: Select relevant columns for macronutrients, vitamins, minerals, and fats
-    nutrient_columns = [
-        'Calories', 'Fat (g)', 'Saturated Fats (g)', 'Trans Fatty Acids (g)',
-        'Fatty acids, total monounsaturated (mg)', 'Fatty acids, total polyunsaturated (mg)', 
-        'Protein (g)', 'Carbohydrate (g)', 'Sugars (g)', 'Fiber (g)', 
-        'Calcium (mg)', 'Iron, Fe (mg)', 'Potassium, K (mg)', 'Magnesium (mg)', 
-        'Vitamin A, RAE (mcg)', 'Vitamin C (mg)', 'Vitamin D (mcg)', 'Vitamin E (Alpha-Tocopherol) (mg)', 
-        'Vitamin B-12 (mcg)', 'Folate (B9) (mcg)'
-    ]
-
-    # Step 3: Convert selected columns to numeric, forcing errors to NaN
-    for col in nutrient_columns:
-        food_data[col] = pd.to_numeric(food_data[col], errors='coerce')
-
-    food_data[nutrient_columns] = food_data[nutrient_columns].fillna(0)
-
-    # Step 6: Normalize the data for all items
-    scaler = MinMaxScaler(feature_range=(0, 10))
-    normalized_nutrients = scaler.fit_transform(food_data[nutrient_columns])
-
-    # Step 7: Apply the rating function to all food items
-    food_data['Rating'] = [
-        rate_food(profile, food_name, group1, group2, group3) 
-        for profile, food_name, group1, group2, group3 in zip(
-            normalized_nutrients, food_data['name'], 
-            food_data['Predicted Food Group 1'], 
-            food_data['Predicted Food Group 2'], 
-            food_data['Predicted Food Group 3'])
-    ]
-
-    # Step 8: Scale ratings to a 0-10 range
-    max_rating = food_data['Rating'].max()
-    food_data['Scaled Rating'] = food_data['Rating'] / max_rating * 10
-
-    return food_data
+FOOD_DATA_PATH = '../public/food_data.csv'
+
+# In-memory ratings of every food with their sorted, substitute and search
+# indexes, rebuilt when the CSV changes and updated in place by /add_foods and
+# /update_foods
+rating_store = None
+rating_index = None
+substitute_index = None
+search_index = None
+rating_store_mtime = None
+rating_store_lock = threading.Lock()
+
+# Most foods a single /top_foods or /foods_by_rating page returns
+MAX_PAGE_SIZE = 1000
+
+# Most foods and substitutes per food a single /substitutes request can ask for
+MAX_SUBSTITUTE_QUERIES = 100
+MAX_SUBSTITUTES = 50
+
+# Most matches a single /search_foods request returns
+MAX_SEARCH_RESULTS = 100
+
+# Environment variable holding the token /add_foods and /update_foods require,
+# sent as "Authorization: Bearer <token>". Both routes are disabled without it
+ADMIN_TOKEN_ENV = 'FOOD_RATER_ADMIN_TOKEN'
+
+# Prometheus metrics served at /metrics: per-route request counts and latencies,
+# plus rating store rebuilds and in-place updates
+metrics = MetricsRegistry()
+instrument_app(app, metrics, 'food_rater')
+rating_store_rebuild_seconds = metrics.histogram(
+    'food_rater_rating_store_rebuild_seconds', 'Duration of full rating store and index rebuilds.')
+rating_store_updates = metrics.counter(
+    'food_rater_rating_store_updates_total', 'In-place rating store updates by operation and whether every '
+    'food was rescored.', ('operation', 'full_rebuild'))
+metrics.gauge('food_rater_foods', 'Foods in the rating store.',
+              lambda: len(rating_store) if rating_store is not None else 0)
+
+def process_food_data(file_path=FOOD_DATA_PATH, table_dir=FOOD_TABLE_DIR, pipeline_path=RATING_PIPELINE_PATH):
+    """
+    Load the food table (converting the CSV only when it changed) and add the
+    'Rating' and 'Scaled Rating' columns with the shared rating pipeline.
+    table_dir and pipeline_path default to the server's own models directory.
+    """
+    food_table = load_food_table(file_path, table_dir)
+    food_data = food_table.frame()
+    pipeline = load_or_fit_pipeline(food_table, food_data, pipeline_path)
+    return pipeline.score(food_data, food_table.nutrients)
+
+def build_rating_store(file_path=FOOD_DATA_PATH):
+    """
+    Build the rating store for the food data CSV with the shared rating pipeline.
+    """
+    food_table = load_food_table(file_path)
+    return RatingStore.from_table(food_table, load_or_fit_pipeline(food_table))
+
+def get_rating_store():
+    """
+    Return the rating store, rebuilding it only when the food data CSV has changed.
+    """
+    global rating_store, rating_index, substitute_index, search_index, rating_store_mtime
+
+    mtime = os.stat(FOOD_DATA_PATH).st_mtime_ns
+    if mtime != rating_store_mtime:
+        with rating_store_lock:
+            # Another request may have rebuilt the store while we were waiting
+            if mtime != rating_store_mtime:
+                with rating_store_rebuild_seconds.time():
+                    rating_store = build_rating_store(FOOD_DATA_PATH)
+                    rating_index = RatingIndex(rating_store)
+                    substitute_index = SubstituteIndex(rating_store)
+                    search_index = FoodSearchIndex(rating_store)
+                rating_store_mtime = mtime
+                app.logger.info(f"Rating store built with {len(rating_store)} foods.")
+    return rating_store
 
 @app.route('/get_food_rating', methods=['GET'])
 def get_food_rating():
     food_id = request.args.get('food_id')  # Get food_id from the query parameters
 
-    # Process all food data (this can be optimized to avoid re-reading the CSV every time)
-    food_data = process_food_data()
-
-    # Filter the DataFrame to get the food item by ID
-    filtered_data = food_data[food_data['ID'].astype(str) == food_id]  # Assuming food_id is a string
+    # Look the food item up in the precomputed ratings
+    rating = get_rating_store().get(food_id)
 
-    if filtered_data.empty:
+    if rating is None:
         return jsonify({"error": "Food item not found."}), 404
 
     # Return the scaled rating for the food item
-    rating = filtered_data['Scaled Rating'].values[0]
     return jsonify({"food_id": food_id, "scaled_rating": rating})
 
+def ranked_foods_response(low, high):
+    """
+    Page of the foods rated between low and high, highest first, filtered by
+    the 'group' and 'exclude' query parameters and paginated by 'offset' and
+    'limit'.
+    """
+    try:
+        offset = max(0, int(request.args.get('offset', 0)))
+        limit = max(0, min(int(request.args.get('limit', 10)), MAX_PAGE_SIZE))
+    except ValueError:
+        return jsonify({"error": "offset and limit must be integers."}), 400
+
+    get_rating_store()
+    with rating_store_lock:
+        total, foods = rating_index.between(low, high, request.args.get('group'), offset, limit,
+                                            request.args.getlist('exclude'))
+    return jsonify({"total": total, "offset": offset, "foods": foods})
+
+@app.route('/top_foods', methods=['GET'])
+def top_foods():
+    """
+    Highest rated foods, e.g. /top_foods?group=Fruits&limit=10 or
+    /top_foods?exclude=Snacks&exclude=Sweets&offset=20.
+    """
+    return ranked_foods_response(None, None)
+
+@app.route('/foods_by_rating', methods=['GET'])
+def foods_by_rating():
+    """
+    Foods with a scaled rating between min and max (inclusive), highest first,
+    e.g. /foods_by_rating?min=5&max=8&group=Vegetables.
+    """
+    try:
+        low = float(request.args['min']) if 'min' in request.args else None
+        high = float(request.args['max']) if 'max' in request.args else None
+    except ValueError:
+        return jsonify({"error": "min and max must be numbers."}), 400
+    return ranked_foods_response(low, high)
+
+@app.route('/substitutes', methods=['GET'])
+def substitutes():
+    """
+    Healthier substitutes: for each food_id (repeat it for a batch), the k
+    foods with the most similar normalized nutrients that have a higher scaled
+    rating. same_group=true restricts them to the food's top predicted group.
+    """
+    food_ids = request.args.getlist('food_id')
+    same_group = request.args.get('same_group', 'false').lower() in ('1', 'true', 'yes')
+    try:
+        k = int(request.args.get('k', 5))
+    except ValueError:
+        return jsonify({"error": "k must be an integer."}), 400
+    if not food_ids or len(food_ids) > MAX_SUBSTITUTE_QUERIES or not 1 <= k <= MAX_SUBSTITUTES:
+        return jsonify({"error": f"Give 1 to {MAX_SUBSTITUTE_QUERIES} food_id parameters "
+                                 f"and k between 1 and {MAX_SUBSTITUTES}."}), 400
+
+    get_rating_store()
+    with rating_store_lock:
+        try:
+            results = substitute_index.substitutes(food_ids, k, same_group)
+        except KeyError as e:
+            return jsonify({"error": f"Food item {e.args[0]} not found."}), 404
+    return jsonify({"substitutes": dict(zip(food_ids, results))})
+
+@app.route('/search_foods', methods=['GET'])
+def search_foods():
+    """
+    Fuzzy food name search for autocomplete, e.g. /search_foods?q=appl&limit=10.
+    Returns the best matches with their ID, name, predicted food groups and
+    scaled rating.
+    """
+    query = request.args.get('q', '')
+    try:
+        limit = max(1, min(int(request.args.get('limit', 10)), MAX_SEARCH_RESULTS))
+    except ValueError:
+        return jsonify({"error": "limit must be an integer."}), 400
+
+    get_rating_store()
+    with rating_store_lock:
+        foods = search_index.search(query, limit)
+    return jsonify({"query": query, "foods": foods})
+
+def admin_authorized():
+    """
+    Whether the request carries the admin token set in ADMIN_TOKEN_ENV.
+    """
+    token = os.environ.get(ADMIN_TOKEN_ENV)
+    header = request.headers.get('Authorization', '')
+    return bool(token) and hmac.compare_digest(header.encode(), f'Bearer {token}'.encode())
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+def foods_error(foods, require_nutrients):
+    """
+    Why a /add_foods or /update_foods foods list is invalid, or None if it is
+    valid. Every food is an object with an ID; the nutrients it has must be
+    numbers, and require_nutrients (for new foods) requires all of them.
+    """
+    if not isinstance(foods, list) or not foods or not all(isinstance(food, dict) for food in foods):
+        return "foods must be a non-empty list of objects."
+    for food in foods:
+        food_id = food.get('ID')
+        if isinstance(food_id, bool) or not isinstance(food_id, (str, int)):
+            return "Every food needs an ID."
+        for col in NUTRIENT_COLUMNS:
+            if col in food and not is_number(food[col]):
+                return f"{col} of food {food_id} must be a number."
+            if col not in food and require_nutrients:
+                return f"Food {food_id} is missing {col}."
+        if 'name' in food and not isinstance(food['name'], str):
+            return f"name of food {food_id} must be a string."
+        for col in FOOD_GROUP_COLUMNS:
+            if col in food and food[col] is not None and not isinstance(food[col], str):
+                return f"{col} of food {food_id} must be a string or null."
+    return None
+
+@app.route('/add_foods', methods=['POST'])
+def add_foods():
+    """
+    Add foods to the rating store. Only the new foods are rated, unless one of
+    them moves a normalization bound. Returns the IDs whose scaled rating changed.
+    Changes are kept in memory until food_data.csv itself changes. Requires the
+    admin token.
+    """
+    if not admin_authorized():
+        return jsonify({"error": "Not authorized."}), 403
+    payload = request.get_json(silent=True)
+    foods = payload.get('foods') if isinstance(payload, dict) else None
+    error = foods_error(foods, require_nutrients=True)
+    if error:
+        return jsonify({"error": error}), 400
+
+    store = get_rating_store()
+    with rating_store_lock:
+        try:
+            result = store.add(foods)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        rating_store_updates.inc(operation='add', full_rebuild=str(result['full_rebuild']).lower())
+        rating_index.update(result['rescored'])
+        substitute_index.update([food['ID'] for food in foods], result['full_rebuild'])
+        search_index.update([food['ID'] for food in foods])
+    return jsonify(result)
+
+@app.route('/update_foods', methods=['POST'])
+def update_foods():
+    """
+    Update the given fields of foods in the rating store. Only the updated foods
+    are re-rated, unless a normalization bound moves. Returns the IDs whose
+    scaled rating changed. Requires the admin token.
+    """
+    if not admin_authorized():
+        return jsonify({"error": "Not authorized."}), 403
+    payload = request.get_json(silent=True)
+    foods = payload.get('foods') if isinstance(payload, dict) else None
+    error = foods_error(foods, require_nutrients=False)
+    if error:
+        return jsonify({"error": error}), 400
+
+    store = get_rating_store()
+    with rating_store_lock:
+        try:
+            result = store.update(foods)
+        except KeyError as e:
+            return jsonify({"error": f"Food item {e.args[0]} not found."}), 404
+        rating_store_updates.inc(operation='update', full_rebuild=str(result['full_rebuild']).lower())
+        rating_index.update(result['rescored'] + [food['ID'] for food in foods])
+        substitute_index.update([food['ID'] for food in foods], result['full_rebuild'])
+        search_index.update([food['ID'] for food in foods])
+    return jsonify(result)
+
 if __name__ == "__main__":
+    # Build the rating store once at startup instead of on the first request
+    get_rating_store()
     app.run(host='0.0.0.0', port=5000)
@@ -0,0 +1,119 @@
+import bisect
+
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import CountVectorizer
+
+# BM25 parameters for the character n-gram scores
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Added to a food's score for each query word that starts one of its words,
+# so autocomplete ("appl") ranks whole-word prefix matches first
+PREFIX_BOOST = 2.0
+
+# Character n-gram size of the fuzzy index
+NGRAM_SIZE = 3
+
+
+class FoodSearchIndex:
+    """
+    Fuzzy name search over the foods of a RatingStore.
+
+    Two indexes are built over the lowercased food names:
+    - a prefix index: the sorted word vocabulary (a flattened trie), where the
+      words starting with a prefix are one contiguous column range of a
+      food x word matrix, found with two binary searches;
+    - a character n-gram inverted index with BM25 weights, stored as a sparse
+      food x n-gram matrix, so a query scores every food by summing the
+      columns of its n-grams, which tolerates typos and partial words.
+
+    Ratings and food groups are read from the store at query time, so only
+    renames require update.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.rebuild()
+
+    def rebuild(self):
+        names = [name.lower() for name in self.store.names]
+        self._names = list(self.store.names)
+
+        # Character n-grams within word boundaries, weighted with BM25
+        self._ngram_vectorizer = CountVectorizer(analyzer='char_wb', ngram_range=(NGRAM_SIZE, NGRAM_SIZE),
+                                                 lowercase=True, dtype=np.float32)
+        counts = self._ngram_vectorizer.fit_transform(names).tocsr()
+        self._ngram_weights = self._bm25(counts).tocsc()
+
+        # Word vocabulary, sorted by the vectorizer, for prefix lookups
+        self._word_vectorizer = CountVectorizer(binary=True, lowercase=True, token_pattern=r'(?u)\b\w+\b',
+                                                dtype=np.float32)
+        self._words_of_food = self._word_vectorizer.fit_transform(names).tocsc()
+        self._words = list(self._word_vectorizer.get_feature_names_out())
+
+    def update(self, food_ids):
+        """
+        Rebuild the index if any of the given foods was added or renamed.
+        """
+        store = self.store
+        rows = [store.row_of[str(food_id)] for food_id in food_ids]
+        if any(row >= len(self._names) or store.names[row] != self._names[row] for row in rows):
+            self.rebuild()
+
+    def search(self, query, limit=10):
+        """
+        The best matching foods for query, best first.
+
+        Returns:
+        - List of food dicts with a 'score'.
+        """
+        query = query.lower().strip()
+        num_foods = self._ngram_weights.shape[0]
+        if not query or not num_foods:
+            return []
+
+        scores = np.zeros(num_foods, dtype=np.float32)
+        vocabulary = self._ngram_vectorizer.vocabulary_
+        columns = sorted({vocabulary[ngram] for ngram in self._ngram_vectorizer.build_analyzer()(query)
+                          if ngram in vocabulary})
+        if columns:
+            scores += np.asarray(self._ngram_weights[:, columns].sum(axis=1)).ravel()
+
+        for word in query.split():
+            start = bisect.bisect_left(self._words, word)
+            end = bisect.bisect_left(self._words, word + '\uffff')
+            if end > start:
+                has_prefix = np.asarray(self._words_of_food[:, start:end].sum(axis=1)).ravel() > 0
+                scores[has_prefix] += PREFIX_BOOST
+
+        limit = min(limit, num_foods)
+        candidates = np.argpartition(-scores, limit - 1)[:limit]
+        candidates = candidates[scores[candidates] > 0]
+
+        # Best score first, shorter names first on ties, like the analyzer UI orders its results
+        candidates = sorted(candidates, key=lambda row: (-scores[row], len(self._names[row]), self._names[row]))
+        store = self.store
+        return [
+            {
+                'food_id': store.ids[row],
+                'name': store.names[row],
+                'food_groups': store.food_groups[row],
+                'scaled_rating': store.get(store.ids[row]),
+                'score': float(scores[row]),
+            }
+            for row in candidates]
+
+    def _bm25(self, counts):
+        num_foods = counts.shape[0]
+        lengths = np.asarray(counts.sum(axis=1)).ravel()
+        average_length = lengths.mean() if num_foods else 0.0
+        document_frequency = np.bincount(counts.indices, minlength=counts.shape[1])
+        idf = np.log1p((num_foods - document_frequency + 0.5) / (document_frequency + 0.5)).astype(np.float32)
+
+        # tf * (k1 + 1) / (tf + k1 * (1 - b + b * length / average length)), per stored entry
+        rows = np.repeat(np.arange(num_foods), np.diff(counts.indptr))
+        norms = BM25_K1 * (1 - BM25_B + BM25_B * lengths[rows] / max(average_length, 1e-9))
+        tf = counts.data
+        weights = tf * (BM25_K1 + 1) / (tf + norms) * idf[counts.indices]
+        return sparse.csr_matrix((weights.astype(np.float32), counts.indices, counts.indptr), shape=counts.shape)
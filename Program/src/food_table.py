@@ -0,0 +1,128 @@
+import argparse
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from rating import BASE_DIR, FOOD_DATA_PATH, FOOD_GROUP_COLUMNS, NUTRIENT_COLUMNS, hash_file, read_food_data
+
+# Converted food tables live in one directory per CSV content hash
+FOOD_TABLE_DIR = os.path.join(BASE_DIR, 'models', 'food_table')
+
+# Bump when the converted layout changes, so tables written by older code are converted again
+FOOD_TABLE_FORMAT = 1
+
+
+class FoodTable:
+    """
+    Typed, columnar copy of food_data.csv: the nutrient columns as one float
+    matrix plus the ID, name and predicted food group columns.
+
+    The nutrient matrix is stored column-major, so memory-mapping it only pages
+    in the columns that are actually read and the rating engine can use its
+    columns without copying them.
+    """
+
+    def __init__(self, data_hash, ids, names, food_group_codes, food_groups, nutrients):
+        self.data_hash = data_hash
+        self.ids = ids
+        self.names = names
+        self.food_group_codes = food_group_codes  # (n, 3) indices into food_groups, -1 if missing
+        self.food_groups = food_groups
+        self.nutrients = nutrients  # (n, 20) in NUTRIENT_COLUMNS order
+
+    def __len__(self):
+        return len(self.ids)
+
+    def frame(self):
+        """
+        DataFrame of the ID, name and predicted food group columns, the shape
+        the rating pipeline expects next to the nutrient matrix.
+        """
+        food_data = pd.DataFrame({'ID': self.ids, 'name': self.names})
+        for group, col in enumerate(FOOD_GROUP_COLUMNS):
+            food_data[col] = pd.Categorical.from_codes(self.food_group_codes[:, group], self.food_groups)
+        return food_data
+
+
+def convert_food_data(file_path=FOOD_DATA_PATH, table_dir=FOOD_TABLE_DIR, data_hash=None):
+    """
+    Parse food_data.csv once and write it as a FoodTable under table_dir.
+    Tables of older versions of the CSV are removed.
+    """
+    if data_hash is None:
+        data_hash = hash_file(file_path)
+    food_data = read_food_data(file_path)
+
+    # Factorize the food groups of all three columns together, so they share one category list
+    groups = food_data[FOOD_GROUP_COLUMNS].astype(object)
+    food_group_codes, food_groups = pd.factorize(groups.to_numpy().ravel())
+    food_group_codes = food_group_codes.reshape(len(food_data), len(FOOD_GROUP_COLUMNS)).astype(np.int16)
+
+    # Write to a temporary directory first, then rename, so readers never see a partial table
+    os.makedirs(table_dir, exist_ok=True)
+    final_dir = os.path.join(table_dir, data_hash)
+    temp_dir = f'{final_dir}.tmp{os.getpid()}'
+    shutil.rmtree(temp_dir, ignore_errors=True)
+    os.makedirs(temp_dir)
+
+    nutrients = np.asfortranarray(food_data[NUTRIENT_COLUMNS].to_numpy(dtype=float))
+    np.save(os.path.join(temp_dir, 'nutrients.npy'), nutrients)
+    np.save(os.path.join(temp_dir, 'ids.npy'), food_data['ID'].to_numpy(dtype=str))
+    np.save(os.path.join(temp_dir, 'names.npy'), food_data['name'].astype(str).to_numpy(dtype=str))
+    np.save(os.path.join(temp_dir, 'food_groups.npy'), food_group_codes)
+    with open(os.path.join(temp_dir, 'meta.json'), 'w') as f:
+        json.dump({
+            'format': FOOD_TABLE_FORMAT,
+            'data_hash': data_hash,
+            'rows': len(food_data),
+            'nutrient_columns': NUTRIENT_COLUMNS,
+            'food_groups': [str(group) for group in food_groups],
+        }, f, indent=2)
+
+    shutil.rmtree(final_dir, ignore_errors=True)
+    os.replace(temp_dir, final_dir)
+
+    for entry in os.listdir(table_dir):
+        if entry != data_hash and '.tmp' not in entry:
+            shutil.rmtree(os.path.join(table_dir, entry), ignore_errors=True)
+    return final_dir
+
+
+def load_food_table(file_path=FOOD_DATA_PATH, table_dir=FOOD_TABLE_DIR, mmap_mode='r'):
+    """
+    Load the FoodTable for the current contents of file_path, converting the
+    CSV first if it has no up to date table. The nutrient matrix is
+    memory-mapped by default.
+    """
+    data_hash = hash_file(file_path)
+    path = os.path.join(table_dir, data_hash)
+
+    meta = None
+    if os.path.exists(os.path.join(path, 'meta.json')):
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+    if meta is None or meta.get('format') != FOOD_TABLE_FORMAT or meta['nutrient_columns'] != NUTRIENT_COLUMNS:
+        path = convert_food_data(file_path, table_dir, data_hash)
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+
+    return FoodTable(
+        data_hash,
+        np.load(os.path.join(path, 'ids.npy')),
+        np.load(os.path.join(path, 'names.npy')),
+        np.load(os.path.join(path, 'food_groups.npy')),
+        meta['food_groups'],
+        np.load(os.path.join(path, 'nutrients.npy'), mmap_mode=mmap_mode))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert food_data.csv to a columnar food table.")
+    parser.add_argument('--data', default=FOOD_DATA_PATH, help="Food data CSV to convert")
+    parser.add_argument('--output', default=FOOD_TABLE_DIR, help="Directory to write the food table to")
+    args = parser.parse_args()
+
+    path = convert_food_data(args.data, args.output)
+    print(f"Food table saved to {path}.")
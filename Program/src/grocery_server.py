@@ -1,15 +1,30 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-from sklearn.linear_model import LogisticRegression
 from sklearn.pipeline import make_pipeline
-from sklearn.preprocessing import LabelEncoder
-from sklearn.feature_extraction.text import TfidfVectorizer
-import pandas as pd
+import numpy as np
 import joblib
 import os
+import random
 import secrets
+import sklearn
+import sqlite3
+import threading
+import time
+
+from log_pipeline import configure_logging, dropped_records, log_payload
+from metrics import BYTE_BUCKETS, ROW_BUCKETS, MetricsRegistry, instrument_app
+from model import load_bundle
+from personalization import PersonalizedModel, item_features
+from prediction_cache import PredictionCache, prediction_key
+from request_collapsing import LatestRequests, SingleFlight
+from retrain_queue import RetrainQueue
+from user_cache import UserDataCache
 
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import delete, event, select, tuple_, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_jwt_extended import (
     JWTManager, create_access_token, jwt_required, get_jwt_identity
@@ -17,15 +32,15 @@ from flask_jwt_extended import (
 
 import logging
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Configure logging: records are written by a background thread, see log_pipeline
+configure_logging()
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 CORS(app)
 
-# Configure the SQLite database
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///grocery_app.db'
+# Configure the SQLite database, GROCERY_DATABASE_URI points it elsewhere (e.g. for benchmarks)
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('GROCERY_DATABASE_URI', 'sqlite:///grocery_app.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 #app.config['JWT_SECRET_KEY'] = secrets.token_hex(32)
 app.config['JWT_SECRET_KEY'] = 'your-very-secure-secret-key'
@@ -33,7 +48,23 @@ app.config['JWT_SECRET_KEY'] = 'your-very-secure-secret-key'
 db = SQLAlchemy(app)
 jwt = JWTManager(app)
 
-# Ensure the directory for user-specific data exists
+
+@event.listens_for(Engine, 'connect')
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    WAL lets requests read while another one writes, and writers wait for
+    each other instead of failing with "database is locked".
+    """
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.execute('PRAGMA busy_timeout=30000')
+        cursor.close()
+
+
+# Ensure the directory for user-specific data exists (files from before the
+# user state tables, migrated on first load)
 if not os.path.exists('user_data'):
     os.makedirs('user_data')
 
@@ -59,69 +90,719 @@ initialCategories = [
         { 'id': 15, 'name': 'Pasta & Grains' },
     ]
 
-# Load the Label Encoder if exists, else create and save
-def load_label_encoder():
-    label_encoder_path = 'models/label_encoder.pkl'
-    if os.path.exists(label_encoder_path):
-        label_encoder = joblib.load(label_encoder_path)
-        logger.info("LabelEncoder loaded from saved file.")
-    else:
-        # If not exists, create it from initial data
-        initial_data = pd.read_csv('data.csv')
-        y = initial_data['Category'].tolist()
-        label_encoder = LabelEncoder()
-        label_encoder.fit(y)
-        joblib.dump(label_encoder, label_encoder_path)
-        logger.info("LabelEncoder created from initial data and saved.")
-    return label_encoder
+# Load the base category model bundle built by `python model.py`. Training happens at
+# build time, so startup only memory-maps the fitted model and refuses stale bundles.
+model_bundle = load_bundle()
+base_model_version = model_bundle['version']
+if model_bundle['sklearn_version'] != sklearn.__version__:
+    logger.warning(f"Model bundle was built with scikit-learn {model_bundle['sklearn_version']}, "
+                   f"running {sklearn.__version__}. Consider rebuilding it with: python model.py")
+
+# Bundles built with `python model.py --compact` hold a CompactTextClassifier, which
+# vectorizes and predicts on its own with NumPy, instead of a vectorizer and classifier
+if model_bundle.get('compact'):
+    pipeline = model_bundle['classifier']
+else:
+    pipeline = make_pipeline(model_bundle['vectorizer'], model_bundle['classifier'])
+
+# Category names of the base pipeline's classes, fixed at build time
+base_classes = model_bundle['classes']
+logger.info(f"Initial model {base_model_version} loaded.")
+
+def new_user_model():
+    """
+    A user model with an empty correction layer, which predicts like the base pipeline.
+    """
+    return PersonalizedModel(pipeline, base_classes, base_version=base_model_version)
+
+# In-process cache of deserialized user data, so repeated requests only check the revision
+USER_CACHE_MAX_ENTRIES = 256
+USER_CACHE_MAX_BYTES = 256 * 1024 * 1024
+user_data_cache = UserDataCache(max_entries=USER_CACHE_MAX_ENTRIES, max_bytes=USER_CACHE_MAX_BYTES)
+
+# Cache of /grocery/predict results: shared by every user without personal
+# corrections, per user (and user model version) otherwise
+PREDICTION_CACHE_MAX_SHARED_ENTRIES = 100000
+PREDICTION_CACHE_MAX_USERS = 1024
+prediction_cache = PredictionCache(max_shared_entries=PREDICTION_CACHE_MAX_SHARED_ENTRIES,
+                                   max_users=PREDICTION_CACHE_MAX_USERS)
+
+# Concurrent identical predictions run the model once, and a client's keystroke
+# predictions superseded by a newer request (see 'requestSeq') are dropped
+# before the model runs
+predict_flights = SingleFlight()
+latest_predict_requests = LatestRequests()
+
+# Longest 'clientId' accepted with a 'requestSeq'
+MAX_CLIENT_ID_LENGTH = 64
+
+# Prometheus metrics served at /metrics: per-route request counts and latencies,
+# plus the internal operations that dominate request cost
+metrics = MetricsRegistry()
+instrument_app(app, metrics, 'grocery')
+user_state_load_seconds = metrics.histogram(
+    'grocery_user_state_load_seconds', 'Duration of load_user_data by where the data came from.', ('source',))
+user_state_load_bytes = metrics.histogram(
+    'grocery_user_state_load_bytes', 'Approximate bytes of user state read from the database.', buckets=BYTE_BUCKETS)
+user_state_save_seconds = metrics.histogram(
+    'grocery_user_state_save_seconds', 'Duration of save_user_data.')
+user_state_save_bytes = metrics.histogram(
+    'grocery_user_state_save_bytes', 'Approximate bytes of user state rows written per save.', buckets=BYTE_BUCKETS)
+sync_operations = metrics.counter(
+    'grocery_sync_operations_total', 'Operations received by /grocery/sync by type and whether they were applied '
+    'or rejected.', ('type', 'result'))
+user_state_conflicts = metrics.counter(
+    'grocery_user_state_conflicts_total', 'Saves rejected because the user state changed concurrently.')
+retrain_seconds = metrics.histogram(
+    'grocery_retrain_seconds', 'Duration of model retraining by kind.', ('kind',))
+retrain_latency_seconds = metrics.histogram(
+    'grocery_retrain_latency_seconds', 'Time from queueing a user model rebuild to its end, by result.',
+    ('result',))
+retrain_training_rows = metrics.histogram(
+    'grocery_retrain_training_rows', 'Training-set size of model retraining by kind.', ('kind',),
+    buckets=ROW_BUCKETS)
+model_predict_seconds = metrics.histogram(
+    'grocery_model_predict_seconds', 'Duration of user model predictions by endpoint.', ('endpoint',))
+predict_seconds = metrics.histogram(
+    'grocery_predict_seconds', 'Duration of /grocery/predict requests not answered from history, by whether the '
+    'prediction cache hit.', ('cache',))
+predicted_items = metrics.counter(
+    'grocery_predicted_items_total', 'Predicted items by endpoint and source (history, cache or model).',
+    ('endpoint', 'source'))
+metrics.gauge('grocery_retrain_queue_depth', 'Retrain jobs queued.', lambda: retrain_queue.stats()['queue_depth'])
+metrics.gauge('grocery_retrain_running', 'Retrain jobs running.', lambda: retrain_queue.stats()['running'])
+metrics.function_counter('grocery_retrain_jobs_submitted_total', 'Retrain jobs submitted.',
+                         lambda: retrain_queue.stats()['submitted'])
+metrics.function_counter('grocery_retrain_jobs_coalesced_total',
+                         'Retrain submissions coalesced into an already queued job.',
+                         lambda: retrain_queue.stats()['coalesced'])
+metrics.function_counter('grocery_retrain_jobs_completed_total', 'Retrain jobs completed.',
+                         lambda: retrain_queue.stats()['completed'])
+metrics.function_counter('grocery_retrain_jobs_failed_total', 'Retrain jobs that raised.',
+                         lambda: retrain_queue.stats()['failed'])
+metrics.gauge('grocery_prediction_cache_entries', 'Cached predictions, shared and per user.',
+              lambda: sum(prediction_cache.stats()[key] for key in ('shared_entries', 'user_entries')))
+metrics.function_counter('grocery_prediction_cache_hits_total', 'Prediction cache hits.',
+                         lambda: prediction_cache.hits)
+metrics.function_counter('grocery_prediction_cache_misses_total', 'Prediction cache misses.',
+                         lambda: prediction_cache.misses)
+metrics.function_counter('grocery_prediction_cache_invalidations_total', 'Per-user prediction cache invalidations.',
+                         lambda: prediction_cache.invalidations)
+metrics.function_counter('grocery_predictions_collapsed_total',
+                         'Predictions answered by an identical concurrent call instead of the model.',
+                         lambda: predict_flights.collapsed)
+metrics.function_counter('grocery_predictions_superseded_total',
+                         'Predict requests dropped because the client sent a newer one.',
+                         lambda: latest_predict_requests.superseded)
+metrics.gauge('grocery_log_records_dropped', 'Log records dropped because the log queue was full.',
+              dropped_records)
+metrics.gauge('grocery_user_cache_bytes', 'Approximate bytes of cached user data.',
+              lambda: user_data_cache.stats()['bytes'])
+
+# Locks around read-modify-write of a user's data. Users are striped over a
+# fixed set of locks, so memory doesn't grow with the number of users; users
+# sharing a stripe just take turns. Never hold two of them at once
+USER_LOCK_STRIPES = 64
+user_locks = [threading.Lock() for _ in range(USER_LOCK_STRIPES)]
+
+def user_lock(user_id):
+    return user_locks[hash(str(user_id)) % USER_LOCK_STRIPES]
 
-label_encoder = load_label_encoder()
+# User model
+class User(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    username = db.Column(db.String(100), nullable=False, unique=True)
+    password_hash = db.Column(db.String(128), nullable=False)
 
-# Load initial training data from CSV
-initial_data = pd.read_csv('data.csv')
+# User state, one table per part so a save only writes the rows that changed.
+# Every table is keyed by user first, so loading a user is an index range scan.
+class UserState(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    revision = db.Column(db.Integer, nullable=False)  # bumped by every save, see save_user_data
+    model_version = db.Column(db.Integer, nullable=False)
+    model_base_version = db.Column(db.String(64))
+    model_stale = db.Column(db.Boolean, nullable=False, default=False)
+
+class UserModelWeight(db.Model):
+    # One weight of the user's correction layer, see PersonalizedModel
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    feature = db.Column(db.Integer, primary_key=True)
+    category = db.Column(db.String(200), primary_key=True)
+    value = db.Column(db.Float, nullable=False)
+
+# The synced tables (see /grocery/sync) stamp every row with the revision that
+# last wrote it, so the changes since a revision are an index range scan
+class UserItem(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    item_key = db.Column(db.String(64), primary_key=True)  # the client's item id
+    position = db.Column(db.Integer, nullable=False)
+    data = db.Column(db.JSON, nullable=False)
+    revision = db.Column(db.Integer, nullable=False)
+    __table_args__ = (db.Index('ix_user_item_revision', 'user_id', 'revision'),)
+
+class UserCategory(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    category_key = db.Column(db.String(64), primary_key=True)  # the client's category id
+    position = db.Column(db.Integer, nullable=False)
+    data = db.Column(db.JSON, nullable=False)
+    revision = db.Column(db.Integer, nullable=False)
+    __table_args__ = (db.Index('ix_user_category_revision', 'user_id', 'revision'),)
+
+class UserCategoryUsage(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    category = db.Column(db.String(200), primary_key=True)
+    count = db.Column(db.Integer, nullable=False)
+    revision = db.Column(db.Integer, nullable=False)
+    __table_args__ = (db.Index('ix_user_category_usage_revision', 'user_id', 'revision'),)
+
+class UserHistory(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    item = db.Column(db.String(200), primary_key=True)
+    category = db.Column(db.String(200), nullable=False)
+    revision = db.Column(db.Integer, nullable=False)
+    __table_args__ = (db.Index('ix_user_history_revision', 'user_id', 'revision'),)
+
+class UserDeletion(db.Model):
+    # Tombstone of a row removed from a synced table, so deltas can report it
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    table_name = db.Column(db.String(64), primary_key=True)
+    row_key = db.Column(db.String(200), primary_key=True)
+    revision = db.Column(db.Integer, nullable=False)
+    __table_args__ = (db.Index('ix_user_deletion_revision', 'user_id', 'revision'),)
+
+# Row key columns of each user state table, after user_id
+USER_STATE_KEYS = {
+    UserModelWeight: ('feature', 'category'),
+    UserItem: ('item_key',),
+    UserCategory: ('category_key',),
+    UserCategoryUsage: ('category',),
+    UserHistory: ('item',),
+}
+
+# Tables sent to clients by /grocery/sync, by their name in sync responses
+SYNCED_TABLES = {
+    UserItem: 'items',
+    UserCategory: 'categories',
+    UserCategoryUsage: 'categoryUsage',
+    UserHistory: 'userHistory',
+}
+
+# Revisions a sync client may be behind before it has to load the full state
+# again; older tombstones are pruned every SYNC_PRUNE_INTERVAL revisions
+SYNC_HISTORY_REVISIONS = 1000
+SYNC_PRUNE_INTERVAL = 100
+
+# Approximate in-memory size of a user state row, for the user data cache
+USER_STATE_ROW_BYTES = 100
+
+# Rows per DELETE statement, below SQLite's bound parameter limit
+USER_STATE_DELETE_CHUNK = 300
+
+# Attempts of update_user_data before giving up on a user whose state keeps changing,
+# and the backoff step between attempts in seconds
+USER_STATE_SAVE_ATTEMPTS = 5
+USER_STATE_RETRY_DELAY = 0.02
+
+class UserStateConflict(Exception):
+    """
+    Raised by save_user_data when the user's state was saved by another
+    request since it was loaded.
+    """
 
-# Standardize the 'Item' column by converting to lowercase and stripping whitespace
-initial_data['Item'] = initial_data['Item'].str.lower().str.strip()
+def copy_user_data(user_data):
+    """
+    Copy user data so callers can modify it without touching the cached entry.
+    The model is shared, everything callers mutate in place is copied.
+    """
+    user_data = dict(user_data)
+    user_data['history'] = dict(user_data.get('history', {}))
+    return user_data
 
-X = initial_data['Item'].tolist()
-y = initial_data['Category'].tolist()
+def entry_key(entry, position):
+    return str(entry.get('id', f'#{position}'))
 
-# Use TF-IDF Vectorizer for text feature extraction
-tfidf_vectorizer = TfidfVectorizer()
+def user_state_rows(user_data):
+    """
+    The user data as {table: {row key: row values}}, the form save_user_data diffs.
+    Items and categories keep the positions they were stored at (user_data's
+    'positions') while their order allows it, so removing or appending one
+    doesn't rewrite the rows after it.
+    """
+    positions = user_data.get('positions', {})
+
+    def keyed(entries, name):
+        stored_positions = positions.get(name, {})
+        rows = {}
+        last_position = -1
+        for index, entry in enumerate(entries):
+            key = entry_key(entry, index)
+            position = stored_positions.get(key)
+            if position is None or position <= last_position:
+                position = last_position + 1
+            rows[(key,)] = {'position': position, 'data': entry}
+            last_position = position
+        return rows
+
+    rows = {
+        UserModelWeight: {(feature, category): {'value': float(value)}
+                          for feature, class_weights in user_data['model'].weights.items()
+                          for category, value in class_weights.items()},
+        UserItem: keyed(user_data.get('items', []), 'items'),
+        UserCategoryUsage: {(category,): {'count': count} for category, count in user_data.get('categoryUsage', {}).items()},
+        UserHistory: {(item,): {'category': category} for item, category in user_data.get('history', {}).items()},
+    }
+    if 'categories' in user_data:
+        rows[UserCategory] = keyed(user_data['categories'], 'categories')
+    return rows
 
-# Train initial model using TfidfVectorizer
-initial_model = LogisticRegression(max_iter=2000)
-pipeline = make_pipeline(tfidf_vectorizer, initial_model)
-pipeline.fit(X, label_encoder.transform(y))
-logger.info("Initial model trained.")
+def selected_user_state_rows(user_data, keys):
+    """
+    The rows of user_state_rows selected by keys, {table: values of its first
+    key column}, built without walking the rest of the state. Only the model
+    weight (by feature), category usage and history tables can be selected.
+    """
+    model_weights = user_data['model'].weights
+    category_usage = user_data.get('categoryUsage', {})
+    history = user_data.get('history', {})
+    rows = {}
+    if UserModelWeight in keys:
+        rows[UserModelWeight] = {(feature, category): {'value': float(value)}
+                                 for feature in keys[UserModelWeight]
+                                 for category, value in model_weights.get(feature, {}).items()}
+    if UserCategoryUsage in keys:
+        rows[UserCategoryUsage] = {(category,): {'count': category_usage[category]}
+                                   for category in keys[UserCategoryUsage] if category in category_usage}
+    if UserHistory in keys:
+        rows[UserHistory] = {(item,): {'category': history[item]} for item in keys[UserHistory] if item in history}
+    return rows
+
+def row_positions(rows):
+    """
+    {table name: {key: position}} of the item and category rows, see user_state_rows.
+    """
+    return {SYNCED_TABLES[table]: {row_key[0]: values['position'] for row_key, values in rows[table].items()}
+            for table in (UserItem, UserCategory) if table in rows}
 
-# User model
-class User(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(100), nullable=False, unique=True)
-    password_hash = db.Column(db.String(128), nullable=False)
+def user_data_size(user_data):
+    """
+    Approximate in-memory size of user data, from its row count.
+    """
+    row_count = (sum(len(class_weights) for class_weights in user_data['model'].weights.values())
+                 + len(user_data.get('items', [])) + len(user_data.get('categories', []))
+                 + len(user_data.get('categoryUsage', {})) + len(user_data.get('history', {})))
+    return USER_STATE_ROW_BYTES * row_count
 
-def load_user_data(user_id):
+def user_state_bytes(rows):
+    """
+    Approximate stored size of user state rows ({row key: row values}), for the metrics.
+    """
+    return sum(len(str(value)) for row_key, values in rows.items() for value in (*row_key, *values.values()))
+
+def read_user_state(user_id, state):
+    """
+    Read a user's data from the database, given their UserState row.
+    """
+    user_id = int(user_id)
+    weights = {}
+    for feature, category, value in db.session.execute(
+            select(UserModelWeight.feature, UserModelWeight.category, UserModelWeight.value)
+            .where(UserModelWeight.user_id == user_id)):
+        weights.setdefault(feature, {})[category] = value
+    items = db.session.execute(
+        select(UserItem.item_key, UserItem.position, UserItem.data)
+        .where(UserItem.user_id == user_id).order_by(UserItem.position)).all()
+    categories = db.session.execute(
+        select(UserCategory.category_key, UserCategory.position, UserCategory.data)
+        .where(UserCategory.user_id == user_id).order_by(UserCategory.position)).all()
+    category_usage = dict(db.session.execute(
+        select(UserCategoryUsage.category, UserCategoryUsage.count).where(UserCategoryUsage.user_id == user_id)).all())
+    history = dict(db.session.execute(
+        select(UserHistory.item, UserHistory.category).where(UserHistory.user_id == user_id)).all())
+
+    user_data = {
+        'model': PersonalizedModel(pipeline, base_classes, weights, state.model_version, base_model_version),
+        'history': history,
+        'items': [data for _, _, data in items],
+        'categoryUsage': category_usage,
+        # Learned against an older base model: rebuild on the next save or login
+        'model_stale': state.model_stale or state.model_base_version != base_model_version,
+        'revision': state.revision,
+        'positions': {'items': {key: position for key, position, _ in items},
+                      'categories': {key: position for key, position, _ in categories}},
+    }
+    if categories:
+        user_data['categories'] = [data for _, _, data in categories]
+    return user_data
+
+def load_legacy_user_data(user_id):
     """
-    Load the user's data from the file system if available.
-    Ensure that the user history is a dictionary.
+    Load user data from a user_data/{user_id}.joblib file written before the
+    user state tables existed, or None if there is none.
     """
     user_file = f'user_data/{user_id}.joblib'
+    if not os.path.exists(user_file):
+        return None
+
+    user_data = joblib.load(user_file)
+
+    # Ensure history is a dictionary, initialize if it's not
+    if not isinstance(user_data.get('history', {}), dict):
+        user_data['history'] = {}
+
+    delta = user_data.get('model')
+    if isinstance(delta, dict):
+        user_data['model'] = PersonalizedModel.from_delta(delta, pipeline, base_classes, base_model_version)
+        if delta['base_version'] != base_model_version:
+            user_data['model_stale'] = True
+    else:
+        # Files from before incremental personalization hold a full retrained
+        # pipeline; replace it with a correction layer built from the history
+        user_data['model'] = new_user_model()
+        user_data['model'].rebuild(user_data['history'])
+    return user_data
+
+def load_user_data(user_id):
+    """
+    Load the user's data from the cache, or from the database if it changed.
+    Users with only a legacy user data file are migrated to the database.
+    The returned data carries the 'revision' it was loaded at, for save_user_data.
+    """
+    started_at = time.perf_counter()
     try:
-        if os.path.exists(user_file):
-            user_data = joblib.load(user_file)
+        revision = db.session.execute(
+            select(UserState.revision).where(UserState.user_id == int(user_id))).scalar()
+        if revision is None:
+            user_data = load_legacy_user_data(user_id)
+            if user_data is None:
+                user_state_load_seconds.observe(time.perf_counter() - started_at, source='new')
+                return {'model': new_user_model(), 'history': {}}
+            try:
+                save_user_data(user_id, user_data)
+                logger.info(f"User data file migrated to the database for user_id: {user_id}")
+            except UserStateConflict:
+                pass  # Migrated by a concurrent request
+            return load_user_data(user_id)
+
+        # The revision check catches state saved by other workers
+        user_data = user_data_cache.get(user_id, version=revision)
+        source = 'cache'
+        if user_data is None:
+            state = db.session.execute(select(UserState).where(UserState.user_id == int(user_id))).scalar_one()
+            user_data = read_user_state(user_id, state)
+            db.session.expunge(state)
             logger.info(f"User data loaded for user_id: {user_id}")
-            
-            # Ensure history is a dictionary, initialize if it's not
-            if not isinstance(user_data.get('history', {}), dict):
-                user_data['history'] = {}
-            
-            return user_data
+            user_data_cache.put(user_id, user_data, user_data_size(user_data), version=user_data['revision'])
+            user_state_load_bytes.observe(sum(user_state_bytes(rows) for rows in user_state_rows(user_data).values()))
+            source = 'database'
+        user_state_load_seconds.observe(time.perf_counter() - started_at, source=source)
+        return copy_user_data(user_data)
     except Exception as e:
+        db.session.rollback()
         logger.error(f"Failed to load user data for user_id {user_id}. Error: {e}")
-    
+
     # If no user-specific data is found, return initial model and empty history
-    return {'model': pipeline, 'history': {}}
+    return {'model': new_user_model(), 'history': {}}
+
+def save_user_data(user_id, data, keys=None):
+    """
+    Save the changes made to user data since it was loaded, in one transaction.
+    Only the model weight, item, category, category usage and history rows that
+    changed are written. Raises UserStateConflict if the user's state was
+    saved by another request after data was loaded; use update_user_data to retry.
+
+    keys (see selected_user_state_rows) can name the only rows that may have
+    changed. Then only those rows are compared and written, so the save costs
+    the same however large the rest of the state is.
+    """
+    started_at = time.perf_counter()
+    user_id = int(user_id)
+    revision = data.get('revision')
+    if revision is None:
+        keys = None  # A first save writes everything
+    model = data['model']
+    model_stale = bool(data.get('model_stale', False))
+    written_bytes = 0
+    try:
+        if revision is None:
+            # First save of this user
+            stored = {}
+            db.session.add(UserState(user_id=user_id, revision=1, model_version=model.version,
+                                     model_base_version=model.base_version, model_stale=model_stale))
+            db.session.flush()
+        else:
+            # The revision condition makes this a compare-and-swap: it also takes
+            # the database write lock, so nothing else can save until we commit
+            stored_data = user_data_cache.get(user_id, version=revision)
+            result = db.session.execute(
+                update(UserState).where(UserState.user_id == user_id, UserState.revision == revision)
+                .values(revision=revision + 1, model_version=model.version,
+                        model_base_version=model.base_version, model_stale=model_stale))
+            if result.rowcount != 1:
+                raise UserStateConflict(f"User state of user_id {user_id} changed since revision {revision}")
+
+            if stored_data is None:
+                state = db.session.execute(select(UserState).where(UserState.user_id == user_id)).scalar_one()
+                stored_data = read_user_state(user_id, state)
+                db.session.expunge(state)
+            stored = user_state_rows(stored_data) if keys is None else selected_user_state_rows(stored_data, keys)
+
+        new_revision = 1 if revision is None else revision + 1
+        rows = user_state_rows(data) if keys is None else selected_user_state_rows(data, keys)
+        for table, table_rows in rows.items():
+            written_bytes += write_user_state_rows(table, user_id, stored.get(table, {}), table_rows, new_revision)
+        if new_revision % SYNC_PRUNE_INTERVAL == 0:
+            db.session.execute(delete(UserDeletion).where(
+                UserDeletion.user_id == user_id, UserDeletion.revision <= new_revision - SYNC_HISTORY_REVISIONS))
+        db.session.commit()
+    except UserStateConflict:
+        db.session.rollback()
+        user_state_conflicts.inc()
+        raise
+    except IntegrityError:
+        db.session.rollback()
+        user_state_conflicts.inc()
+        raise UserStateConflict(f"User state of user_id {user_id} was created concurrently")
+    except Exception:
+        db.session.rollback()
+        raise
+
+    data['revision'] = new_revision
+    data['model_stale'] = model_stale
+    if keys is None:
+        data['positions'] = row_positions(rows)
+
+    # Write through to the cache so the next request doesn't read the rows back
+    user_data_cache.put(user_id, copy_user_data(data), user_data_size(data), version=data['revision'])
+    user_state_save_seconds.observe(time.perf_counter() - started_at)
+    user_state_save_bytes.observe(written_bytes)
+    logger.info(f"User data saved for user_id: {user_id}")
+
+def write_user_state_rows(table, user_id, stored_rows, rows, revision):
+    """
+    Upsert the rows that changed and delete the rows that are gone. Rows of
+    synced tables are stamped with revision, and their deletions recorded as
+    tombstones. Returns the approximate number of bytes written.
+    """
+    keys = USER_STATE_KEYS[table]
+    key_columns = tuple_(*(getattr(table, key) for key in keys))
+    synced = table in SYNCED_TABLES
+    removed = [row_key for row_key in stored_rows if row_key not in rows]
+    for start in range(0, len(removed), USER_STATE_DELETE_CHUNK):
+        db.session.execute(delete(table).where(
+            table.user_id == user_id, key_columns.in_(removed[start:start + USER_STATE_DELETE_CHUNK])))
+    if synced and removed:
+        upsert(UserDeletion, ('user_id', 'table_name', 'row_key'),
+               [{'user_id': user_id, 'table_name': SYNCED_TABLES[table], 'row_key': row_key[0], 'revision': revision}
+                for row_key in removed])
+
+    changed_rows = {row_key: values for row_key, values in rows.items() if stored_rows.get(row_key) != values}
+    changed = [{'user_id': user_id, **dict(zip(keys, row_key)), **values, **({'revision': revision} if synced else {})}
+               for row_key, values in changed_rows.items()]
+    if changed:
+        upsert(table, ('user_id', *keys), changed)
+    return user_state_bytes(changed_rows)
+
+def upsert(table, key_columns, rows):
+    statement = sqlite_insert(table.__table__)
+    statement = statement.on_conflict_do_update(
+        index_elements=list(key_columns),
+        set_={column: statement.excluded[column] for column in rows[0] if column not in key_columns})
+    db.session.execute(statement, rows)
+
+def update_user_data(user_id, update_function, keys=None):
+    """
+    Load the user's data, let update_function modify it and save it, starting
+    over if another request saved the user's state in between.
+    update_function may return False to skip saving. keys, if given, names the
+    only rows update_function changes, see save_user_data.
+
+    Returns:
+    - The saved user data, or None if update_function skipped saving.
+    """
+    for attempt in range(USER_STATE_SAVE_ATTEMPTS):
+        if attempt:
+            # Randomized backoff, so writers racing for the same user spread out
+            time.sleep(random.uniform(0, USER_STATE_RETRY_DELAY * attempt))
+        user_data = load_user_data(user_id)
+        if update_function(user_data) is False:
+            return None
+        try:
+            save_user_data(user_id, user_data, keys)
+            return user_data
+        except UserStateConflict:
+            logger.info(f"User state of user_id {user_id} changed concurrently, retrying.")
+    raise UserStateConflict(f"User state of user_id {user_id} kept changing, gave up after "
+                            f"{USER_STATE_SAVE_ATTEMPTS} attempts")
+
+class SyncRevisionRejected(Exception):
+    """
+    Raised when a sync client's base revision is ahead of the server's or too
+    old to send the changes since; the client has to load the full state.
+    """
+    def __init__(self, message, revision):
+        super().__init__(message)
+        self.revision = revision
+
+def check_sync_base(base_revision, revision):
+    if base_revision > revision:
+        raise SyncRevisionRejected(f"Unknown revision {base_revision}, the latest is {revision}", revision)
+    if base_revision < revision - SYNC_HISTORY_REVISIONS:
+        raise SyncRevisionRejected(f"Revision {base_revision} is too old to sync from", revision)
+
+def changes_since(user_id, since):
+    """
+    The rows of the synced tables written after revision since, and the keys
+    of the rows removed after it, read in one transaction. A key can be both
+    removed and upserted (removed, then added again): apply removals first.
+
+    Returns:
+    - Tuple of the user's current revision and {table name: {'upserted': ..., 'removed': [keys]}}.
+    """
+    user_id = int(user_id)
+    try:
+        revision = db.session.execute(
+            select(UserState.revision).where(UserState.user_id == user_id)).scalar() or 0
+        items = db.session.execute(
+            select(UserItem.data).where(UserItem.user_id == user_id, UserItem.revision > since)
+            .order_by(UserItem.position)).scalars().all()
+        categories = db.session.execute(
+            select(UserCategory.data).where(UserCategory.user_id == user_id, UserCategory.revision > since)
+            .order_by(UserCategory.position)).scalars().all()
+        category_usage = dict(db.session.execute(
+            select(UserCategoryUsage.category, UserCategoryUsage.count)
+            .where(UserCategoryUsage.user_id == user_id, UserCategoryUsage.revision > since)).all())
+        history = [{'item': item, 'category': category} for item, category in db.session.execute(
+            select(UserHistory.item, UserHistory.category)
+            .where(UserHistory.user_id == user_id, UserHistory.revision > since))]
+        deletions = db.session.execute(
+            select(UserDeletion.table_name, UserDeletion.row_key)
+            .where(UserDeletion.user_id == user_id, UserDeletion.revision > since)).all()
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    changes = {
+        'items': {'upserted': list(items), 'removed': []},
+        'categories': {'upserted': list(categories), 'removed': []},
+        'categoryUsage': {'upserted': category_usage, 'removed': []},
+        'userHistory': {'upserted': history, 'removed': []},
+    }
+    for table_name, row_key in deletions:
+        changes[table_name]['removed'].append(row_key)
+    return revision, changes
+
+def sync_string(operation, field, kind=None):
+    value = operation.get(field)
+    if not isinstance(value, str) or not value.strip():
+        raise ValueError(f"{kind or operation.get('type')} needs a non-empty '{field}'")
+    return value.strip()
+
+def put_entry(entries, entry):
+    """
+    entries with entry replacing the one with the same id, or appended.
+    """
+    if not isinstance(entry, dict) or entry.get('id') is None:
+        raise ValueError("Items and categories need an 'id'")
+    key = str(entry['id'])
+    entries = list(entries)
+    for index, existing in enumerate(entries):
+        if entry_key(existing, index) == key:
+            entries[index] = entry
+            return entries
+    entries.append(entry)
+    return entries
+
+def remove_entry(entries, key):
+    if key is None:
+        raise ValueError("Removing an item or category needs its 'id'")
+    return [entry for index, entry in enumerate(entries) if entry_key(entry, index) != str(key)]
+
+# Operation types of /grocery/sync, see apply_sync_operation
+SYNC_OPERATION_TYPES = (
+    'putItem', 'removeItem', 'putCategory', 'removeCategory', 'renameCategory',
+    'incrementCategoryUsage', 'putHistory', 'removeHistory',
+)
+
+def sync_operation_type(operation):
+    """
+    The operation's type, or 'unknown', so metrics labels stay bounded.
+    """
+    kind = operation.get('type') if isinstance(operation, dict) else None
+    return kind if kind in SYNC_OPERATION_TYPES else 'unknown'
+
+def apply_sync_operation(user_data, operation):
+    """
+    Apply one /grocery/sync operation to user data, without touching the
+    lists and dicts it shares with the cache. Operations merge with what
+    other clients saved since the sender's base revision: the last write of
+    an item, category or history entry wins, removing something that is
+    already gone does nothing, and usage increments add up.
+
+    Operations, by 'type':
+    - putItem {item}, removeItem {id}
+    - putCategory {category}, removeCategory {id}
+    - renameCategory {from, to}: also moves the items, usage and history
+    - incrementCategoryUsage {category, by}: by defaults to 1 and can't be negative
+    - putHistory {item, category}, removeHistory {item}
+
+    Invalid operations raise ValueError before changing user_data.
+
+    Returns:
+    - True if the operation changed the history, which the user model learns from.
+    """
+    if not isinstance(operation, dict):
+        raise ValueError("Operations must be objects")
+    kind = operation.get('type')
+    history = user_data.get('history', {})
+    if kind == 'putItem':
+        item = operation.get('item')
+        if isinstance(item, dict):
+            sync_string(item, 'name', 'putItem')
+            sync_string(item, 'category', 'putItem')
+        user_data['items'] = put_entry(user_data.get('items', []), item)
+    elif kind == 'removeItem':
+        user_data['items'] = remove_entry(user_data.get('items', []), operation.get('id'))
+    elif kind == 'putCategory':
+        user_data['categories'] = put_entry(user_data.get('categories', initialCategories), operation.get('category'))
+    elif kind == 'removeCategory':
+        user_data['categories'] = remove_entry(user_data.get('categories', initialCategories), operation.get('id'))
+    elif kind == 'renameCategory':
+        old_name, new_name = sync_string(operation, 'from'), sync_string(operation, 'to')
+        user_data['categories'] = [{**category, 'name': new_name} if category.get('name') == old_name else category
+                                   for category in user_data.get('categories', initialCategories)]
+        user_data['items'] = [{**item, 'category': new_name} if item.get('category') == old_name else item
+                              for item in user_data.get('items', [])]
+        category_usage = dict(user_data.get('categoryUsage', {}))
+        if old_name in category_usage:
+            category_usage[new_name] = category_usage.get(new_name, 0) + category_usage.pop(old_name)
+        user_data['categoryUsage'] = category_usage
+        if old_name in history.values():
+            user_data['history'] = {item: new_name if category == old_name else category
+                                    for item, category in history.items()}
+            return True
+    elif kind == 'incrementCategoryUsage':
+        category = sync_string(operation, 'category')
+        by = operation.get('by', 1)
+        if not isinstance(by, int) or isinstance(by, bool) or by < 0:
+            raise ValueError("incrementCategoryUsage needs a non-negative integer 'by'")
+        category_usage = dict(user_data.get('categoryUsage', {}))
+        category_usage[category] = category_usage.get(category, 0) + by
+        user_data['categoryUsage'] = category_usage
+    elif kind == 'putHistory':
+        item, category = sync_string(operation, 'item').lower(), sync_string(operation, 'category')
+        if history.get(item) != category:
+            user_data['history'] = {**history, item: category}
+            return True
+    elif kind == 'removeHistory':
+        item = sync_string(operation, 'item').lower()
+        if item in history:
+            user_data['history'] = {key: value for key, value in history.items() if key != item}
+            return True
+    else:
+        raise ValueError(f"Unknown operation type: {kind}")
+    return False
+
 
 
 @app.route('/grocery/loadUserData', methods=['GET'])
@@ -132,6 +813,19 @@ def load_user_data_endpoint():
         logger.error("User ID is missing in the request")
         return jsonify({"error": "User ID is required"}), 400
 
+    # ?since=<revision>: only the changes after it, in the /grocery/sync format
+    since = request.args.get('since', type=int)
+    if since is not None:
+        try:
+            revision, changes = changes_since(user_id, since)
+            check_sync_base(since, revision)
+        except SyncRevisionRejected as e:
+            return jsonify({"error": str(e), "revision": e.revision}), 409
+        except Exception as e:
+            logger.error(f"Error loading changes for user_id {user_id}: {e}")
+            return jsonify({"error": "Error loading the changes"}), 500
+        return jsonify({'revision': revision, 'changes': changes}), 200
+
     logger.info(f"Loading user data for user_id: {user_id}")
 
     # Load user-specific data
@@ -154,19 +848,22 @@ def load_user_data_endpoint():
         'items': user_data.get('items', []),
         'categories': user_data.get('categories', initialCategories),  # Send initial categories if none exist
         'categoryUsage': user_data.get('categoryUsage', {}),
-        'userHistory': user_history_list
+        'userHistory': user_history_list,
+        'revision': user_data.get('revision', 0),  # the baseRevision of the client's next sync
     }
 
-    logger.info(f"Sending response data for user_id: {user_id}: {response_data}")
-    return jsonify(response_data), 200
+    response = jsonify(response_data)
+    log_payload(logger, f"Sending response data for user_id: {user_id}", response_data, response.get_data())
+    return response, 200
 
 
 
+# Full-state save of older clients, /grocery/sync sends only the changes
 @app.route('/grocery/saveState', methods=['POST'])
 @jwt_required()
 def save_user_state():
     data = request.get_json()
-    logger.info(f"Received saveState request with data: {data}")  # Log the incoming request data
+    log_payload(logger, "Received saveState request", data, request.get_data())
     user_id = get_jwt_identity()
 
     # Validate input
@@ -174,119 +871,139 @@ def save_user_state():
         logger.error("No data provided in saveState request")
         return jsonify({"error": "No data provided"}), 400
 
-    # Load existing user data
-    user_data = load_user_data(user_id)
-
-    # Save the entire state
-    user_data['items'] = data.get('items', [])
-    user_data['categories'] = data.get('categories', initialCategories)  # Use global initialCategories
-    user_data['categoryUsage'] = data.get('categoryUsage', {})
-
     # Convert 'userHistory' array to dict
     user_history_list = data.get('userHistory', [])
-    user_data['history'] = {entry['item']: entry['category'] for entry in user_history_list}
-
-    # Save the updated user data
-    save_user_data(user_id, user_data)
-
-    return jsonify({"message": "State saved successfully"}), 200
+    history = {entry['item']: entry['category'] for entry in user_history_list}
 
+    history_changed = False
 
+    def save_state(user_data):
+        nonlocal history_changed
+        # Save the entire state; only the rows that differ are written
+        user_data['items'] = data.get('items', [])
+        user_data['categories'] = data.get('categories', initialCategories)  # Use global initialCategories
+        user_data['categoryUsage'] = data.get('categoryUsage', {})
 
-import shutil
-import tempfile
+        # The user model only learns from saveItem; a history edited here (e.g. a
+        # renamed category) needs the model rebuilt in the background
+        history_changed = history != user_data['history']
+        if history_changed:
+            user_data['model_stale'] = True
+        user_data['history'] = history
 
-def save_user_data(user_id, data):
-    """
-    Save user-specific data into a file atomically.
-    """
-    user_file = f'user_data/{user_id}.joblib'
-    temp_file = f'{user_file}.tmp'
-    
-    # Save data to a temporary file first, then rename (atomic save)
-    joblib.dump(data, temp_file)
-    shutil.move(temp_file, user_file)
-    
-    logger.info(f"User data saved for user_id: {user_id}")
+    try:
+        with user_lock(user_id):
+            update_user_data(user_id, save_state)
+    except Exception as e:
+        logger.error(f"Error saving state for user_id {user_id}: {e}")
+        return jsonify({"error": "Error saving the state"}), 500
 
+    if history_changed:
+        retrain_queue.submit(user_id)
 
-def retrain_model_with_user_history(user_history):
-    """
-    Retrain the model by incorporating user-specific data with higher priority.
-    Parameters:
-    - user_history: Dictionary of {item_name: category}
-    Returns:
-    - Updated sklearn Pipeline model.
-    """
-    global label_encoder  # Explicitly use the global label_encoder
-
-    # Ensure user_history is a dictionary
-    if not isinstance(user_history, dict):
-        logger.error("User history is not in the expected dictionary format.")
-        return pipeline  # Return the original model if the history is not in the right format
-
-    if not user_history:
-        logger.info("No user history provided. Returning initial model.")
-        return pipeline  # Return the initial model if no user history is present
-
-    # Load initial data
-    df_initial = pd.DataFrame({'Item': X, 'Category': y})
-
-    # Load user history as DataFrame
-    df_user = pd.DataFrame({'Item': list(user_history.keys()), 'Category': list(user_history.values())})
-
-    # Combine categories from initial data and user history
-    combined_categories = pd.concat([df_initial['Category'], df_user['Category']]).unique()
-
-    # Check for new categories
-    new_categories = set(df_user['Category']) - set(label_encoder.classes_)
-    if new_categories:
-        logger.info(f"New categories detected: {new_categories}. Updating LabelEncoder.")
-        
-        # Update the LabelEncoder by including all categories (initial + user categories)
-        updated_classes = list(label_encoder.classes_) + list(new_categories)  # Combine old and new categories
-        label_encoder = LabelEncoder()  # Re-initialize LabelEncoder
-        label_encoder.fit(updated_classes)  # Fit it with the updated list of categories
-        
-        # Save the updated LabelEncoder
-        joblib.dump(label_encoder, 'models/label_encoder.pkl')
-        logger.info("LabelEncoder updated and saved with new categories.")
-    else:
-        logger.info("No new categories detected. Using existing LabelEncoder.")
+    return jsonify({"message": "State saved successfully"}), 200
 
-    # Encode categories using the updated LabelEncoder
-    try:
-        df_user['Category_encoded'] = label_encoder.transform(df_user['Category'])
-    except Exception as e:
-        logger.error(f"Error encoding user categories: {e}")
-        raise
 
-    # Assign higher weight to user data by duplicating user entries
-    user_multiplier = 20  # Adjust this multiplier as needed to prioritize user data
-    df_user_weighted = pd.concat([df_user] * user_multiplier, ignore_index=True)
 
-    # Combine initial data with weighted user data
-    df_combined = pd.concat([df_initial, df_user_weighted], ignore_index=True)
+@app.route('/grocery/sync', methods=['POST'])
+@jwt_required()
+def sync_state():
+    """
+    Apply the client's operations (see apply_sync_operation) and send back the
+    changes since its base revision, its own included, so the request, the
+    response and the rows written scale with the change rather than the state.
+
+    Request: {"baseRevision": <revision of the client's state>, "operations": [...]}
+    Response: {"revision": <new base revision>, "changes": <see changes_since>,
+               "rejected": [{"index", "type", "error"}, ...]}.
+    Invalid operations are skipped and listed in "rejected", the others are
+    still applied. A base revision the server can't sync from is rejected with
+    409; the client then loads the full state and sends its operations again.
+    """
+    data = request.get_json(silent=True) or {}
+    user_id = get_jwt_identity()
 
-    # Standardize the 'Item' column by converting to lowercase and stripping whitespace
-    df_combined['Item'] = df_combined['Item'].str.lower().str.strip()
+    base_revision = data.get('baseRevision')
+    operations = data.get('operations', [])
+    if (not isinstance(base_revision, int) or isinstance(base_revision, bool) or base_revision < 0
+            or not isinstance(operations, list)):
+        return jsonify({"error": "baseRevision and a list of operations are required"}), 400
+    log_payload(logger, "Received sync request", data, request.get_data())
+
+    history_changed = False
+    rejected = []
+
+    def apply_operations(user_data):
+        nonlocal history_changed
+        check_sync_base(base_revision, user_data.get('revision', 0))
+        history_changed = False
+        rejected.clear()
+        for index, operation in enumerate(operations):
+            try:
+                history_changed |= apply_sync_operation(user_data, operation)
+            except ValueError as e:
+                rejected.append({'index': index, 'type': sync_operation_type(operation), 'error': str(e)})
+        if len(rejected) == len(operations):
+            return False  # Nothing to save
+        if history_changed:
+            user_data['model_stale'] = True
 
-    # Encode categories
     try:
-        y_combined = label_encoder.transform(df_combined['Category'])
+        with user_lock(user_id):
+            update_user_data(user_id, apply_operations)
+            revision, changes = changes_since(user_id, base_revision)
+    except SyncRevisionRejected as e:
+        return jsonify({"error": str(e), "revision": e.revision}), 409
     except Exception as e:
-        logger.error(f"Error encoding combined categories: {e}")
-        raise
+        logger.error(f"Error syncing state for user_id {user_id}: {e}")
+        return jsonify({"error": "Error syncing the state"}), 500
+
+    rejected_indexes = {entry['index'] for entry in rejected}
+    for index, operation in enumerate(operations):
+        sync_operations.inc(type=sync_operation_type(operation),
+                            result='rejected' if index in rejected_indexes else 'applied')
+    if rejected:
+        logger.warning(f"Rejected {len(rejected)} of {len(operations)} sync operations for user_id {user_id}: "
+                       f"{rejected[:3]}")
+    if history_changed:
+        retrain_queue.submit(user_id)
 
-    # Prepare data for retraining
-    X_combined = df_combined['Item'].tolist()
+    return jsonify({'revision': revision, 'changes': changes, 'rejected': rejected}), 200
 
-    # Retrain the model using only logistic regression and tfidf vectorizer
-    new_pipeline = make_pipeline(TfidfVectorizer(), LogisticRegression(max_iter=1000))
-    new_pipeline.fit(X_combined, y_combined)
-    logger.info("Model retrained with user history.")
 
-    return new_pipeline
+def rebuild_user_model(user_id):
+    """
+    Background retrain job: rebuild the user's model from their latest history.
+    Requests keep using the previous model until the rebuilt one is saved.
+    """
+    # Runs on a retrain worker thread, outside of any request
+    with app.app_context():
+        user_data = load_user_data(user_id)
+        history = user_data['history']
+        model = user_data['model'].copy()
+        with retrain_seconds.time(kind='user_model'):
+            model.rebuild(history)
+        retrain_training_rows.observe(len(history), kind='user_model')
+
+        def save_model(user_data):
+            if user_data['history'] != history:
+                # A newer save changed the history while we were rebuilding and
+                # has already scheduled another run
+                logger.info(f"Discarding outdated model rebuild for user_id: {user_id}")
+                return False
+            user_data['model'] = model
+            user_data['model_stale'] = False
+
+        with user_lock(user_id):
+            if update_user_data(user_id, save_model) is None:
+                return
+            prediction_cache.invalidate(user_id)
+    logger.info(f"User model rebuilt from {len(history)} history items for user_id: {user_id}")
+
+
+# Background worker pool for retraining, bursts of saves per user coalesce into one job
+RETRAIN_WORKERS = 2
+retrain_queue = RetrainQueue(rebuild_user_model, max_workers=RETRAIN_WORKERS, latency=retrain_latency_seconds)
 
 
 @app.route('/')
@@ -314,7 +1031,7 @@ def signup():
     logger.info(f"New user created: {username}")
 
     # Initialize user data with default model and empty history
-    user_data = {'model': pipeline, 'history': {}}
+    user_data = {'model': new_user_model(), 'history': {}}
     save_user_data(new_user.id, user_data)
     logger.info(f"Initialized data for new user: {username}")
 
@@ -349,12 +1066,10 @@ def login():
         # Load user data
         user_data = load_user_data(user.id)
 
-        # Retrain model with the user's history upon login
-        if user_data['history']:
-            logger.info('Retraining model with user history upon login...')
-            user_data['model'] = retrain_model_with_user_history(user_data['history'])
-            save_user_data(user.id, user_data)
-            logger.info('Model retrained and saved after login.')
+        # Catch up on a rebuild that didn't finish (e.g. the server restarted)
+        if user_data['history'] and user_data.get('model_stale'):
+            logger.info('Scheduling user model rebuild upon login...')
+            retrain_queue.submit(user.id)
 
         return jsonify({"access_token": access_token}), 200
     else:
@@ -366,13 +1081,14 @@ def login():
 @app.route('/grocery/predict', methods=['POST'])
 @jwt_required()
 def predict():
+    started_at = time.perf_counter()
     data = request.get_json()
     if data is None:
         logger.error("Invalid JSON data received.")
         return jsonify({"error": "Invalid JSON data"}), 400
 
     item_name = data.get('itemName')
-    if not item_name:
+    if not isinstance(item_name, str) or not item_name.strip():
         logger.error("'itemName' is missing in the request.")
         return jsonify({"error": "'itemName' is required"}), 400
 
@@ -380,6 +1096,19 @@ def predict():
     if not user_id:
         return jsonify({"error": "User ID is required"}), 400
 
+    # Optional increasing sequence number of the client's predict requests, with
+    # an id of the client (e.g. a browser tab) that numbers them; only the
+    # latest one per client is answered
+    request_seq = data.get('requestSeq')
+    client_id = data.get('clientId')
+    if request_seq is not None:
+        if not isinstance(request_seq, int) or isinstance(request_seq, bool):
+            return jsonify({"error": "'requestSeq' must be an integer"}), 400
+        if not isinstance(client_id, str) or not client_id or len(client_id) > MAX_CLIENT_ID_LENGTH:
+            return jsonify({"error": "'requestSeq' needs a 'clientId' string"}), 400
+        if not latest_predict_requests.begin(user_id, client_id, request_seq):
+            return jsonify({"error": "Superseded by a newer request"}), 409
+
     # Load user data
     user_data = load_user_data(user_id)
 
@@ -388,30 +1117,130 @@ def predict():
     # Check the user history first and return if found
     if 'history' in user_data and item_name_standardized in user_data['history']:
         predicted_category = user_data['history'][item_name_standardized]
+        predicted_items.inc(endpoint='predict', source='history')
         logger.info(f"Item '{item_name_standardized}' found in user history with category '{predicted_category}'.")
         # Short-circuit: return the category immediately if found in history
         return jsonify({"predictedCategory": predicted_category})
 
-    # If not in history, proceed with model prediction
+    # If not in history, proceed with model prediction, unless it is cached
     try:
         user_model = user_data['model']
-        predicted_category_encoded = user_model.predict([item_name_standardized])[0]
-        predicted_category = label_encoder.inverse_transform([predicted_category_encoded])[0]
+        predicted_category = prediction_cache.get(user_id, user_model, item_name_standardized)
+        cache_hit = predicted_category is not None
+        if not cache_hit:
+            if request_seq is not None and latest_predict_requests.is_superseded(user_id, client_id, request_seq):
+                return jsonify({"error": "Superseded by a newer request"}), 409
+            with model_predict_seconds.time(endpoint='predict'):
+                predicted_category = predict_flights.do(
+                    prediction_key(user_id, user_model, item_name_standardized),
+                    lambda: user_model.predict([item_name_standardized])[0])
+            prediction_cache.put(user_id, user_model, item_name_standardized, predicted_category)
+        predicted_items.inc(endpoint='predict', source='cache' if cache_hit else 'model')
         logger.info(f"Predicted category: {predicted_category}")
     except Exception as e:
         logger.error(f"Error during prediction: {e}")
         return jsonify({"error": "Error during prediction"}), 500
 
+    predict_seconds.observe(time.perf_counter() - started_at, cache='hit' if cache_hit else 'miss')
     return jsonify({"predictedCategory": predicted_category})
 
 
 
 
+# Upper bound on the number of item names accepted by /grocery/predictBatch
+MAX_BATCH_SIZE = 1000
+
+def top_k_categories(probabilities, classes, k):
+    """
+    Top k (category, probability) pairs per row, highest probability first.
+    """
+    k = min(k, probabilities.shape[1])
+    top_indices = np.argpartition(probabilities, -k, axis=1)[:, -k:]
+    top_probabilities = np.take_along_axis(probabilities, top_indices, axis=1)
+    order = np.argsort(-top_probabilities, axis=1)
+    top_indices = np.take_along_axis(top_indices, order, axis=1)
+    top_probabilities = np.take_along_axis(top_probabilities, order, axis=1)
+    return [
+        [{'category': classes[index], 'probability': float(probability)}
+         for index, probability in zip(row_indices, row_probabilities)]
+        for row_indices, row_probabilities in zip(top_indices, top_probabilities)
+    ]
+
+@app.route('/grocery/predictBatch', methods=['POST'])
+@jwt_required()
+def predict_batch():
+    data = request.get_json()
+    if data is None:
+        logger.error("Invalid JSON data received.")
+        return jsonify({"error": "Invalid JSON data"}), 400
+
+    item_names = data.get('itemNames')
+    if not isinstance(item_names, list) or not all(isinstance(name, str) for name in item_names):
+        logger.error("'itemNames' is missing or not a list of strings.")
+        return jsonify({"error": "'itemNames' must be a list of strings"}), 400
+    if len(item_names) > MAX_BATCH_SIZE:
+        return jsonify({"error": f"At most {MAX_BATCH_SIZE} items can be predicted at once"}), 400
+    # Blank names are rejected, like /grocery/predict does
+    blank_rows = [row for row, name in enumerate(item_names) if not name.strip()]
+    if blank_rows:
+        return jsonify({"error": f"'itemNames' must not be blank (rows {blank_rows[:10]})"}), 400
+
+    top_k = data.get('topK', 3)
+    if not isinstance(top_k, int) or isinstance(top_k, bool) or top_k < 1:
+        return jsonify({"error": "'topK' must be a positive integer"}), 400
+
+    user_id = get_jwt_identity()
+    if not user_id:
+        return jsonify({"error": "User ID is required"}), 400
+
+    # Load user data
+    user_data = load_user_data(user_id)
+    history = user_data['history']
+
+    # Answer items from the user history directly, batch the rest through the model
+    item_names_standardized = [name.strip().lower() for name in item_names]
+    predictions = [None] * len(item_names)
+    model_rows = []
+    for row, item_name_standardized in enumerate(item_names_standardized):
+        if item_name_standardized in history:
+            category = history[item_name_standardized]
+            predictions[row] = {
+                'itemName': item_names[row],
+                'predictedCategory': category,
+                'topCategories': [{'category': category, 'probability': 1.0}],
+                'fromHistory': True,
+            }
+        else:
+            model_rows.append(row)
+
+    if model_rows:
+        try:
+            user_model = user_data['model']
+            classes = user_model.classes()
+            with model_predict_seconds.time(endpoint='predictBatch'):
+                probabilities = user_model.predict_proba([item_names_standardized[row] for row in model_rows], classes)
+            for row, top_categories in zip(model_rows, top_k_categories(probabilities, classes, top_k)):
+                predictions[row] = {
+                    'itemName': item_names[row],
+                    'predictedCategory': top_categories[0]['category'],
+                    'topCategories': top_categories,
+                    'fromHistory': False,
+                }
+        except Exception as e:
+            logger.error(f"Error during batch prediction: {e}")
+            return jsonify({"error": "Error during prediction"}), 500
+
+    predicted_items.inc(len(item_names) - len(model_rows), endpoint='predictBatch', source='history')
+    predicted_items.inc(len(model_rows), endpoint='predictBatch', source='model')
+    logger.info(f"Batch predicted {len(item_names)} items, {len(item_names) - len(model_rows)} from history.")
+    return jsonify({"predictions": predictions})
+
+
 @app.route('/grocery/saveItem', methods=['POST'])
 @jwt_required()
 def save_item():
     data = request.get_json()
-    logger.info(f"Received request data for saving item: {data}")
+    log_payload(logger, "Received saveItem request", data, request.get_data())
 
     item_name = data.get('itemName')
     category = data.get('category')
@@ -423,41 +1252,40 @@ def save_item():
     item_name_standardized = item_name.strip().lower()
     category = category.strip()
 
-    # Load user data
-    user_data = load_user_data(user_id)
+    # The save only changes the item's history row and the weights of its features
+    keys = {UserHistory: [item_name_standardized],
+            UserModelWeight: [feature for feature, _ in item_features(item_name_standardized)]}
 
-    # Initialize history as a dictionary if it doesn't exist
-    if 'history' not in user_data or not isinstance(user_data['history'], dict):
-        user_data['history'] = {}
+    try:
+        def save(user_data):
+            # Initialize history as a dictionary if it doesn't exist
+            if 'history' not in user_data or not isinstance(user_data['history'], dict):
+                user_data['history'] = {}
 
-    # Update the item's category in the history
-    user_data['history'][item_name_standardized] = category
+            # Update the item's category in the history
+            user_data['history'][item_name_standardized] = category
 
-    try:
-        # Retrain the model with the updated history
-        logger.info('Retraining model with user history:')
-        logger.info(user_data['history'])
-        model = retrain_model_with_user_history(user_data['history'])
-
-        user_data['model'] = model
-        save_user_data(user_id, user_data)
-        logger.info(f"Item '{item_name_standardized}' saved with category '{category}' for user '{user_id}'.")
-
-        # Check if the category is new and update LabelEncoder
-        global label_encoder
-        if category not in label_encoder.classes_:
-            logger.info(f"New category '{category}' detected, updating LabelEncoder.")
-            all_categories = list(label_encoder.classes_) + [category]
-            label_encoder = LabelEncoder()
-            label_encoder.fit(all_categories)
-            joblib.dump(label_encoder, os.path.join('models', LABEL_ENCODER_PATH))
-            logger.info("LabelEncoder reloaded and updated after saving.")
+            # Update the user's correction layer with just the new item, so the
+            # next prediction reflects it before the background rebuild runs.
+            # The copy shares the weights learn doesn't touch, see PersonalizedModel.copy
+            logger.info(f"Updating user model with new item, user history has {len(user_data['history'])} items")
+            model = user_data['model'].copy()
+            model.learn(item_name_standardized, category)
+            user_data['model'] = model
+
+        with user_lock(user_id):
+            update_user_data(user_id, save, keys)
+            prediction_cache.invalidate(user_id)
+            logger.info(f"Item '{item_name_standardized}' saved with category '{category}' for user '{user_id}'.")
+
+        # Consolidate the full history in the background, coalesced with other saves
+        retrain_queue.submit(user_id)
 
     except Exception as e:
-        logger.error(f"Error during saving and retraining: {e}")
-        return jsonify({"error": "Error saving the item and retraining the model"}), 500
+        logger.error(f"Error during saving and updating the model: {e}")
+        return jsonify({"error": "Error saving the item and updating the model"}), 500
 
-    return jsonify({"message": "Item saved and model retrained successfully"})
+    return jsonify({"message": "Item saved and model updated successfully"})
 
 @jwt.expired_token_loader
 def expired_token_callback(jwt_header, jwt_payload):
@@ -0,0 +1,130 @@
+import atexit
+import hashlib
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+
+# Level of the server logs, the LOG_LEVEL environment variable overrides it (e.g. DEBUG)
+DEFAULT_LOG_LEVEL = 'INFO'
+
+# Fraction of log_payload calls that also log the full payload, at DEBUG level.
+# The LOG_PAYLOAD_SAMPLE_RATE environment variable overrides it
+DEFAULT_PAYLOAD_SAMPLE_RATE = 0.01
+
+# Records waiting for the listener thread; when it falls this far behind, new
+# records are dropped (and counted) instead of blocking requests
+LOG_QUEUE_SIZE = 10000
+
+LOG_FORMAT = '%(asctime)s %(levelname)s %(name)s [%(threadName)s] %(message)s'
+
+# Dicts with more keys than this are summarized by their key count only
+SUMMARY_MAX_FIELDS = 10
+
+# Longest scalar value quoted in a payload summary
+SUMMARY_MAX_VALUE_LENGTH = 40
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler for a bounded queue that drops records when it is full
+    rather than blocking or printing an error for each one.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_listener = None
+_queue_handler = None
+
+
+def configure_logging(level=None):
+    """
+    Send every log record through a queue to a background QueueListener,
+    which formats and writes it to stderr, so request threads never wait on
+    the output stream. Replaces the root logger's handlers; calling it again
+    does nothing.
+
+    Returns:
+    - The running QueueListener.
+    """
+    global _listener, _queue_handler
+    if _listener is not None:
+        return _listener
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    _queue_handler = DroppingQueueHandler(log_queue)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_queue_handler)
+    root.setLevel(level or os.environ.get('LOG_LEVEL', DEFAULT_LOG_LEVEL))
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    # Flush the records still queued when the process exits
+    atexit.register(_listener.stop)
+    return _listener
+
+
+def dropped_records():
+    """
+    Records dropped because the log queue was full.
+    """
+    return _queue_handler.dropped if _queue_handler is not None else 0
+
+
+def payload_sample_rate():
+    return float(os.environ.get('LOG_PAYLOAD_SAMPLE_RATE', DEFAULT_PAYLOAD_SAMPLE_RATE))
+
+
+def summarize_value(value):
+    if isinstance(value, (list, dict, str)):
+        return f'{type(value).__name__}[{len(value)}]'
+    text = repr(value)
+    return text if len(text) <= SUMMARY_MAX_VALUE_LENGTH else text[:SUMMARY_MAX_VALUE_LENGTH] + '...'
+
+
+def payload_summary(payload, raw=None):
+    """
+    Short description of a JSON payload, e.g.
+    "{items=list[200], categories=list[15], revision=12} 31890 bytes blake2b:9f2c4e1a07d3".
+    Lists, dicts and strings show their length only, never their content. The
+    size and hash are of raw, the payload's serialized bytes, when given;
+    equal hashes in two log lines mean equal payloads.
+    """
+    if isinstance(payload, dict) and len(payload) <= SUMMARY_MAX_FIELDS:
+        summary = '{' + ', '.join(f'{key}={summarize_value(value)}' for key, value in payload.items()) + '}'
+    else:
+        summary = summarize_value(payload)
+    if raw is not None:
+        summary += f' {len(raw)} bytes blake2b:{hashlib.blake2b(raw, digest_size=6).hexdigest()}'
+    return summary
+
+
+def log_payload(logger, message, payload, raw=None, sample_rate=None):
+    """
+    Log message with a summary of payload at INFO level, see payload_summary.
+    A sample_rate fraction of calls (LOG_PAYLOAD_SAMPLE_RATE by default) also
+    logs the full payload at DEBUG level. Nothing is summarized or serialized
+    for levels the logger doesn't emit.
+    """
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(f"{message}: {payload_summary(payload, raw)}")
+    if sample_rate is None:
+        sample_rate = payload_sample_rate()
+    if sample_rate > 0 and logger.isEnabledFor(logging.DEBUG) and random.random() < sample_rate:
+        logger.debug(f"{message}, full payload: {json.dumps(payload, default=str)}")
@@ -0,0 +1,218 @@
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Response, g, request
+
+# Upper bounds of the latency histograms, in seconds. Starts below a millisecond
+# so cached predictions and history lookups land in their own buckets
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Upper bounds of the size histograms, in bytes
+BYTE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# Upper bounds of the training-set size histograms, in rows
+ROW_BUCKETS = (10, 100, 1000, 10000, 100000, 1000000)
+
+# Content type of the Prometheus text exposition format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(labelnames, labelvalues, extra=()):
+    pairs = list(zip(labelnames, labelvalues)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label_value(value)}"' for name, value in pairs) + '}'
+
+
+def format_value(value):
+    if isinstance(value, int):
+        return str(value)
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+
+class Metric:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _labelvalues(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def header(self):
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}  # label values -> count
+
+    def inc(self, amount=1, **labels):
+        key = self._labelvalues(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        return [f'{self.name}{format_labels(self.labelnames, key)} {format_value(value)}'
+                for key, value in sorted(values.items())]
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # label values -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value, **labels):
+        key = self._labelvalues(labels)
+        bucket = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[bucket] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observe the duration of the with block, also when it raises.
+        """
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started_at, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = {key: list(counts) for key, counts in self._values.items()}
+        lines = []
+        for key, counts in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{format_labels(self.labelnames, key, [("le", format_value(bound))])} '
+                             f'{cumulative}')
+            lines.append(f'{self.name}_sum{format_labels(self.labelnames, key)} {format_value(counts[-1])}')
+            lines.append(f'{self.name}_count{format_labels(self.labelnames, key)} {cumulative}')
+        return lines
+
+
+class Gauge(Metric):
+    """
+    A value read when the metrics are rendered, e.g. a queue depth.
+    """
+    type = 'gauge'
+
+    def __init__(self, name, documentation, function):
+        super().__init__(name, documentation)
+        self.function = function  # callable() -> number
+
+    def samples(self):
+        return [f'{self.name} {format_value(self.function())}']
+
+
+class FunctionCounter(Metric):
+    """
+    A counter kept by another object (e.g. a queue's submitted count), read
+    when the metrics are rendered.
+    """
+    type = 'counter'
+
+    def __init__(self, name, documentation, function):
+        super().__init__(name, documentation)
+        self.function = function  # callable() -> number, never decreasing
+
+    def samples(self):
+        return [f'{self.name} {format_value(self.function())}']
+
+
+class MetricsRegistry:
+    """
+    The metrics of one server process, rendered in the Prometheus text
+    exposition format. Every worker process has its own registry, so scrape
+    each worker (or run one) to get complete numbers.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name, documentation, function):
+        return self._register(Gauge(name, documentation, function))
+
+    def function_counter(self, name, documentation, function):
+        return self._register(FunctionCounter(name, documentation, function))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.header())
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+    def _register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+
+def instrument_app(app, registry, prefix):
+    """
+    Count and time every request of a Flask app per route, and serve the
+    registry at /metrics. Requests are labelled with the route pattern (e.g.
+    /grocery/predict), never the raw path, so the label set stays bounded.
+    """
+    requests_total = registry.counter(
+        f'{prefix}_http_requests_total', 'HTTP requests by route, method and status code.',
+        ('route', 'method', 'status'))
+    request_seconds = registry.histogram(
+        f'{prefix}_http_request_duration_seconds', 'HTTP request latency by route and method.',
+        ('route', 'method'))
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_started_at = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        started_at = g.pop('metrics_started_at', None)
+        if started_at is not None:
+            route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+            request_seconds.observe(time.perf_counter() - started_at, route=route, method=request.method)
+            requests_total.inc(route=route, method=request.method, status=response.status_code)
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        return Response(registry.render(), content_type=CONTENT_TYPE)
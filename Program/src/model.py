@@ -1,45 +1,72 @@
+import argparse
+import hashlib
+import io
 import joblib
+import timeit
+import numpy as np
 from sklearn.linear_model import LogisticRegression
+from sklearn.model_selection import KFold
 from sklearn.pipeline import make_pipeline
 from sklearn.preprocessing import LabelEncoder
 from sklearn.feature_extraction.text import TfidfVectorizer
+import sklearn
 import pandas as pd
 import os
 
+from compact_model import CompactTextClassifier
+
 # Define constants
-INITIAL_MODEL_PATH = 'initial_category_model.pkl'
-LABEL_ENCODER_PATH = 'label_encoder.pkl'
+DATA_PATH = 'data.csv'
+BUNDLE_PATH = os.path.join('models', 'category_bundle.joblib')
+
+# Bump when the training setup changes, so bundles built by older code count as stale
+BUNDLE_FORMAT = 1
+
+# Largest cross-validated accuracy drop of the compact model under the
+# sklearn pipeline that --compare accepts
+COMPACT_ACCURACY_TOLERANCE = 0.02
+
+
+class StaleBundleError(RuntimeError):
+    """
+    Raised when the model bundle is missing or was not built from the current training data.
+    """
+
+
+def hash_training_data(data_path=DATA_PATH):
+    with open(data_path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
 
-# Ensure the directory for saving models exists
-os.makedirs('models', exist_ok=True)
 
-# Load the data
-df = pd.read_csv('data.csv')
+def bundle_version(data_hash, compact=False):
+    version = f'{BUNDLE_FORMAT}-{data_hash[:12]}'
+    return f'{version}-compact' if compact else version
 
-# Standardize the 'Item' column by converting to lowercase and stripping whitespace
-df['Item'] = df['Item'].str.lower().str.strip()
 
-X = df['Item'].tolist()
-y = df['Category'].tolist()
+def load_training_data(data_path=DATA_PATH):
+    """
+    Load the item/category training data, with items lowercased and stripped.
+    """
+    df = pd.read_csv(data_path)
+
+    # Standardize the 'Item' column by converting to lowercase and stripping whitespace
+    df['Item'] = df['Item'].str.lower().str.strip()
 
-# Initialize and fit the Label Encoder
-label_encoder = LabelEncoder()
-y_encoded = label_encoder.fit_transform(y)
+    return df['Item'].tolist(), df['Category'].tolist()
 
-# Save the Label Encoder for future use
-joblib.dump(label_encoder, os.path.join('models', LABEL_ENCODER_PATH))
-print("Label encoder saved.")
 
 # Function to train the model
-def train_model(X, y, user_history=None, user_multiplier=5):
+def train_model(X, y, label_encoder, user_history=None, user_multiplier=5, max_iter=1000):
     """
     Train the Logistic Regression model with optional user history.
 
     Parameters:
     - X: List of item names from the initial dataset.
     - y: List of corresponding categories.
+    - label_encoder: Fitted LabelEncoder covering every category in y and user_history.
     - user_history: Optional list of dictionaries with 'item' and 'category' keys.
     - user_multiplier: Multiplier to weight user data higher than initial data.
+    - max_iter: Maximum number of LogisticRegression iterations.
 
     Returns:
     - Trained sklearn Pipeline model.
@@ -63,7 +90,7 @@ def train_model(X, y, user_history=None, user_multiplier=5):
     vectorizer = TfidfVectorizer()
 
     # Initialize the Logistic Regression model
-    lr_model = LogisticRegression(max_iter=1000)
+    lr_model = LogisticRegression(max_iter=max_iter)
 
     # Create the pipeline
     pipeline = make_pipeline(vectorizer, lr_model)
@@ -73,38 +100,129 @@ def train_model(X, y, user_history=None, user_multiplier=5):
 
     return pipeline
 
-# Initial training without user history
-initial_model = train_model(X, y)
 
-# Save the initial model
-joblib.dump(initial_model, os.path.join('models', INITIAL_MODEL_PATH))
-print("Initial model saved.")
+def build_bundle(data_path=DATA_PATH, bundle_path=BUNDLE_PATH, compact=False):
+    """
+    Train the base category model and write it as a versioned bundle.
 
-def retrain_model_with_user_history(user_history):
+    The bundle holds the fitted vectorizer, classifier and label encoder, the
+    category names of the classifier's classes and the hash of the training
+    data. It is written uncompressed so the server can memory-map its arrays.
+    With compact, the classifier is a CompactTextClassifier, which does its
+    own feature hashing, and the vectorizer is None.
     """
-    Retrain the model by incorporating user-specific data with higher priority.
+    data_hash = hash_training_data(data_path)
+    X, y = load_training_data(data_path)
 
-    Parameters:
-    - user_history: List of dictionaries with 'item' and 'category' keys.
+    # Initialize and fit the Label Encoder
+    label_encoder = LabelEncoder()
+    label_encoder.fit(y)
+
+    if compact:
+        vectorizer = None
+        classifier = CompactTextClassifier.fit(X, label_encoder.transform(y), max_iter=2000)
+    else:
+        pipeline = train_model(X, y, label_encoder, max_iter=2000)
+        vectorizer, classifier = pipeline.named_steps['tfidfvectorizer'], pipeline.named_steps['logisticregression']
+
+    bundle = {
+        'format': BUNDLE_FORMAT,
+        'version': bundle_version(data_hash, compact),
+        'compact': compact,
+        'data_hash': data_hash,
+        'sklearn_version': sklearn.__version__,
+        'vectorizer': vectorizer,
+        'classifier': classifier,
+        'label_encoder': label_encoder,
+        'classes': list(label_encoder.inverse_transform(classifier.classes_)),
+    }
+
+    # Write to a temporary file first, then rename, so a running server never sees a partial bundle
+    os.makedirs(os.path.dirname(bundle_path), exist_ok=True)
+    temp_path = f'{bundle_path}.tmp'
+    joblib.dump(bundle, temp_path)
+    os.replace(temp_path, bundle_path)
+    return bundle
+
+
+def load_bundle(bundle_path=BUNDLE_PATH, data_path=DATA_PATH, mmap_mode='r'):
+    """
+    Load the model bundle, memory-mapping its arrays by default.
+    Raises StaleBundleError if the bundle is missing, was built by an older
+    training setup or from different training data.
+    """
+    if not os.path.exists(bundle_path):
+        raise StaleBundleError(f"Model bundle {bundle_path} not found. Build it with: python model.py")
+
+    bundle = joblib.load(bundle_path, mmap_mode=mmap_mode)
+    if bundle.get('format') != BUNDLE_FORMAT:
+        raise StaleBundleError(f"Model bundle {bundle_path} has format {bundle.get('format')}, "
+                               f"expected {BUNDLE_FORMAT}. Rebuild it with: python model.py")
+    if bundle['data_hash'] != hash_training_data(data_path):
+        raise StaleBundleError(f"Model bundle {bundle_path} was built from a different {data_path}. "
+                               f"Rebuild it with: python model.py")
+    return bundle
+
+
+def compare_compact_model(data_path=DATA_PATH, folds=5, item_name='brown bread'):
+    """
+    Compare the compact model with the sklearn pipeline on the training data:
+    serialized size, single-item predict latency and cross-validated accuracy.
 
     Returns:
-    - Updated sklearn Pipeline model.
+    - Dictionary of the measurements, per model.
     """
-    updated_model = train_model(X, y, user_history=user_history)
-    print("Model retrained with user history.")
-    return updated_model
+    X, y = load_training_data(data_path)
+    label_encoder = LabelEncoder().fit(y)
+    X_array, y_encoded = np.array(X, dtype=object), label_encoder.transform(y)
+
+    correct = {'pipeline': 0, 'compact': 0}
+    for train, test in KFold(folds, shuffle=True, random_state=0).split(X_array):
+        pipeline = train_model(list(X_array[train]), list(np.array(y, dtype=object)[train]), label_encoder)
+        compact = CompactTextClassifier.fit(list(X_array[train]), y_encoded[train])
+        correct['pipeline'] += int((pipeline.predict(list(X_array[test])) == y_encoded[test]).sum())
+        correct['compact'] += int((compact.predict(list(X_array[test])) == y_encoded[test]).sum())
+
+    pipeline = train_model(X, y, label_encoder)
+    compact = CompactTextClassifier.fit(X, y_encoded)
+    pipeline_bytes = io.BytesIO()
+    joblib.dump(pipeline, pipeline_bytes)
+    compact_bytes = io.BytesIO()
+    compact.save(compact_bytes)
+
+    results = {}
+    for name, model, size in [('pipeline', pipeline, len(pipeline_bytes.getvalue())),
+                              ('compact', compact, len(compact_bytes.getvalue()))]:
+        timer = timeit.Timer(lambda: model.predict([item_name]))
+        number, _ = timer.autorange()
+        results[name] = {
+            'size_bytes': size,
+            'predict_us': min(timer.repeat(5, number)) / number * 1e6,
+            'accuracy': correct[name] / len(X),
+        }
+    return results
+
 
-# Example usage:
 if __name__ == "__main__":
-    # Example user history
-    example_user_history = [
-        {'item': 'brown bread', 'category': 'Bakery'},
-        {'item': 'whole grain bread', 'category': 'Bakery'}
-    ]
-
-    # Retrain the model with user history
-    updated_model = retrain_model_with_user_history(example_user_history)
-
-    # Save the updated model
-    joblib.dump(updated_model, os.path.join('models', 'updated_category_model.pkl'))
-    print("Updated model saved.")
+    parser = argparse.ArgumentParser(description="Train the base category model and write the model bundle.")
+    parser.add_argument('--data', default=DATA_PATH, help="Training data CSV with Item and Category columns")
+    parser.add_argument('--output', default=BUNDLE_PATH, help="Path of the model bundle to write")
+    parser.add_argument('--compact', action='store_true',
+                        help="Build the compact model: hashed features, int8 coefficients, NumPy predict")
+    parser.add_argument('--compare', action='store_true',
+                        help="Only compare the compact model with the pipeline, without writing a bundle")
+    args = parser.parse_args()
+
+    if args.compare:
+        results = compare_compact_model(args.data)
+        for name, result in results.items():
+            print(f"{name:<10} {result['size_bytes']:>9} bytes {result['predict_us']:>9.1f} us/predict "
+                  f"{result['accuracy']:.3f} accuracy")
+        accuracy_drop = results['pipeline']['accuracy'] - results['compact']['accuracy']
+        if accuracy_drop > COMPACT_ACCURACY_TOLERANCE:
+            raise SystemExit(f"Compact model accuracy is {accuracy_drop:.3f} below the pipeline's, "
+                             f"over the {COMPACT_ACCURACY_TOLERANCE} tolerance")
+        print(f"Compact model accuracy within {COMPACT_ACCURACY_TOLERANCE} of the pipeline's.")
+    else:
+        bundle = build_bundle(args.data, args.output, args.compact)
+        print(f"Model bundle {bundle['version']} saved to {args.output}.")
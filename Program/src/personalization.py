@@ -0,0 +1,206 @@
+import numpy as np
+from sklearn.feature_extraction.text import HashingVectorizer
+
+# Hashed feature space for the per-user correction layer. It needs no vocabulary,
+# so words the base model has never seen (e.g. a user's own brand names) can still
+# be personalized, and a user only stores weights for the features they touched.
+user_vectorizer = HashingVectorizer(n_features=2 ** 20, alternate_sign=False, norm='l2')
+
+# How far (in decision function units) a saved item's category must beat every
+# other category after an update, and how many update steps we allow per item
+PERSONALIZATION_MARGIN = 1.0
+MAX_UPDATES_PER_ITEM = 5
+
+# Number of passes over the history when rebuilding the correction layer from scratch
+REBUILD_EPOCHS = 3
+
+
+def item_features(item_name):
+    """
+    The user_vectorizer features of an item name as (feature index, value)
+    pairs. learn(item_name, ...) only changes the weights of these features.
+    """
+    hashed = user_vectorizer.transform([item_name])
+    return list(zip(hashed.indices.tolist(), hashed.data.tolist()))
+
+
+class PersonalizedModel:
+    """
+    Category model made of the shared, frozen base pipeline plus a small
+    per-user correction layer.
+
+    The correction layer is a sparse linear model over user_vectorizer features,
+    stored as {feature index: {category: weight}}. Its scores are added to the
+    base pipeline's decision function, so an empty layer predicts exactly like
+    the base model. Each saved item is learned with a passive-aggressive update
+    that only touches that item's features, which keeps saveItem independent of
+    the size of the user's history.
+    """
+
+    def __init__(self, base_pipeline, base_classes, weights=None, version=0, base_version=None):
+        self.base_pipeline = base_pipeline
+        self.base_classes = list(base_classes)
+        self.weights = weights if weights is not None else {}
+        self.version = version
+        self.base_version = base_version
+
+    def copy(self):
+        """
+        Copy the correction layer; the base pipeline is shared. The per-feature
+        weights are shared too until learn replaces them (copy on write), so
+        this is a shallow copy of the feature index.
+        """
+        return PersonalizedModel(self.base_pipeline, self.base_classes, dict(self.weights), self.version,
+                                 self.base_version)
+
+    def to_delta(self):
+        """
+        Compact form of the correction layer for storage: the weights as
+        (feature, category id, value) arrays plus the base model version they
+        were learned against. The base pipeline itself is never included.
+        """
+        categories = []
+        category_ids = {}
+        features, class_ids, values = [], [], []
+        for feature, class_weights in self.weights.items():
+            for category, weight in class_weights.items():
+                if category not in category_ids:
+                    category_ids[category] = len(categories)
+                    categories.append(category)
+                features.append(feature)
+                class_ids.append(category_ids[category])
+                values.append(weight)
+        return {
+            'base_version': self.base_version,
+            'version': self.version,
+            'categories': categories,
+            'features': np.array(features, dtype=np.int32),
+            'class_ids': np.array(class_ids, dtype=np.int16),
+            'values': np.array(values, dtype=np.float32),
+        }
+
+    @classmethod
+    def from_delta(cls, delta, base_pipeline, base_classes, base_version):
+        """
+        Rebuild a model from to_delta output on top of the given base model.
+        Callers should compare delta['base_version'] with base_version: the
+        weights stay usable after a base model change, but were tuned against
+        the old base scores.
+        """
+        categories = delta['categories']
+        weights = {}
+        for feature, class_id, value in zip(delta['features'].tolist(), delta['class_ids'].tolist(),
+                                            delta['values'].tolist()):
+            weights.setdefault(feature, {})[categories[class_id]] = value
+        return cls(base_pipeline, base_classes, weights, delta['version'], base_version)
+
+    def classes(self):
+        """
+        Base categories followed by user-only categories, in first-seen order.
+        """
+        classes = list(self.base_classes)
+        known = set(classes)
+        for class_weights in self.weights.values():
+            for category in class_weights:
+                if category not in known:
+                    known.add(category)
+                    classes.append(category)
+        return classes
+
+    def decision_function(self, item_names, classes=None):
+        """
+        Score each item against each category in classes (default: self.classes()).
+        Categories the base model doesn't know start at the item's lowest base score.
+        """
+        if classes is None:
+            classes = self.classes()
+        scores = self._base_scores(item_names, classes)
+
+        if self.weights:
+            class_index = {category: index for index, category in enumerate(classes)}
+            hashed = user_vectorizer.transform(item_names)
+            for row in range(hashed.shape[0]):
+                start, end = hashed.indptr[row], hashed.indptr[row + 1]
+                features = zip(hashed.indices[start:end], hashed.data[start:end])
+                self._add_user_scores(scores[row], features, class_index)
+        return scores
+
+    def predict(self, item_names):
+        classes = self.classes()
+        scores = self.decision_function(item_names, classes)
+        return [classes[index] for index in scores.argmax(axis=1)]
+
+    def predict_proba(self, item_names, classes=None):
+        """
+        Softmax over decision_function; for an empty correction layer this is
+        the base LogisticRegression's predict_proba.
+        """
+        scores = self.decision_function(item_names, classes)
+        scores -= scores.max(axis=1, keepdims=True)
+        probabilities = np.exp(scores)
+        probabilities /= probabilities.sum(axis=1, keepdims=True)
+        return probabilities
+
+    def learn(self, item_name, category):
+        """
+        Update the correction layer so item_name is predicted as category.
+        Returns False if the item has no usable features (it is then only
+        covered by the exact-match history lookup).
+        """
+        features = item_features(item_name)
+        if not features:
+            return False
+
+        classes = self.classes()
+        if category not in classes:
+            classes.append(category)
+        class_index = {name: index for index, name in enumerate(classes)}
+        target = class_index[category]
+        base_scores = self._base_scores([item_name], classes)[0]
+
+        for _ in range(MAX_UPDATES_PER_ITEM):
+            scores = base_scores.copy()
+            self._add_user_scores(scores, features, class_index)
+
+            target_score = scores[target]
+            scores[target] = -np.inf
+            competitor = classes[int(scores.argmax())]
+
+            loss = PERSONALIZATION_MARGIN - (target_score - scores.max())
+            if loss <= 0:
+                break
+
+            # The features are L2 normalized, so moving the target up and the
+            # competitor down by loss / 2 each closes the margin in one step
+            step = loss / 2
+            for feature, value in features:
+                # Never modified in place, copies of this model may share it
+                class_weights = dict(self.weights.get(feature, {}))
+                class_weights[category] = class_weights.get(category, 0.0) + step * value
+                class_weights[competitor] = class_weights.get(competitor, 0.0) - step * value
+                self.weights[feature] = class_weights
+
+        self.version += 1
+        return True
+
+    def rebuild(self, user_history):
+        """
+        Rebuild the correction layer from scratch over the full user history.
+        """
+        self.weights = {}
+        for _ in range(REBUILD_EPOCHS):
+            for item_name, category in user_history.items():
+                self.learn(item_name, category)
+
+    def _base_scores(self, item_names, classes):
+        base_scores = self.base_pipeline.decision_function(item_names)
+        num_base = len(self.base_classes)
+        scores = np.empty((len(item_names), len(classes)))
+        scores[:, :num_base] = base_scores
+        scores[:, num_base:] = base_scores.min(axis=1, keepdims=True)
+        return scores
+
+    def _add_user_scores(self, scores, features, class_index):
+        for feature, value in features:
+            for category, weight in self.weights.get(feature, {}).items():
+                scores[class_index[category]] += value * weight
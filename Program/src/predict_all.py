@@ -1,6 +1,9 @@
 import pandas as pd
 import joblib
 import os
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 
 label_mapping = {
@@ -27,6 +30,14 @@ label_mapping = {
     'Spices and Herbs': 20,
 }
 
+# Index -> label lookup array, built once instead of per prediction
+label_array = np.empty(len(label_mapping), dtype=object)
+for label, index in label_mapping.items():
+    label_array[index] = label
+
+# Number of CSV rows predicted and written at a time
+DEFAULT_CHUNKSIZE = 10000
+
 # Load the model and vectorizer
 def load_model_and_vectorizer():
     model = joblib.load('food_model.pkl')
@@ -38,38 +49,89 @@ def predict_top3_food_groups(food_names, model, vectorizer):
     X_new = vectorizer.transform(food_names)
     probabilities = model.predict_proba(X_new)
     
-    # Get the top 3 categories by probability for each food item
-    top_3_indices = np.argsort(probabilities, axis=1)[:, -3:][:, ::-1]  # Sort and get top 3 indices in descending order
-    top_3_categories = [[list(label_mapping.keys())[i] for i in indices] for indices in top_3_indices]
+    # Get the top 3 categories by probability for each food item: partition out the
+    # top 3 indices, then sort just those 3 in descending order of probability
+    top_3_indices = np.argpartition(probabilities, -3, axis=1)[:, -3:]
+    top_3_probabilities = np.take_along_axis(probabilities, top_3_indices, axis=1)
+    order = np.argsort(-top_3_probabilities, axis=1)
+    top_3_indices = np.take_along_axis(top_3_indices, order, axis=1)
+    top_3_categories = label_array[top_3_indices].tolist()
 
     return top_3_categories
 
-# Append top 3 predictions to the CSV file and create a new file
-def append_top3_predictions_to_csv(input_csv_path, output_csv_path):
-    # Load the CSV file
-    df = pd.read_csv(input_csv_path)
+def add_top3_predictions(df, model, vectorizer):
+    """
+    Add the 'Predicted Food Group 1-3' columns to a chunk of the food table.
+    """
+    top_3_predictions = np.array(predict_top3_food_groups(df['name'].str.lower(), model, vectorizer), dtype=object)
+    df['Predicted Food Group 1'] = top_3_predictions[:, 0]
+    df['Predicted Food Group 2'] = top_3_predictions[:, 1]
+    df['Predicted Food Group 3'] = top_3_predictions[:, 2]
+    return df
+
+# Model and vectorizer of a worker process, loaded once by init_worker
+worker_model = None
+worker_vectorizer = None
 
-    # Load the model and vectorizer
-    model, vectorizer = load_model_and_vectorizer()
+def init_worker():
+    global worker_model, worker_vectorizer
+    worker_model, worker_vectorizer = load_model_and_vectorizer()
 
-    # Predict the top 3 food groups for each food name
-    top_3_predictions = predict_top3_food_groups(df['name'].str.lower(), model, vectorizer)
+def predicted_csv_chunk(df, header, model, vectorizer):
+    """
+    Add the predictions to a chunk and format it as CSV text.
+    """
+    return add_top3_predictions(df, model, vectorizer).to_csv(header=header, index=False)
 
-    # Add the top 3 predictions as new columns
-    df['Predicted Food Group 1'] = [pred[0] for pred in top_3_predictions]
-    df['Predicted Food Group 2'] = [pred[1] for pred in top_3_predictions]
-    df['Predicted Food Group 3'] = [pred[2] for pred in top_3_predictions]
+def predicted_csv_chunk_in_worker(df, header):
+    return predicted_csv_chunk(df, header, worker_model, worker_vectorizer)
+
+def predicted_csv_chunks(chunks, workers):
+    """
+    Yield each chunk with predictions added, as CSV text in input order. Only
+    the first chunk includes the header row.
+    With workers > 1 the chunks are predicted and formatted in a process pool,
+    keeping at most two chunks per worker in flight so memory stays bounded.
+    """
+    if workers <= 1:
+        model, vectorizer = load_model_and_vectorizer()
+        for chunk_number, chunk in enumerate(chunks):
+            yield predicted_csv_chunk(chunk, chunk_number == 0, model, vectorizer)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+        in_flight = deque()
+        for chunk_number, chunk in enumerate(chunks):
+            in_flight.append(executor.submit(predicted_csv_chunk_in_worker, chunk, chunk_number == 0))
+            if len(in_flight) >= 2 * workers:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+
+# Append top 3 predictions to the CSV file and create a new file
+def append_top3_predictions_to_csv(input_csv_path, output_csv_path, chunksize=DEFAULT_CHUNKSIZE, workers=1):
+    """
+    Stream the input CSV in chunks of chunksize rows, add the top 3 predicted food
+    groups to each chunk and append it to the output CSV, so memory use does not
+    depend on the size of the input. workers > 1 predicts chunks in a process pool.
+    """
+    chunks = pd.read_csv(input_csv_path, chunksize=chunksize)
 
-    # Save the new dataframe to a new CSV file
-    df.to_csv(output_csv_path, index=False)
+    with open(output_csv_path, 'w', newline='') as output_file:
+        for csv_chunk in predicted_csv_chunks(chunks, workers):
+            output_file.write(csv_chunk)
 
     print(f"Top 3 predictions added and saved to {output_csv_path}")
 
 if __name__ == "__main__":
-    input_csv = "../public/food_data.csv"  # Replace with the path to your input CSV
-    output_csv = "../public/new_food_data.csv"  # Replace with your desired output path
+    parser = argparse.ArgumentParser(description="Add the top 3 predicted food groups to the food table.")
+    parser.add_argument('--input', default="../public/food_data.csv", help="Path to the input CSV")
+    parser.add_argument('--output', default="../public/new_food_data.csv", help="Path of the output CSV")
+    parser.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE, help="Rows processed at a time")
+    parser.add_argument('--workers', type=int, default=1, help="Processes used to predict chunks")
+    args = parser.parse_args()
 
     if not os.path.exists('food_model.pkl'):
         print("Model not found! Please train the model first.")
     else:
-        append_top3_predictions_to_csv(input_csv, output_csv)
+        append_top3_predictions_to_csv(args.input, args.output, args.chunksize, args.workers)
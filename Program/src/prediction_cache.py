@@ -0,0 +1,119 @@
+import threading
+from collections import OrderedDict
+
+
+def normalize_item_name(item_name):
+    """
+    Cache key form of an item name: lowercased, with runs of whitespace
+    collapsed. The category models tokenize on words, so this never changes
+    a prediction.
+    """
+    return ' '.join(item_name.lower().split())
+
+
+def prediction_key(user_id, model, item_name):
+    """
+    Identity of a prediction: equal keys always predict the same category.
+    Users without personal corrections share keys with the base model.
+    """
+    if not model.weights:
+        return ('base', model.base_version, normalize_item_name(item_name))
+    return (str(user_id), model.version, normalize_item_name(item_name))
+
+
+class PredictionCache:
+    """
+    LRU cache of predicted categories.
+
+    Users without personal corrections predict exactly like the base model,
+    so they share entries keyed by (base model version, item name). Users
+    with corrections get their own entries, tagged with their model version:
+    a lookup with a newer version (e.g. after saveItem) drops that user's
+    entries, so stale predictions are never served. Users are evicted least
+    recently used first, as are shared entries.
+    """
+
+    def __init__(self, max_shared_entries=100000, max_users=1024, max_entries_per_user=1000):
+        self.max_shared_entries = max_shared_entries
+        self.max_users = max_users
+        self.max_entries_per_user = max_entries_per_user
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._shared = OrderedDict()  # (base_version, item_name) -> category
+        self._users = OrderedDict()   # user_id -> (model version, OrderedDict of item_name -> category)
+        self._lock = threading.Lock()
+
+    def get(self, user_id, model, item_name):
+        """
+        Return the cached category of item_name for this user's model, or None on a miss.
+        """
+        with self._lock:
+            entries = self._entries(user_id, model)
+            key = self._key(model, item_name)
+            category = entries.get(key) if entries is not None else None
+            if category is None:
+                self.misses += 1
+                return None
+            entries.move_to_end(key)
+            self.hits += 1
+            return category
+
+    def put(self, user_id, model, item_name, category):
+        with self._lock:
+            entries = self._entries(user_id, model, create=True)
+            key = self._key(model, item_name)
+            entries[key] = category
+            entries.move_to_end(key)
+            limit = self.max_shared_entries if entries is self._shared else self.max_entries_per_user
+            while len(entries) > limit:
+                entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        """
+        Drop a user's personal entries. Shared entries are kept.
+        """
+        with self._lock:
+            if self._users.pop(str(user_id), None) is not None:
+                self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'shared_entries': len(self._shared),
+                'users': len(self._users),
+                'user_entries': sum(len(entries) for _, entries in self._users.values()),
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+            }
+
+    def _key(self, model, item_name):
+        item_name = normalize_item_name(item_name)
+        return (model.base_version, item_name) if not model.weights else item_name
+
+    def _entries(self, user_id, model, create=False):
+        """
+        The entries model predictions are cached in. Must hold the lock.
+        """
+        if not model.weights:
+            return self._shared
+
+        key = str(user_id)
+        user = self._users.get(key)
+        if user is not None and user[0] != model.version:
+            # The user's model changed since these predictions were cached
+            del self._users[key]
+            self.invalidations += 1
+            user = None
+        if user is None:
+            if not create:
+                return None
+            user = (model.version, OrderedDict())
+            self._users[key] = user
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        self._users.move_to_end(key)
+        return user[1]
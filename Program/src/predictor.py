@@ -5,9 +5,15 @@ from sklearn.linear_model import LogisticRegression
 from sklearn.metrics import classification_report
 import numpy as np
 import joblib
+import logging
 import os
 import sys
 
+from compact_model import CompactTextClassifier
+from model import hash_training_data
+
+logger = logging.getLogger(__name__)
+
 label_mapping = {
     'Baked Foods': 0,
     'Snacks': 1,
@@ -32,6 +38,20 @@ label_mapping = {
     'Spices and Herbs': 20,
 }
 
+# Index -> label lookup array, the reverse of label_mapping
+label_array = np.empty(len(label_mapping), dtype=object)
+for label, index in label_mapping.items():
+    label_array[index] = label
+
+FOOD_DATA_PATH = '../public/food_data.csv'
+
+MODEL_PATH = 'food_model.pkl'
+VECTORIZER_PATH = 'vectorizer.pkl'
+
+# Compact model (hashed features, int8 coefficients, NumPy predict), used instead
+# of the pickled model and vectorizer when present
+COMPACT_MODEL_PATH = 'food_model_compact.npz'
+
 # Step 1: Load data from the CSV file
 def load_data(file_path):
     df = pd.read_csv(file_path)
@@ -52,55 +72,127 @@ def extract_features(df):
     return X, vectorizer
 
 # Step 4: Train and save the model
-def train_and_save_model(file_path):
+def train_and_save_model(file_path, compact=False):
+    """
+    Train the food group model on food_data.csv. With compact, train a
+    CompactTextClassifier on the names and save it to COMPACT_MODEL_PATH,
+    with the hash of file_path so get_predictor can tell when it is stale.
+    """
     df = load_data(file_path)
     df = preprocess_data(df)
 
-    X, vectorizer = extract_features(df)
-    y = df['Food Group']
+    if compact:
+        names_train, names_test, y_train, y_test = train_test_split(
+            df['name'].tolist(), df['Food Group'], test_size=0.2, random_state=42)
+        model = CompactTextClassifier.fit(names_train, y_train, stop_words=True)
+        model.data_hash = hash_training_data(file_path)
+        model.save(COMPACT_MODEL_PATH)
+        X_test = names_test
+    else:
+        X, vectorizer = extract_features(df)
+        y = df['Food Group']
+
+        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
 
-    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+        model = LogisticRegression(max_iter=1000)
+        model.fit(X_train, y_train)
 
-    model = LogisticRegression(max_iter=1000)
-    model.fit(X_train, y_train)
+        # Save the model and vectorizer
+        joblib.dump(model, MODEL_PATH)
+        joblib.dump(vectorizer, VECTORIZER_PATH)
 
-    # Save the model and vectorizer
-    joblib.dump(model, 'food_model.pkl')
-    joblib.dump(vectorizer, 'vectorizer.pkl')
+    # Make the next prediction pick up the new model
+    global default_predictor
+    default_predictor = None
 
     y_pred = model.predict(X_test)
     print("Classification Report:\n", classification_report(y_test, y_pred))
 
 # Step 5: Predict food groups for new items and check filters
-def predict_food_groups(food_names):
-    # Load the model and vectorizer
-    model = joblib.load('food_model.pkl')
-    vectorizer = joblib.load('vectorizer.pkl')
+class FoodGroupPredictor:
+    """
+    Food group classifier and vectorizer, loaded once and kept in memory.
+    """
 
-    # Transform the input food names
-    X_new = vectorizer.transform(food_names)
-    
-    # Predict food groups
-    predictions = model.predict(X_new)
-    return predictions
+    def __init__(self, model_path=MODEL_PATH, vectorizer_path=VECTORIZER_PATH, compact_model_path=None):
+        if compact_model_path is not None:
+            self.model = CompactTextClassifier.load(compact_model_path)
+            self.vectorizer = None
+        else:
+            self.model = joblib.load(model_path)
+            self.vectorizer = joblib.load(vectorizer_path)
+
+    def predict(self, food_names):
+        """
+        Predicted label_mapping index for each food name.
+        """
+        if self.vectorizer is None:
+            # The compact model hashes the names itself
+            return self.model.predict([food_name.lower() for food_name in food_names]).astype(int)
+        X_new = self.vectorizer.transform(food_names)
+        return self.model.predict(X_new).astype(int)
+
+    def predict_labels(self, food_names):
+        return label_array[self.predict(food_names)]
+
+    def visible_mask(self, food_names, category_filters):
+        """
+        Boolean array telling which food names fall into a category enabled in category_filters.
+        """
+        visible_by_index = np.array([bool(category_filters.get(label, False)) for label in label_array])
+        return visible_by_index[self.predict(food_names)]
+
+    def filter_visible(self, food_names, category_filters):
+        """
+        The food names that fall into a category enabled in category_filters, in input order.
+        """
+        food_names = list(food_names)
+        mask = self.visible_mask(food_names, category_filters)
+        return [food_name for food_name, visible in zip(food_names, mask) if visible]
+
+# Shared predictor, created on first use
+default_predictor = None
+
+def get_predictor(data_path=FOOD_DATA_PATH):
+    """
+    The shared predictor: the compact model if it was trained on the current
+    data_path, as model.load_bundle checks for the category bundle, the
+    pickled model otherwise. A compact model saved without a data hash
+    counts as stale; without data_path there is nothing to check against.
+    """
+    global default_predictor
+    if default_predictor is None:
+        predictor = None
+        if os.path.exists(COMPACT_MODEL_PATH):
+            predictor = FoodGroupPredictor(compact_model_path=COMPACT_MODEL_PATH)
+            if os.path.exists(data_path) and predictor.model.data_hash != hash_training_data(data_path):
+                logger.warning(f"{COMPACT_MODEL_PATH} was not trained on the current {data_path}, using "
+                               f"{MODEL_PATH} instead. Delete it and retrain with: python predictor.py --compact")
+                predictor = None
+        default_predictor = predictor or FoodGroupPredictor()
+    return default_predictor
+
+def predict_food_groups(food_names):
+    return get_predictor().predict(food_names)
 
 # Check if the food item is within the category filters
 def is_item_visible(food_name, category_filters):
-    predictions = predict_food_groups([food_name])
-    category = list(label_mapping.keys())[list(label_mapping.values()).index(predictions[0])]
-    return category_filters.get(category, False)
+    return bool(get_predictor().visible_mask([food_name], category_filters)[0])
 
 if __name__ == "__main__":
+    # --compact trains and uses the compact model instead of the pickled one
+    compact = '--compact' in sys.argv[1:]
+    arguments = [argument for argument in sys.argv[1:] if argument != '--compact']
+
     # Check if the model exists
-    if not os.path.exists('food_model.pkl'):
-        file_path = '../public/food_data.csv'  # Replace with your file path
-        train_and_save_model(file_path)
+    if not os.path.exists(COMPACT_MODEL_PATH if compact else MODEL_PATH):
+        train_and_save_model(FOOD_DATA_PATH, compact)
     else:
         print("Model already exists. Skipping training.")
 
     # Get the food item from command line arguments
-    if len(sys.argv) > 1:
-        food_item = sys.argv[1].lower()  # Get the food item name from the command line
+    if arguments:
+        food_item = arguments[0].lower()  # Get the food item name from the command line
         # Define the category filters (This could be dynamic based on your needs)
         category_filters = {
             'Baked Foods': True,
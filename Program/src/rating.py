@@ -0,0 +1,292 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+# Default locations, relative to this file so the server (run from src/) and the
+# batch jobs (run from public/) share the same data and fitted pipeline
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+FOOD_DATA_PATH = os.path.join(BASE_DIR, '..', 'public', 'food_data.csv')
+RATING_PIPELINE_PATH = os.path.join(BASE_DIR, 'models', 'rating_pipeline.json')
+
+# Bump when the rating logic changes, so pipelines saved by older code are refitted
+RATING_PIPELINE_FORMAT = 1
+
+# Nutrient columns in the order of a nutrient profile
+NUTRIENT_COLUMNS = [
+    'Calories', 'Fat (g)', 'Saturated Fats (g)', 'Trans Fatty Acids (g)',
+    'Fatty acids, total monounsaturated (mg)', 'Fatty acids, total polyunsaturated (mg)',
+    'Protein (g)', 'Carbohydrate (g)', 'Sugars (g)', 'Fiber (g)',
+    'Calcium (mg)', 'Iron, Fe (mg)', 'Potassium, K (mg)', 'Magnesium (mg)',
+    'Vitamin A, RAE (mcg)', 'Vitamin C (mg)', 'Vitamin D (mcg)', 'Vitamin E (Alpha-Tocopherol) (mg)',
+    'Vitamin B-12 (mcg)', 'Folate (B9) (mcg)'
+]
+
+FOOD_GROUP_COLUMNS = ['Predicted Food Group 1', 'Predicted Food Group 2', 'Predicted Food Group 3']
+
+# Range the nutrients are normalized to before rating
+NORMALIZED_RANGE = (0, 10)
+
+# Score adjustments per food group (category)
+CATEGORY_RATINGS = {
+    'Fruits': 3, 'Vegetables': 3, 'Snacks': -2, 'Sweets': -3, 'Fast Foods': -3,
+    'Fish': 3, 'Meats': 3, 'Dairy and Egg Products': 3, 'Baked Foods': 1,
+    'Restaurant Foods': 0, 'Beans and Lentils': 3, 'Nuts and Seeds': 3,
+    'Grains and Pasta': -1, 'Spices and Herbs': 0, 'Fats and Oils': 0, 'Baby Foods': +2
+}
+
+# Base nutrient rating terms as (nutrient profile index, weight), in the order rate_food sums them
+BASE_RATING_TERMS = [
+    (6, 0.15), (9, 0.1), (7, -0.02), (1, 0.1), (8, -0.35),   # protein, fiber, carbs, total fat, sugars
+    (10, 0.20), (11, 0.20), (12, 0.05), (13, 0.05),           # calcium, iron, potassium, magnesium
+    (14, 0.15), (15, 0.15), (16, 0.15), (17, 0.15),           # vitamins A, C, D, E
+    (18, 0.15), (19, 0.05)                                    # vitamin B12, folate
+]
+
+
+def rate_food(nutrient_profile, food_name, food_group_1, food_group_2, food_group_3):
+    """
+    Rate a single normalized nutrient profile with the default weights.
+    Reference implementation of rate_foods.
+    """
+    (calories, total_fat, saturated_fat, trans_fat, monounsaturated_fat, polyunsaturated_fat,
+     protein, carbs, sugars, fiber, calcium, iron, potassium, magnesium,
+     vitamin_a, vitamin_c, vitamin_d, vitamin_e, vitamin_b12, folate) = nutrient_profile
+
+    # Base nutrient rating
+    rating = (
+        0.15 * protein + 0.1 * fiber - 0.02 * carbs + 0.1 * total_fat - 0.35 * sugars +
+        0.20 * calcium + 0.20 * iron + 0.05 * potassium + 0.05 * magnesium +
+        0.15 * vitamin_a + 0.15 * vitamin_c + 0.15 * vitamin_d + 0.15 * vitamin_e +
+        0.15 * vitamin_b12 + 0.05 * folate
+    )
+
+    # Adjust the score based on healthy vs. unhealthy fats
+    rating += 0.1 * (monounsaturated_fat + polyunsaturated_fat)  # Reward healthy fats
+    rating -= 0.4 * (saturated_fat + trans_fat)  # Penalize unhealthy fats
+
+    # Add calorie control: slightly penalize extremely high-calorie foods
+    if calories < 60:
+        rating += 1
+    if calories > 250:
+        rating -= 0.1 * (calories - 500) / 100
+
+    # Adjust score based on food groups (categories)
+    if "Infant" in food_name and rating < 4:
+        rating += 7  # Reward for infant food
+    else:
+        food_groups = [food_group_1, food_group_2, food_group_3]
+        for group in food_groups:
+            if group in CATEGORY_RATINGS:
+                rating += CATEGORY_RATINGS[group]  # Add the category rating directly
+
+    # Ensure the rating is within 0-10
+    return max(0, min(10, rating))
+
+
+def encode_food_groups(food_groups, category_ratings=CATEGORY_RATINGS):
+    """
+    Encode food group columns as an (n, len(food_groups)) array of indices into
+    category_ratings. Groups without a rating are encoded as -1.
+    """
+    rated_groups = pd.Index(list(category_ratings))
+    return np.column_stack([rated_groups.get_indexer(groups) for groups in food_groups])
+
+
+def infant_food_mask(food_names):
+    """
+    Boolean mask of the food names that contain "Infant".
+    """
+    return pd.Series(food_names).str.contains("Infant", regex=False, na=False).to_numpy()
+
+
+def rate_foods(normalized_nutrients, infant_foods, food_group_codes,
+               base_rating_terms=BASE_RATING_TERMS, category_ratings=CATEGORY_RATINGS):
+    """
+    Vectorized rate_food over the whole normalized nutrient matrix.
+
+    Parameters:
+    - normalized_nutrients: (n, 20) matrix in NUTRIENT_COLUMNS order.
+    - infant_foods: Boolean mask from infant_food_mask.
+    - food_group_codes: (n, 3) group indices from encode_food_groups.
+
+    Returns:
+    - Array of ratings equal to calling rate_food row by row.
+    """
+    # One contiguous row per nutrient, so each term below is a single pass over memory
+    nutrients = np.ascontiguousarray(np.asarray(normalized_nutrients, dtype=float).T)
+    calories = nutrients[0]
+
+    # Base nutrient rating: the weight vector applied term by term, in the same
+    # order rate_food adds them, so the sums are bit-for-bit equal
+    (first_column, first_weight), *other_terms = base_rating_terms
+    rating = nutrients[first_column] * first_weight
+    for column, weight in other_terms:
+        rating += nutrients[column] * weight
+
+    # Healthy vs. unhealthy fats
+    rating += 0.1 * (nutrients[4] + nutrients[5])
+    rating -= 0.4 * (nutrients[2] + nutrients[3])
+
+    # Calorie control
+    rating[calories < 60] += 1
+    high_calories = calories > 250
+    rating[high_calories] -= 0.1 * (calories[high_calories] - 500) / 100
+
+    # Food group bonuses, the trailing 0 is picked up by unrated groups (-1)
+    group_bonus = np.append(np.array(list(category_ratings.values()), dtype=float), 0.0)
+    grouped_rating = rating.copy()
+    for group in range(food_group_codes.shape[1]):
+        grouped_rating += group_bonus[food_group_codes[:, group]]
+
+    # Infant food override replaces the group bonuses
+    infant_override = infant_foods & (rating < 4)
+    rating = np.where(infant_override, rating + 7, grouped_rating)
+
+    # Ensure the rating is within 0-10
+    return np.clip(rating, 0, 10)
+
+
+def read_food_data(file_path=FOOD_DATA_PATH):
+    """
+    Read the food table with the nutrient columns converted to numbers, missing
+    or unparseable values count as 0.
+    """
+    # Read the CSV file with low_memory=False to avoid DtypeWarning
+    food_data = pd.read_csv(file_path, low_memory=False)
+
+    # Convert selected columns to numeric, forcing errors to NaN
+    for col in NUTRIENT_COLUMNS:
+        food_data[col] = pd.to_numeric(food_data[col], errors='coerce')
+
+    food_data[NUTRIENT_COLUMNS] = food_data[NUTRIENT_COLUMNS].fillna(0)
+    return food_data
+
+
+def hash_file(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class RatingPipeline:
+    """
+    Compiled food rating pipeline: the nutrient column schema, the fitted
+    min/max normalization, the rating weights and food group bonuses, and the
+    maximum rating used to rescale ratings to 0-10.
+
+    Fitting computes the same normalization as
+    MinMaxScaler(feature_range=(0, 10)). A fitted pipeline is saved as JSON so
+    the server and the batch jobs rate with identical parameters, and nothing
+    refits it per request.
+    """
+
+    def __init__(self, data_min, data_max, max_rating, data_hash=None,
+                 base_rating_terms=BASE_RATING_TERMS, category_ratings=CATEGORY_RATINGS,
+                 nutrient_columns=NUTRIENT_COLUMNS):
+        self.max_rating = float(max_rating)
+        self.data_hash = data_hash
+        self.base_rating_terms = [(int(column), float(weight)) for column, weight in base_rating_terms]
+        self.category_ratings = dict(category_ratings)
+        self.nutrient_columns = list(nutrient_columns)
+        self.set_bounds(data_min, data_max)
+
+    def set_bounds(self, data_min, data_max):
+        """
+        Set the per-column minimum and maximum the nutrients are normalized with.
+        """
+        self.data_min = np.array(data_min, dtype=float)
+        self.data_max = np.array(data_max, dtype=float)
+
+        # Same arithmetic as MinMaxScaler.transform, so normalized values match it exactly
+        data_range = self.data_max - self.data_min
+        data_range[data_range < 10 * np.finfo(data_range.dtype).eps] = 1.0
+        self.scale = (NORMALIZED_RANGE[1] - NORMALIZED_RANGE[0]) / data_range
+        self.offset = NORMALIZED_RANGE[0] - self.data_min * self.scale
+
+    @classmethod
+    def fit(cls, food_data, data_hash=None, nutrients=None, **kwargs):
+        """
+        Fit the normalization and maximum rating on a table from read_food_data,
+        or on the nutrient matrix and frame of a FoodTable.
+        """
+        if nutrients is None:
+            nutrients = food_data[NUTRIENT_COLUMNS].to_numpy(dtype=float)
+        pipeline = cls(nutrients.min(axis=0), nutrients.max(axis=0), 1.0, data_hash, **kwargs)
+        pipeline.max_rating = float(pipeline.rate(food_data, nutrients).max())
+        return pipeline
+
+    def normalize(self, nutrients):
+        return np.asarray(nutrients, dtype=float) * self.scale + self.offset
+
+    def rate(self, food_data, nutrients=None):
+        """
+        Unscaled 0-10 ratings for every row of food_data.
+        """
+        if nutrients is None:
+            nutrients = food_data[self.nutrient_columns].to_numpy(dtype=float)
+        food_group_codes = encode_food_groups([food_data[col] for col in FOOD_GROUP_COLUMNS], self.category_ratings)
+        return rate_foods(self.normalize(nutrients), infant_food_mask(food_data['name']), food_group_codes,
+                          self.base_rating_terms, self.category_ratings)
+
+    def score(self, food_data, nutrients=None):
+        """
+        Add the 'Rating' and 'Scaled Rating' columns to food_data and return it.
+        """
+        food_data['Rating'] = self.rate(food_data, nutrients)
+        food_data['Scaled Rating'] = food_data['Rating'] / self.max_rating * 10
+        return food_data
+
+    def to_dict(self):
+        return {
+            'format': RATING_PIPELINE_FORMAT,
+            'data_hash': self.data_hash,
+            'nutrient_columns': self.nutrient_columns,
+            'data_min': self.data_min.tolist(),
+            'data_max': self.data_max.tolist(),
+            'max_rating': self.max_rating,
+            'base_rating_terms': self.base_rating_terms,
+            'category_ratings': self.category_ratings,
+        }
+
+    def save(self, path=RATING_PIPELINE_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f'{path}.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path=RATING_PIPELINE_PATH):
+        with open(path) as f:
+            state = json.load(f)
+        if state.get('format') != RATING_PIPELINE_FORMAT:
+            raise ValueError(f"Rating pipeline {path} has format {state.get('format')}, "
+                             f"expected {RATING_PIPELINE_FORMAT}")
+        return cls(state['data_min'], state['data_max'], state['max_rating'], state['data_hash'],
+                   state['base_rating_terms'], state['category_ratings'], state['nutrient_columns'])
+
+
+def load_or_fit_pipeline(food_table, food_data=None, pipeline_path=RATING_PIPELINE_PATH):
+    """
+    Load the saved rating pipeline if it was fitted on the same food data as
+    food_table (a FoodTable), otherwise fit it and save it. food_data defaults
+    to food_table.frame().
+    """
+    if os.path.exists(pipeline_path):
+        try:
+            pipeline = RatingPipeline.load(pipeline_path)
+            if pipeline.data_hash == food_table.data_hash and pipeline.nutrient_columns == NUTRIENT_COLUMNS:
+                return pipeline
+        except (ValueError, KeyError):
+            pass
+
+    if food_data is None:
+        food_data = food_table.frame()
+    pipeline = RatingPipeline.fit(food_data, food_table.data_hash, food_table.nutrients)
+    pipeline.save(pipeline_path)
+    return pipeline
@@ -0,0 +1,153 @@
+import numpy as np
+
+# Above this fraction of rescored foods, update rebuilds the index instead of moving rows one by one
+REBUILD_FRACTION = 0.05
+
+
+class SortedRatings:
+    """
+    Rows ordered by descending scaled rating, ties by ascending row.
+
+    Ratings are kept negated so both arrays are in ascending order and
+    numpy.searchsorted finds any rating or rating range in O(log n).
+    """
+
+    def __init__(self, rows, ratings):
+        keys = -np.asarray(ratings, dtype=float)
+        order = np.lexsort((rows, keys))
+        self.rows = np.asarray(rows, dtype=np.intp)[order]
+        self.keys = keys[order]
+
+    def __len__(self):
+        return len(self.rows)
+
+    def between(self, low=None, high=None):
+        """
+        (start, end) positions of the rows rated between low and high, inclusive.
+        """
+        start = 0 if high is None else int(np.searchsorted(self.keys, -high, 'left'))
+        end = len(self.keys) if low is None else int(np.searchsorted(self.keys, -low, 'right'))
+        return start, max(start, end)
+
+    def remove(self, row, rating):
+        position = self._position(row, -rating)
+        if position >= len(self.rows) or self.rows[position] != row:
+            raise KeyError(row)
+        self.rows = np.delete(self.rows, position)
+        self.keys = np.delete(self.keys, position)
+
+    def insert(self, row, rating):
+        position = self._position(row, -rating)
+        self.rows = np.insert(self.rows, position, row)
+        self.keys = np.insert(self.keys, position, -rating)
+
+    def _position(self, row, key):
+        start = np.searchsorted(self.keys, key, 'left')
+        end = np.searchsorted(self.keys, key, 'right')
+        return int(start + np.searchsorted(self.rows[start:end], row))
+
+
+class RatingIndex:
+    """
+    Sorted index over the scaled ratings of a RatingStore: one ordering of all
+    foods plus one per predicted food group, so top N and rating range queries,
+    with or without a food group, take O(log n + k).
+
+    Group filters never rebuild anything: including a group picks its
+    ordering, excluding groups masks the chosen ordering. After the store
+    changes, pass the rescored IDs to update.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.rebuild()
+
+    def rebuild(self):
+        store = self.store
+        ratings = np.array(store.scaled_ratings())
+        all_rows = np.arange(len(store))
+
+        self._groups_of_row = [{group for group in groups if isinstance(group, str)} for groups in store.food_groups]
+        group_rows = {}
+        for row, groups in enumerate(self._groups_of_row):
+            for group in groups:
+                group_rows.setdefault(group, []).append(row)
+
+        self._ratings = ratings
+        self._all = SortedRatings(all_rows, ratings)
+        self._groups = {group: SortedRatings(np.array(rows), ratings[rows]) for group, rows in group_rows.items()}
+
+    def update(self, food_ids):
+        """
+        Move the given foods to their current position and food groups. Pass
+        the 'rescored' IDs of RatingStore.add or update together with the IDs
+        that were updated, since a food group change alone may not change the
+        scaled rating.
+        """
+        store = self.store
+        rows = list(dict.fromkeys(store.row_of[str(food_id)] for food_id in food_ids))
+        if len(rows) > REBUILD_FRACTION * len(store):
+            # Many changes: one sort is cheaper than moving rows one by one
+            self.rebuild()
+            return
+
+        ratings = np.array(store.scaled_ratings())
+        self._groups_of_row.extend(set() for _ in range(len(store) - len(self._groups_of_row)))
+        for row in rows:
+            new_groups = {group for group in store.food_groups[row] if isinstance(group, str)}
+            if row < len(self._ratings):
+                old_rating = self._ratings[row]
+                self._all.remove(row, old_rating)
+                for group in self._groups_of_row[row]:
+                    self._groups[group].remove(row, old_rating)
+
+            self._all.insert(row, ratings[row])
+            for group in new_groups:
+                if group not in self._groups:
+                    self._groups[group] = SortedRatings(np.empty(0, dtype=np.intp), np.empty(0))
+                self._groups[group].insert(row, ratings[row])
+            self._groups_of_row[row] = new_groups
+        self._ratings = ratings
+
+    def groups(self):
+        return sorted(self._groups)
+
+    def top(self, n=10, group=None, offset=0, exclude=()):
+        """
+        The n highest rated foods, optionally within a food group and without
+        the excluded groups, starting at offset.
+        """
+        return self.between(None, None, group, offset, n, exclude)
+
+    def between(self, low=None, high=None, group=None, offset=0, limit=None, exclude=()):
+        """
+        Foods rated between low and high (inclusive), highest first.
+
+        Returns:
+        - (total number of matching foods, list of food dicts for the page)
+        """
+        ordering = self._all if group is None else self._groups.get(group)
+        if ordering is None:
+            return 0, []
+        start, end = ordering.between(low, high)
+        rows = ordering.rows[start:end]
+
+        excluded = [self._groups[group] for group in exclude if group in self._groups]
+        if excluded:
+            keep = np.ones(len(self._ratings), dtype=bool)
+            for excluded_group in excluded:
+                keep[excluded_group.rows] = False
+            rows = rows[keep[rows]]
+
+        total = len(rows)
+        end = total if limit is None else offset + limit
+        return total, [self.food(row) for row in rows[offset:end]]
+
+    def food(self, row):
+        store = self.store
+        return {
+            'food_id': store.ids[row],
+            'name': store.names[row],
+            'food_groups': store.food_groups[row],
+            'scaled_rating': float(self._ratings[row]),
+        }
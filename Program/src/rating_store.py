@@ -0,0 +1,228 @@
+import math
+
+import numpy as np
+
+from rating import FOOD_GROUP_COLUMNS, encode_food_groups, infant_food_mask, rate_foods
+
+
+def nutrient_value(value):
+    """
+    Parse a nutrient value the way read_food_data does: anything that isn't a
+    number counts as 0.
+    """
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return 0.0
+    return 0.0 if math.isnan(value) else value
+
+
+class RatingStore:
+    """
+    In-memory ratings of every food, kept up to date as single rows change.
+
+    The store keeps the nutrient matrix, the raw and scaled ratings and the
+    fitted RatingPipeline, whose per-column min/max and global maximum rating
+    it maintains. Adding or updating foods only re-rates the changed rows as
+    long as no normalization bound moves; a moved bound re-rates every row in
+    one vectorized pass. A changed maximum rating only rescales the scaled
+    ratings, it never re-rates.
+
+    add and update return which foods got a new scaled rating, so callers
+    can refresh what they derived from it.
+    """
+
+    def __init__(self, pipeline, ids, names, food_groups, nutrients):
+        """
+        Parameters:
+        - pipeline: RatingPipeline fitted on exactly these rows.
+        - ids, names: Food IDs and names, one per row.
+        - food_groups: The predicted food group columns, as in FOOD_GROUP_COLUMNS.
+        - nutrients: (n, 20) nutrient matrix in pipeline.nutrient_columns order.
+        """
+        self.pipeline = pipeline
+        self.ids = [str(food_id) for food_id in ids]
+        self.row_of = {food_id: row for row, food_id in enumerate(self.ids)}
+        if len(self.row_of) != len(self.ids):
+            raise ValueError("Food IDs must be unique.")
+        self.names = [name if isinstance(name, str) else '' for name in names]
+        self.food_groups = [list(groups) for groups in zip(*food_groups)]
+
+        self._size = len(self.ids)
+        self._nutrients = np.array(nutrients, dtype=float, order='F')
+        self._group_codes = encode_food_groups(food_groups, pipeline.category_ratings).reshape(self._size, -1)
+        self._infant_foods = np.array(infant_food_mask(self.names))
+        self._ratings = self._rate(slice(0, self._size))
+        self._scaled = self._ratings / pipeline.max_rating * 10
+
+    @classmethod
+    def from_table(cls, food_table, pipeline):
+        food_data = food_table.frame()
+        food_groups = [food_data[col].astype(object).where(food_data[col].notna(), None).tolist()
+                       for col in FOOD_GROUP_COLUMNS]
+        return cls(pipeline, food_table.ids.tolist(), food_table.names.tolist(), food_groups,
+                   food_table.nutrients)
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, food_id):
+        return str(food_id) in self.row_of
+
+    def get(self, food_id, default=None):
+        """
+        Scaled rating of a food, or default if the ID is unknown.
+        """
+        row = self.row_of.get(str(food_id))
+        return default if row is None else float(self._scaled[row])
+
+    def rating(self, food_id):
+        """
+        Unscaled rating of a food. Raises KeyError if the ID is unknown.
+        """
+        return float(self._ratings[self.row_of[str(food_id)]])
+
+    def scaled_ratings(self):
+        """
+        Read-only view of the scaled rating of every row, in row order.
+        """
+        view = self._scaled[:self._size]
+        view.flags.writeable = False
+        return view
+
+    def normalized_nutrients(self, rows=None):
+        """
+        Nutrients of the given rows (default: every row) as the rating pipeline
+        normalizes them.
+        """
+        if rows is None:
+            rows = slice(0, self._size)
+        return self.pipeline.normalize(self._nutrients[rows])
+
+    def add(self, foods):
+        """
+        Add new foods. Each food is a dict with an 'ID' and optionally 'name',
+        the FOOD_GROUP_COLUMNS and nutrient columns; missing nutrients count as 0.
+        Raises ValueError if an ID already exists.
+        """
+        ids = [str(food['ID']) for food in foods]
+        if len(set(ids)) != len(ids) or any(food_id in self.row_of for food_id in ids):
+            raise ValueError("Food IDs must be unique.")
+
+        start = self._size
+        self._reserve(start + len(foods))
+        rows = np.arange(start, start + len(foods))
+        for row, food_id, food in zip(rows, ids, foods):
+            self.ids.append(food_id)
+            self.row_of[food_id] = row
+            self.names.append('')
+            self.food_groups.append([None] * len(FOOD_GROUP_COLUMNS))
+            self._nutrients[row] = 0.0
+            self._ratings[row] = 0.0
+            self._scaled[row] = np.nan  # every added row is reported
+        self._size += len(foods)
+
+        # New rows can only widen the bounds, never narrow them
+        return self._apply(rows, foods, narrowing=False)
+
+    def update(self, foods):
+        """
+        Update existing foods. Each food is a dict with an 'ID' and the fields
+        to change, as in add. Raises KeyError if an ID is unknown.
+        """
+        rows = np.array([self.row_of[str(food['ID'])] for food in foods], dtype=np.intp)
+        return self._apply(rows, foods, narrowing=True)
+
+    def _apply(self, rows, foods, narrowing):
+        pipeline = self.pipeline
+        old_nutrients = self._nutrients[rows].copy()
+
+        for row, food in zip(rows, foods):
+            for column, col in enumerate(pipeline.nutrient_columns):
+                if col in food:
+                    self._nutrients[row, column] = nutrient_value(food[col])
+            if 'name' in food:
+                self.names[row] = food['name'] if isinstance(food['name'], str) else ''
+                self._infant_foods[row] = 'Infant' in self.names[row]
+            for group, col in enumerate(FOOD_GROUP_COLUMNS):
+                if col in food:
+                    self.food_groups[row][group] = food[col]
+                    self._group_codes[row, group] = encode_food_groups([[food[col]]], pipeline.category_ratings)[0, 0]
+
+        old_max_rating = pipeline.max_rating
+        full_rebuild = self._update_bounds(rows, old_nutrients, narrowing)
+        if full_rebuild:
+            self._ratings[:self._size] = self._rate(slice(0, self._size))
+            self._update_max_rating(np.arange(self._size), narrowing=True)
+        else:
+            old_ratings = self._ratings[rows].copy()
+            self._ratings[rows] = self._rate(rows)
+            self._update_max_rating(rows, narrowing, old_ratings)
+
+        if full_rebuild or pipeline.max_rating != old_max_rating:
+            # Every scaled rating depends on the bounds and the maximum rating
+            old_scaled = self._scaled[:self._size].copy()
+            self._scaled[:self._size] = self._ratings[:self._size] / pipeline.max_rating * 10
+            changed = np.flatnonzero(self._scaled[:self._size] != old_scaled)
+        else:
+            old_scaled = self._scaled[rows].copy()
+            self._scaled[rows] = self._ratings[rows] / pipeline.max_rating * 10
+            changed = np.unique(rows[self._scaled[rows] != old_scaled])
+
+        return {
+            'rescored': [self.ids[row] for row in changed],
+            'full_rebuild': bool(full_rebuild),
+        }
+
+    def _update_bounds(self, rows, old_nutrients, narrowing):
+        """
+        Update the pipeline's normalization bounds for the changed rows.
+        Returns True if a bound moved.
+        """
+        pipeline = self.pipeline
+        new_nutrients = self._nutrients[rows]
+        data_min = np.minimum(pipeline.data_min, new_nutrients.min(axis=0))
+        data_max = np.maximum(pipeline.data_max, new_nutrients.max(axis=0))
+
+        if narrowing:
+            # A bound can only narrow if a row that sat on it changed; only those columns are rescanned
+            changed = new_nutrients != old_nutrients
+            on_min = ((old_nutrients == pipeline.data_min) & changed).any(axis=0)
+            on_max = ((old_nutrients == pipeline.data_max) & changed).any(axis=0)
+            for column in np.flatnonzero(on_min | on_max):
+                values = self._nutrients[:self._size, column]
+                data_min[column], data_max[column] = values.min(), values.max()
+
+        if np.array_equal(data_min, pipeline.data_min) and np.array_equal(data_max, pipeline.data_max):
+            return False
+        pipeline.set_bounds(data_min, data_max)
+        return True
+
+    def _update_max_rating(self, rows, narrowing, old_ratings=None):
+        pipeline = self.pipeline
+        max_rating = max(pipeline.max_rating, float(self._ratings[rows].max())) if len(rows) else pipeline.max_rating
+        if narrowing and (old_ratings is None or (old_ratings == pipeline.max_rating).any()):
+            max_rating = float(self._ratings[:self._size].max())
+        pipeline.max_rating = max_rating
+
+    def _rate(self, rows):
+        pipeline = self.pipeline
+        return rate_foods(pipeline.normalize(self._nutrients[rows]), self._infant_foods[rows],
+                          self._group_codes[rows], pipeline.base_rating_terms, pipeline.category_ratings)
+
+    def _reserve(self, size):
+        capacity = self._nutrients.shape[0]
+        if size <= capacity:
+            return
+        capacity = max(size, 2 * capacity, 16)
+        self._nutrients = self._grow(self._nutrients, capacity)
+        self._group_codes = self._grow(self._group_codes, capacity, fill=-1)
+        self._infant_foods = self._grow(self._infant_foods, capacity)
+        self._ratings = self._grow(self._ratings, capacity)
+        self._scaled = self._grow(self._scaled, capacity)
+
+    def _grow(self, array, capacity, fill=0):
+        grown = np.full((capacity,) + array.shape[1:], fill, dtype=array.dtype,
+                        order='F' if array.ndim > 1 and array.flags.f_contiguous else 'C')
+        grown[:self._size] = array[:self._size]
+        return grown
@@ -0,0 +1,106 @@
+import threading
+from collections import OrderedDict
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls with the same key into one: the first caller
+    runs the function, callers arriving while it runs wait for it and get the
+    same result (or exception). Nothing is kept once the call finishes, that
+    is what PredictionCache is for.
+    """
+
+    def __init__(self):
+        self.executed = 0
+        self.collapsed = 0
+        self._calls = {}  # key -> _Call in flight
+        self._lock = threading.Lock()
+
+    def do(self, key, function):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executed += 1
+            else:
+                self.collapsed += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._calls),
+                'executed': self.executed,
+                'collapsed': self.collapsed,
+            }
+
+
+class LatestRequests:
+    """
+    "Latest request wins" tokens per client, e.g. a browser tab. A client
+    numbers its requests with increasing sequence numbers; a request is
+    superseded once the same client sent one with a higher number, so its
+    work can be skipped. Clients are keyed by (user id, client id): each one
+    seeds its numbers independently, so they are never compared across clients.
+    """
+
+    def __init__(self, max_clients=10000):
+        self.max_clients = max_clients
+        self.superseded = 0
+        self._latest = OrderedDict()  # (user_id, client_id) -> highest sequence number seen
+        self._lock = threading.Lock()
+
+    def begin(self, user_id, client_id, sequence):
+        """
+        Record a request. Returns False if it is already superseded.
+        """
+        key = (str(user_id), client_id)
+        with self._lock:
+            latest = self._latest.get(key)
+            if latest is not None and latest > sequence:
+                self.superseded += 1
+                return False
+            self._latest[key] = sequence
+            self._latest.move_to_end(key)
+            while len(self._latest) > self.max_clients:
+                self._latest.popitem(last=False)
+            return True
+
+    def is_superseded(self, user_id, client_id, sequence):
+        with self._lock:
+            latest = self._latest.get((str(user_id), client_id))
+            if latest is not None and latest > sequence:
+                self.superseded += 1
+                return True
+            return False
+
+    def stats(self):
+        with self._lock:
+            return {
+                'tracked_clients': len(self._latest),
+                'superseded': self.superseded,
+            }
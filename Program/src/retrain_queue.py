@@ -0,0 +1,87 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class RetrainQueue:
+    """
+    Runs per-user retrain jobs on a background thread pool and coalesces bursts.
+
+    There is at most one queued job per user. Submitting while that user's job
+    is still queued is a no-op, since the job reads the latest history when it
+    starts. Submitting while the job is running schedules exactly one more run
+    after it, so the last change is never missed.
+
+    When latency is given (a metrics Histogram with a 'result' label), each
+    job's time from queued to finished is observed in it, labelled completed
+    or failed.
+    """
+
+    def __init__(self, job, max_workers=2, latency=None):
+        self.job = job  # callable(user_id)
+        self.latency = latency
+        self.submitted = 0
+        self.coalesced = 0
+        self.completed = 0
+        self.failed = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='retrain')
+        self._lock = threading.Lock()
+        self._queued = {}  # user_id -> time the job was queued
+        self._running = set()
+        self._rerun = set()
+
+    def submit(self, user_id):
+        key = str(user_id)
+        with self._lock:
+            self.submitted += 1
+            if key in self._queued or key in self._rerun:
+                self.coalesced += 1
+                return
+            if key in self._running:
+                self.coalesced += 1
+                self._rerun.add(key)
+                return
+            self._enqueue(key)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'queue_depth': len(self._queued),
+                'running': len(self._running),
+                'submitted': self.submitted,
+                'coalesced': self.coalesced,
+                'completed': self.completed,
+                'failed': self.failed,
+            }
+
+    def _enqueue(self, key):
+        self._queued[key] = time.perf_counter()
+        self._executor.submit(self._run, key)
+
+    def _run(self, key):
+        with self._lock:
+            queued_at = self._queued.pop(key)
+            self._running.add(key)
+
+        try:
+            self.job(key)
+            succeeded = True
+        except Exception as e:
+            logger.error(f"Retrain job failed for user_id {key}. Error: {e}")
+            succeeded = False
+        finished_at = time.perf_counter()
+
+        with self._lock:
+            self._running.discard(key)
+            if succeeded:
+                self.completed += 1
+            else:
+                self.failed += 1
+            if key in self._rerun:
+                self._rerun.discard(key)
+                self._enqueue(key)
+        if self.latency is not None:
+            self.latency.observe(finished_at - queued_at, result='completed' if succeeded else 'failed')
@@ -0,0 +1,111 @@
+import numpy as np
+
+# Number of foods compared against the queries per block; bounds the distance matrix to queries x BLOCK_SIZE
+BLOCK_SIZE = 8192
+
+
+class SubstituteIndex:
+    """
+    Nearest-neighbour index over the normalized nutrient vectors of a
+    RatingStore, for finding healthier substitutes of a food.
+
+    Foods are compared by Euclidean distance between the 20 nutrient columns
+    as the rating pipeline normalizes them. The vectors are kept as one
+    float32 matrix with precomputed squared norms, and queries scan it in
+    blocks with one matrix product per block, so a batch of queries costs a
+    single pass over the table. After the store changes, pass the changed IDs
+    to update.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.rebuild()
+
+    def rebuild(self):
+        store = self.store
+        self._vectors = np.ascontiguousarray(store.normalized_nutrients(), dtype=np.float32)
+        self._norms = np.einsum('ij,ij->i', self._vectors, self._vectors)
+        self._group_codes = {}
+        self._groups = np.array([self._group_code(groups[0]) for groups in store.food_groups], dtype=np.int32)
+
+    def update(self, food_ids, full_rebuild=False):
+        """
+        Refresh the given foods. With full_rebuild (a normalization bound moved,
+        see RatingStore.add and update) every vector is recomputed.
+        """
+        store = self.store
+        if full_rebuild:
+            self.rebuild()
+            return
+
+        added = len(store) - len(self._vectors)
+        if added > 0:
+            self._vectors = np.concatenate([self._vectors, np.zeros((added, self._vectors.shape[1]), np.float32)])
+            self._norms = np.concatenate([self._norms, np.zeros(added, np.float32)])
+            self._groups = np.concatenate([self._groups, np.full(added, -1, np.int32)])
+
+        rows = np.array(sorted({store.row_of[str(food_id)] for food_id in food_ids}), dtype=np.intp)
+        if len(rows):
+            vectors = store.normalized_nutrients(rows).astype(np.float32)
+            self._vectors[rows] = vectors
+            self._norms[rows] = np.einsum('ij,ij->i', vectors, vectors)
+            self._groups[rows] = [self._group_code(store.food_groups[row][0]) for row in rows]
+
+    def substitutes(self, food_ids, k=5, same_group=False):
+        """
+        For each food, the k nearest foods with a higher scaled rating, nearest
+        first. With same_group, only foods with the same top predicted food
+        group are considered. Raises KeyError for an unknown food ID.
+
+        Returns:
+        - List (one per food ID) of lists of food dicts with a 'distance'.
+        """
+        store = self.store
+        rows = np.array([store.row_of[str(food_id)] for food_id in food_ids], dtype=np.intp)
+        ratings = np.asarray(store.scaled_ratings())
+        queries = self._vectors[rows]
+        query_norms = self._norms[rows]
+        query_ratings = ratings[rows][:, None]
+        query_groups = self._groups[rows][:, None]
+
+        best_distances = np.full((len(rows), k), np.inf, dtype=np.float32)
+        best_rows = np.full((len(rows), k), -1, dtype=np.intp)
+        for start in range(0, len(self._vectors), BLOCK_SIZE):
+            end = min(start + BLOCK_SIZE, len(self._vectors))
+
+            # Squared distances as |q|^2 + |x|^2 - 2 q.x, one matrix product per block
+            distances = query_norms[:, None] + self._norms[start:end] - 2 * (queries @ self._vectors[start:end].T)
+            eligible = ratings[start:end] > query_ratings
+            if same_group:
+                eligible &= (self._groups[start:end] == query_groups) & (query_groups >= 0)
+            distances[~eligible] = np.inf
+
+            # Keep the k best of the previous best and this block
+            candidates = np.concatenate([best_distances, distances], axis=1)
+            candidate_rows = np.concatenate(
+                [best_rows, np.broadcast_to(np.arange(start, end), distances.shape)], axis=1)
+            keep = np.argpartition(candidates, k - 1, axis=1)[:, :k]
+            best_distances = np.take_along_axis(candidates, keep, axis=1)
+            best_rows = np.take_along_axis(candidate_rows, keep, axis=1)
+
+        order = np.argsort(best_distances, axis=1, kind='stable')
+        best_distances = np.take_along_axis(best_distances, order, axis=1)
+        best_rows = np.take_along_axis(best_rows, order, axis=1)
+
+        results = []
+        for distances, found in zip(best_distances, best_rows):
+            results.append([
+                {
+                    'food_id': store.ids[row],
+                    'name': store.names[row],
+                    'food_groups': store.food_groups[row],
+                    'scaled_rating': float(ratings[row]),
+                    'distance': float(np.sqrt(max(distance, 0.0))),
+                }
+                for distance, row in zip(distances, found) if np.isfinite(distance)])
+        return results
+
+    def _group_code(self, group):
+        if not isinstance(group, str):
+            return -1
+        return self._group_codes.setdefault(group, len(self._group_codes))
@@ -0,0 +1,86 @@
+import itertools
+import os
+import shutil
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# The servers import their modules as top-level modules from src/
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SRC_DIR)
+
+from rating import FOOD_GROUP_COLUMNS, NUTRIENT_COLUMNS  # noqa: E402
+
+FOOD_GROUPS = ['Fruits', 'Vegetables', 'Snacks', 'Sweets', 'Meats', 'Baby Foods', 'Beverages', 'Unknown']
+NAME_WORDS = ['apple', 'bread', 'cheese', 'chicken', 'Infant formula', 'rice', 'candy', 'salmon']
+
+
+def write_food_data(path, size=300, seed=0):
+    """
+    Write a synthetic food_data.csv with the real file's columns, including
+    blank and non-numeric nutrients and infant foods. Returns the DataFrame.
+    """
+    rng = np.random.default_rng(seed)
+    food_data = pd.DataFrame({
+        'ID': np.arange(1000, 1000 + size),
+        'name': [f"{' '.join(rng.choice(NAME_WORDS, 2))} {i}" for i in range(size)],
+        'Food Group': rng.choice(FOOD_GROUPS, size),
+    })
+    for col in NUTRIENT_COLUMNS:
+        values = rng.gamma(1.0, 50, size).round(2).astype(object)
+        values[rng.random(size) < 0.05] = ''
+        values[rng.random(size) < 0.01] = 'NULL'
+        food_data[col] = values
+    food_data['Calories'] = rng.uniform(0, 900, size).round(1)
+    for col in FOOD_GROUP_COLUMNS:
+        food_data[col] = rng.choice(FOOD_GROUPS, size)
+    food_data.to_csv(path, index=False)
+    return food_data
+
+
+@pytest.fixture
+def food_data_csv(tmp_path):
+    path = str(tmp_path / 'food_data.csv')
+    write_food_data(path)
+    return path
+
+
+@pytest.fixture(scope='session')
+def grocery_server(tmp_path_factory):
+    """
+    The grocery server module, run from a temporary directory holding its
+    model bundle (built from data.csv), database and user data directory.
+    User model rebuilds are not queued.
+    """
+    work_dir = tmp_path_factory.mktemp('grocery_server')
+    shutil.copy(os.path.join(SRC_DIR, 'data.csv'), work_dir)
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.chdir(work_dir)
+        monkeypatch.setenv('GROCERY_DATABASE_URI', f"sqlite:///{work_dir / 'grocery.db'}")
+        from model import build_bundle
+        build_bundle()
+        import grocery_server
+        with grocery_server.app.app_context():
+            grocery_server.db.create_all()
+        # Background user model rebuilds would change user state under the tests
+        monkeypatch.setattr(grocery_server.retrain_queue, 'submit', lambda user_id: None)
+        yield grocery_server
+
+
+usernames = (f'user{n}' for n in itertools.count())
+
+
+@pytest.fixture
+def user(grocery_server):
+    """
+    A newly signed up user, as (user id, auth headers).
+    """
+    username = next(usernames)
+    response = grocery_server.app.test_client().post(
+        '/grocery/signup', json={'username': username, 'password': 'password'})
+    assert response.status_code == 201
+    with grocery_server.app.app_context():
+        user_id = grocery_server.User.query.filter_by(username=username).one().id
+    return user_id, {'Authorization': f"Bearer {response.json['access_token']}"}
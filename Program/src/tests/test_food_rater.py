@@ -0,0 +1,101 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import food_rater
+from food_table import load_food_table
+from rating import NUTRIENT_COLUMNS, load_or_fit_pipeline
+from rating_store import RatingStore
+
+TOKEN = 'test-token'
+AUTH = {'Authorization': f'Bearer {TOKEN}'}
+
+
+@pytest.fixture
+def client(tmp_path, food_data_csv, monkeypatch):
+    def build_rating_store(file_path):
+        food_table = load_food_table(file_path, str(tmp_path / 'food_table'))
+        return RatingStore.from_table(food_table, load_or_fit_pipeline(
+            food_table, pipeline_path=str(tmp_path / 'rating_pipeline.json')))
+
+    monkeypatch.setattr(food_rater, 'FOOD_DATA_PATH', food_data_csv)
+    monkeypatch.setattr(food_rater, 'build_rating_store', build_rating_store)
+    monkeypatch.setattr(food_rater, 'rating_store_mtime', None)
+    monkeypatch.setenv(food_rater.ADMIN_TOKEN_ENV, TOKEN)
+    return food_rater.app.test_client()
+
+
+def new_food(food_id, **fields):
+    food = {'ID': food_id, 'name': f'food {food_id}', 'Predicted Food Group 1': 'Fruits'}
+    food.update({col: 1.0 for col in NUTRIENT_COLUMNS})
+    food.update(fields)
+    return food
+
+
+def test_add_and_update_require_the_admin_token(client, monkeypatch):
+    for route in ('/add_foods', '/update_foods'):
+        assert client.post(route, json={'foods': [new_food(1)]}).status_code == 403
+        assert client.post(route, json={'foods': [new_food(1)]},
+                           headers={'Authorization': 'Bearer wrong'}).status_code == 403
+
+    monkeypatch.delenv(food_rater.ADMIN_TOKEN_ENV)
+    assert client.post('/add_foods', json={'foods': [new_food(1)]}, headers=AUTH).status_code == 403
+
+
+@pytest.mark.parametrize('route, payload', [
+    ('/add_foods', {'foods': {'ID': 1}}),
+    ('/add_foods', {'foods': [1, 2]}),
+    ('/add_foods', {'foods': []}),
+    ('/add_foods', [new_food(1)]),
+    ('/add_foods', {'foods': [{'ID': 1, 'Calories': 5}]}),
+    ('/add_foods', {'foods': [new_food(1, **{'Protein (g)': 'lots'})]}),
+    ('/add_foods', {'foods': [new_food(True)]}),
+    ('/update_foods', {'foods': 'everything'}),
+    ('/update_foods', {'foods': [{'Calories': 5}]}),
+    ('/update_foods', {'foods': [{'ID': '1000', 'Calories': None}]}),
+    ('/update_foods', {'foods': [{'ID': '1000', 'name': 7}]}),
+])
+def test_invalid_foods_are_rejected(client, route, payload):
+    response = client.post(route, json=payload, headers=AUTH)
+    assert response.status_code == 400
+    assert 'error' in response.json
+
+
+def test_add_and_update_match_a_full_refit(client, food_data_csv, tmp_path):
+    store = food_rater.get_rating_store()
+    protein_max_id = store.ids[int(np.argmax(store.normalized_nutrients()[:, NUTRIENT_COLUMNS.index('Protein (g)')]))]
+    added = [
+        new_food('2000'),
+        # Widens a bound, so every food is rescored
+        new_food('2001', name='Infant cereal', **{'Protein (g)': 10000.0}),
+    ]
+    updated = [
+        {'ID': '1003', 'Sugars (g)': 0.5, 'Predicted Food Group 2': 'Sweets'},
+        {'ID': '1004', 'name': 'Infant formula'},
+        # Moves the bound off the food that sat on it, so the column is rescanned
+        {'ID': '2001', 'Protein (g)': 2.0},
+        {'ID': protein_max_id, 'Protein (g)': 0.0},
+    ]
+
+    response = client.post('/add_foods', json={'foods': added}, headers=AUTH)
+    assert response.status_code == 200 and response.json['full_rebuild']
+    response = client.post('/update_foods', json={'foods': updated}, headers=AUTH)
+    assert response.status_code == 200
+
+    # The same changes applied to the CSV and rated from scratch
+    food_data = pd.read_csv(food_data_csv, dtype=object, keep_default_na=False)
+    food_data = pd.concat([food_data, pd.DataFrame(added).astype(object)], ignore_index=True)
+    food_data = food_data.set_index('ID')
+    for food in updated:
+        for col, value in food.items():
+            if col != 'ID':
+                food_data.loc[food['ID'], col] = value
+    refit_csv = str(tmp_path / 'refit.csv')
+    food_data.reset_index().to_csv(refit_csv, index=False)
+    expected = food_rater.process_food_data(refit_csv, str(tmp_path / 'refit_table'),
+                                            str(tmp_path / 'refit_pipeline.json'))
+
+    assert len(store) == len(expected)
+    for food_id, scaled_rating in zip(expected['ID'].astype(str), expected['Scaled Rating']):
+        assert store.get(food_id) == scaled_rating
+        assert client.get('/get_food_rating', query_string={'food_id': food_id}).json['scaled_rating'] == scaled_rating
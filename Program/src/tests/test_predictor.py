@@ -0,0 +1,39 @@
+import pytest
+
+import predictor
+
+from conftest import write_food_data
+
+# The classification report of a model trained on random names has empty classes
+pytestmark = pytest.mark.filterwarnings('ignore::sklearn.exceptions.UndefinedMetricWarning')
+
+
+@pytest.fixture
+def trained_models(tmp_path, monkeypatch):
+    """
+    Pickled and compact food group models trained on a synthetic food_data.csv,
+    in a temporary working directory. Returns the CSV path.
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(predictor, 'default_predictor', None)
+    food_data_csv = str(tmp_path / 'food_data.csv')
+    write_food_data(food_data_csv)
+    predictor.train_and_save_model(food_data_csv)
+    predictor.train_and_save_model(food_data_csv, compact=True)
+    return food_data_csv
+
+
+def test_compact_model_is_used_while_current(trained_models):
+    assert predictor.get_predictor(trained_models).vectorizer is None
+
+
+def test_stale_compact_model_falls_back_to_the_full_pipeline(trained_models):
+    write_food_data(trained_models, seed=1)
+    assert predictor.get_predictor(trained_models).vectorizer is not None
+
+
+def test_compact_model_without_a_data_hash_is_stale(trained_models):
+    model = predictor.CompactTextClassifier.load(predictor.COMPACT_MODEL_PATH)
+    model.data_hash = None
+    model.save(predictor.COMPACT_MODEL_PATH)
+    assert predictor.get_predictor(trained_models).vectorizer is not None
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+from sklearn.preprocessing import MinMaxScaler
+
+from food_rater import process_food_data
+from rating import NUTRIENT_COLUMNS, rate_food, read_food_data
+
+from conftest import write_food_data
+
+
+def baseline_ratings(file_path):
+    """
+    Ratings and scaled ratings as process_food_data computed them before it
+    was vectorized: MinMaxScaler, then rate_food row by row.
+    """
+    food_data = read_food_data(file_path)
+    normalized_nutrients = MinMaxScaler(feature_range=(0, 10)).fit_transform(food_data[NUTRIENT_COLUMNS])
+    ratings = np.array([
+        rate_food(profile, food_name, group1, group2, group3)
+        for profile, food_name, group1, group2, group3 in zip(
+            normalized_nutrients, food_data['name'], food_data['Predicted Food Group 1'],
+            food_data['Predicted Food Group 2'], food_data['Predicted Food Group 3'])
+    ])
+    return ratings, ratings / ratings.max() * 10
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_ratings_match_the_row_by_row_baseline(tmp_path, seed):
+    food_data_csv = str(tmp_path / 'food_data.csv')
+    write_food_data(food_data_csv, seed=seed)
+    ratings, scaled_ratings = baseline_ratings(food_data_csv)
+
+    # The first call fits and saves the rating pipeline, the second loads it
+    for _ in range(2):
+        food_data = process_food_data(food_data_csv, str(tmp_path / 'food_table'),
+                                      str(tmp_path / 'rating_pipeline.json'))
+        assert np.array_equal(food_data['Rating'].to_numpy(), ratings)
+        assert np.array_equal(food_data['Scaled Rating'].to_numpy(), scaled_ratings)
@@ -0,0 +1,118 @@
+import pytest
+
+
+def item(item_id, name, category='Produce', checked=False):
+    return {'id': item_id, 'name': name, 'category': category, 'checked': checked}
+
+
+@pytest.fixture
+def client(grocery_server, user):
+    _, headers = user
+    client = grocery_server.app.test_client()
+
+    def sync(base_revision, operations, expected_status=200):
+        response = client.post('/grocery/sync', json={'baseRevision': base_revision, 'operations': operations},
+                               headers=headers)
+        assert response.status_code == expected_status, response.json
+        return response.json
+
+    def load(since=None, expected_status=200):
+        response = client.get('/grocery/loadUserData', query_string={} if since is None else {'since': since},
+                              headers=headers)
+        assert response.status_code == expected_status, response.json
+        return response.json
+
+    client.sync, client.load = sync, load
+    return client
+
+
+def test_sync_round_trips_deltas_and_tombstones(client):
+    base = client.load()['revision']
+
+    # Client A adds items, usage and history; the response carries its own changes
+    first = client.sync(base, [
+        {'type': 'putItem', 'item': item(1, 'apples')},
+        {'type': 'putItem', 'item': item(2, 'milk', 'Dairy')},
+        {'type': 'putItem', 'item': item(3, 'bread', 'Bakery')},
+        {'type': 'incrementCategoryUsage', 'category': 'Dairy', 'by': 2},
+        {'type': 'putHistory', 'item': 'Milk', 'category': 'Dairy'},
+    ])
+    assert first['revision'] == base + 1 and first['rejected'] == []
+    changes = first['changes']
+    assert changes['items'] == {'upserted': [item(1, 'apples'), item(2, 'milk', 'Dairy'), item(3, 'bread', 'Bakery')],
+                                'removed': []}
+    assert changes['categoryUsage'] == {'upserted': {'Dairy': 2}, 'removed': []}
+    assert changes['userHistory'] == {'upserted': [{'item': 'milk', 'category': 'Dairy'}], 'removed': []}
+
+    # Client B, at A's revision, checks an item, removes one and the history entry
+    second = client.sync(first['revision'], [
+        {'type': 'putItem', 'item': item(1, 'apples', checked=True)},
+        {'type': 'removeItem', 'id': 2},
+        {'type': 'removeHistory', 'item': 'milk'},
+        {'type': 'incrementCategoryUsage', 'category': 'Dairy'},
+    ])
+    assert second['revision'] == first['revision'] + 1
+
+    # A catches up with only B's changes, removals as tombstones
+    for changes in (second['changes'], client.load(since=first['revision'])['changes']):
+        assert changes['items'] == {'upserted': [item(1, 'apples', checked=True)], 'removed': ['2']}
+        assert changes['categories'] == {'upserted': [], 'removed': []}
+        assert changes['categoryUsage'] == {'upserted': {'Dairy': 3}, 'removed': []}
+        assert changes['userHistory'] == {'upserted': [], 'removed': ['milk']}
+
+    # A removed item added again is reported both removed and upserted since before its removal
+    third = client.sync(second['revision'], [{'type': 'putItem', 'item': item(2, 'oat milk', 'Dairy')}])
+    changes = client.load(since=first['revision'])['changes']
+    assert changes['items']['removed'] == ['2']
+    assert item(2, 'oat milk', 'Dairy') in changes['items']['upserted']
+
+    # Nothing changed since the latest revision, and the full state matches the deltas
+    assert client.load(since=third['revision'])['changes']['items'] == {'upserted': [], 'removed': []}
+    state = client.load()
+    assert state['revision'] == third['revision']
+    assert state['items'] == [item(1, 'apples', checked=True), item(3, 'bread', 'Bakery'),
+                              item(2, 'oat milk', 'Dairy')]
+    assert state['categoryUsage'] == {'Dairy': 3}
+    assert state['userHistory'] == []
+
+
+def test_sync_from_a_stale_or_unknown_revision_is_rejected(grocery_server, client, monkeypatch):
+    monkeypatch.setattr(grocery_server, 'SYNC_HISTORY_REVISIONS', 2)
+    base = client.load()['revision']
+    revision = base
+    for n in range(3):
+        revision = client.sync(revision, [{'type': 'putItem', 'item': item(n, f'item {n}')}])['revision']
+
+    for stale_or_ahead in (base, revision + 1):
+        rejected = client.sync(stale_or_ahead, [{'type': 'putItem', 'item': item(9, 'lost')}], expected_status=409)
+        assert rejected['revision'] == revision
+        assert client.load(since=stale_or_ahead, expected_status=409)['revision'] == revision
+
+    # Nothing from the rejected syncs was applied, and the oldest revision still kept syncs
+    state = client.load()
+    assert state['revision'] == revision
+    assert [entry['id'] for entry in state['items']] == [0, 1, 2]
+    assert client.sync(revision - 2, [])['changes']['items']['upserted'] == [item(1, 'item 1'), item(2, 'item 2')]
+
+
+def test_invalid_sync_operations_are_rejected_individually(client):
+    base = client.load()['revision']
+    response = client.sync(base, [
+        {'type': 'putItem', 'item': item(1, 'apples')},
+        {'type': 'putItem', 'item': item(2, '  ')},
+        {'type': 'dropEverything'},
+        {'type': 'incrementCategoryUsage', 'category': 'Produce', 'by': '5'},
+        {'type': 'removeItem', 'id': 1},
+        {'type': 'putItem', 'item': item(3, 'pears')},
+        {'type': 'incrementCategoryUsage', 'category': 'Produce', 'by': -3},
+    ])
+    assert [(entry['index'], entry['type']) for entry in response['rejected']] == [
+        (1, 'putItem'), (2, 'unknown'), (3, 'incrementCategoryUsage'), (6, 'incrementCategoryUsage')]
+    assert response['changes']['items'] == {'upserted': [item(3, 'pears')], 'removed': []}
+    assert response['changes']['categoryUsage'] == {'upserted': {}, 'removed': []}
+
+    # A sync with only invalid operations saves nothing
+    revision = response['revision']
+    response = client.sync(revision, [{'type': 'removeCategory'}])
+    assert len(response['rejected']) == 1
+    assert response['revision'] == client.load()['revision'] == revision
@@ -0,0 +1,114 @@
+import threading
+
+import pytest
+
+WORKERS = 8
+ITEMS_PER_WORKER = 10
+
+
+def run_workers(grocery_server, user_id, hold_user_lock):
+    """
+    Have WORKERS threads each add ITEMS_PER_WORKER history items with
+    update_user_data, one save per item. Returns the items saved and the
+    number of saves that gave up with UserStateConflict.
+    """
+    saved, conflicts = [], []
+
+    def add_items(worker):
+        with grocery_server.app.app_context():
+            for n in range(ITEMS_PER_WORKER):
+                item = f'item {worker} {n}'
+
+                def add_item(user_data):
+                    user_data['history'][item] = 'Snacks'
+
+                try:
+                    if hold_user_lock:
+                        with grocery_server.user_lock(user_id):
+                            grocery_server.update_user_data(user_id, add_item)
+                    else:
+                        grocery_server.update_user_data(user_id, add_item)
+                    saved.append(item)
+                except grocery_server.UserStateConflict:
+                    conflicts.append(item)
+
+    threads = [threading.Thread(target=add_items, args=(worker,)) for worker in range(WORKERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return saved, conflicts
+
+
+def stored_history(grocery_server, user_id):
+    """
+    The user's history and revision as stored in the database, bypassing the user data cache.
+    """
+    grocery_server.user_data_cache.invalidate(user_id)
+    with grocery_server.app.app_context():
+        user_data = grocery_server.load_user_data(user_id)
+    return user_data['history'], user_data['revision']
+
+
+def test_concurrent_updates_under_the_user_lock_lose_no_history_rows(grocery_server, user):
+    user_id, _ = user
+    _, revision = stored_history(grocery_server, user_id)
+
+    saved, conflicts = run_workers(grocery_server, user_id, hold_user_lock=True)
+
+    history, new_revision = stored_history(grocery_server, user_id)
+    assert not conflicts
+    assert sorted(history) == sorted(saved)
+    assert len(saved) == WORKERS * ITEMS_PER_WORKER
+    assert new_revision == revision + len(saved)
+
+
+@pytest.mark.parametrize('attempts', [1, 5])
+def test_concurrent_updates_from_separate_workers_lose_no_history_rows(grocery_server, user, monkeypatch, attempts):
+    # Without the in-process lock, as from separate worker processes, only the
+    # revision compare-and-swap keeps updates from overwriting each other
+    monkeypatch.setattr(grocery_server, 'USER_STATE_SAVE_ATTEMPTS', attempts)
+    user_id, _ = user
+    _, revision = stored_history(grocery_server, user_id)
+
+    saved, conflicts = run_workers(grocery_server, user_id, hold_user_lock=False)
+
+    history, new_revision = stored_history(grocery_server, user_id)
+    assert saved
+    assert sorted(history) == sorted(saved)
+    assert new_revision == revision + len(saved)
+
+
+def test_learning_on_a_model_copy_leaves_the_original_unchanged(grocery_server):
+    model = grocery_server.new_user_model()
+    model.learn('oat milk', 'Dairy & Eggs')
+    weights = {feature: dict(class_weights) for feature, class_weights in model.weights.items()}
+
+    copy = model.copy()
+    copy.learn('oat milk', 'Beverages')
+    copy.learn('dog treats', 'Pet Supplies')
+
+    assert model.weights == weights
+    assert copy.weights != weights
+
+
+def test_save_item_stores_the_same_state_it_caches(grocery_server, user):
+    user_id, headers = user
+    client = grocery_server.app.test_client()
+    history = {f'pantry item {n}': 'Pantry' for n in range(50)}
+    response = client.post('/grocery/saveState', json={'userHistory': [
+        {'item': item, 'category': category} for item, category in history.items()]}, headers=headers)
+    assert response.status_code == 200
+
+    for item, category in [('oat milk', 'Dairy & Eggs'), ('Dog Treats', 'Pet Supplies'), ('oat milk', 'Beverages')]:
+        assert client.post('/grocery/saveItem', json={'itemName': item, 'category': category},
+                           headers=headers).status_code == 200
+        history[item.lower()] = category
+
+    with grocery_server.app.app_context():
+        cached = grocery_server.load_user_data(user_id)
+    stored, _ = stored_history(grocery_server, user_id)
+    with grocery_server.app.app_context():
+        stored_model = grocery_server.load_user_data(user_id)['model']
+    assert cached['history'] == stored == history
+    assert stored_model.weights == cached['model'].weights
@@ -0,0 +1,75 @@
+import threading
+from collections import OrderedDict
+
+
+class UserDataCache:
+    """
+    Bounded in-process LRU cache of deserialized user data, keyed by user id.
+
+    Each entry remembers its approximate size in bytes and the version of the
+    stored user data it was read from (e.g. a revision number). The size is
+    used as the entry's byte cost, and the version lets callers detect data
+    rewritten by another worker.
+    Least recently used entries are evicted once either the entry count or
+    the total byte cost goes over its limit.
+    """
+
+    def __init__(self, max_entries=256, max_bytes=256 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # user_id -> (user_data, size, version)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, user_id, version=None):
+        """
+        Return the cached user data, or None on a miss.
+        If version is given, an entry read from another version of the data is a miss.
+        """
+        key = str(user_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or (version is not None and entry[2] != version):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, user_id, user_data, size, version=None):
+        """
+        Insert or replace the cached user data, then evict down to the limits.
+        """
+        key = str(user_id)
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = (user_data, size, version)
+            self._bytes += size
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._discard(str(user_id))
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+            }
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]